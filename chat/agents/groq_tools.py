@@ -0,0 +1,202 @@
+import os
+import asyncio
+import json
+import logging
+from decimal import Decimal
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from database_connection.wine_queries import search_user_wines, get_user_wine_notes
+from database_connection.user_stats import get_user_stats
+from chat.history import compact_history
+from .microagent import Agent, function_to_json
+from .groq_triage import CHAT_MODEL, CHAT_TIMEOUT, clean_history, stream_completion, summarize_conversation
+
+# Sommelier that looks up what it needs through tools instead of getting the whole collection
+# in its prompt, so the prompt stays the same size however large the cellar grows.
+TOOL_MODEL = os.getenv("SOMMELIER_TOOL_MODEL", CHAT_MODEL)
+# Rounds of tool calls before the model has to answer with what it has
+MAX_TOOL_ROUNDS = int(os.getenv("SOMMELIER_MAX_TOOL_ROUNDS", "3"))
+# Upper bound on the rows one tool call returns
+MAX_TOOL_ROWS = 25
+# Entries per breakdown in get_stats
+STATS_TOP_N = 10
+
+tool_stats: Dict[str, int] = {
+    "replies": 0,
+    "tool_rounds": 0,
+    "tool_calls": 0,
+    "tool_errors": 0,
+}
+
+def _limit(limit: Optional[int]) -> int:
+    return max(1, min(int(limit or 10), MAX_TOOL_ROWS))
+
+async def search_wines(
+    context_variables: Dict[str, Any],
+    query: Optional[str] = None,
+    country: Optional[str] = None,
+    grape: Optional[str] = None,
+    max_price: Optional[float] = None,
+    year: Optional[int] = None,
+    limit: int = 10,
+) -> List[Dict[str, Any]]:
+    """
+    Search the user's wine collection, most expensive first.
+    query: words that must all appear in the wine's name, producer, grapes, country or region.
+    country: country name. grape: grape variety. max_price: highest price per bottle.
+    year: vintage. limit: number of wines to return (at most 25).
+    """
+    return await search_user_wines(
+        context_variables["user_id"],
+        terms=(query or "").split(),
+        country=country or None,
+        grape=grape or None,
+        max_price=Decimal(str(max_price)) if max_price is not None else None,
+        year=int(year) if year else None,
+        limit=_limit(limit),
+    )
+
+async def get_stats(context_variables: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Statistics of the user's whole collection: bottle and wine counts, total and average
+    value, the most expensive wine, and the top countries, regions, grapes, producers and
+    vintages.
+    """
+    stats = await get_user_stats(context_variables["user_id"])
+    if "error" in stats:
+        return {"error": "No wines found in collection"}
+
+    def top(mapping: Dict[Any, Any]) -> Dict[Any, Any]:
+        return dict(list(mapping.items())[:STATS_TOP_N])
+
+    return {
+        "total_bottles": stats["total_bottles"],
+        "total_unique_wines": stats["total_unique_wines"],
+        "total_value": stats["total_value"],
+        "average_bottle_value": stats["average_bottle_value"],
+        "most_expensive": stats["most_expensive"],
+        "value_by_country": top(stats["value_by_country"]),
+        "value_by_region": top(stats["value_by_region"]),
+        "value_by_grape": top(stats["value_by_grape"]),
+        "value_by_producer": top(stats["value_by_producer"]),
+        "bottles_by_country": dict(stats["countries"].most_common(STATS_TOP_N)),
+        "bottles_by_year": dict(stats["years"].most_common(STATS_TOP_N)),
+    }
+
+async def get_notes(context_variables: Dict[str, Any], wine: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    The user's own tasting notes, newest first.
+    wine: only notes on wines whose name or producer contains this.
+    limit: number of notes to return (at most 25).
+    """
+    return await get_user_wine_notes(context_variables["user_id"], wine or None, _limit(limit))
+
+SOMMELIER = Agent(
+    name="Sommelier",
+    model=TOOL_MODEL,
+    functions=[search_wines, get_stats, get_notes],
+    instructions="""You are a knowledgeable wine sommelier. Your responsibilities include:
+    - Answering questions about wines in the user's collection
+    - Providing wine pairing recommendations
+    - Sharing insights about wine regions, vintages, and varietals
+
+    You don't know the user's collection up front: use the tools to look up the wines, statistics
+    and tasting notes you need, and request independent lookups together. Only mention wines the
+    tools returned. If asked about wines not in the collection, provide general expert advice.
+
+    Be concise but informative in your responses. Do not ask questions.
+    Use the conversation history to remember details the user has shared.""",
+)
+
+TOOLS = {function.__name__: function for function in SOMMELIER.functions}
+TOOL_SCHEMAS = [function_to_json(function) for function in SOMMELIER.functions]
+
+async def _run_tool(tool_call: Dict[str, Any], context_variables: Dict[str, Any]) -> Dict[str, Any]:
+    """Execute one tool call; failures are reported to the model rather than raised."""
+    name = tool_call["function"]["name"]
+    tool_stats["tool_calls"] += 1
+    try:
+        if name not in TOOLS:
+            raise ValueError("unknown tool")
+        arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        result = await TOOLS[name](context_variables, **arguments)
+        content = json.dumps(result, default=str)
+    except Exception as e:
+        tool_stats["tool_errors"] += 1
+        logging.warning(f"Sommelier tool {name} failed: {str(e)}")
+        content = json.dumps({"error": f"{name} failed: {str(e)}"})
+    return {"role": "tool", "tool_call_id": tool_call["id"], "name": name, "content": content}
+
+async def stream_tool_agent_response(
+    message: str,
+    user_id: int,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Yield the sommelier's reply token by token, letting the model query the collection.
+
+    Each round streams one completion; when it ends in tool calls, they run concurrently
+    and their results go back to the model for the next round. Raises asyncio.TimeoutError
+    once the reply, tool calls included, takes longer than GROQ_CHAT_TIMEOUT.
+    """
+    history_summary, recent_turns = await compact_history(clean_history(history), summarize_conversation)
+
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": SOMMELIER.instructions}]
+    if history_summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{history_summary}"
+        })
+    messages.extend(recent_turns)
+    messages.append({"role": "user", "content": message})
+
+    # Tools are scoped to this user; the model never chooses whose data it reads
+    context_variables = {"user_id": user_id}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TIMEOUT
+    tool_stats["replies"] += 1
+
+    for round_number in range(MAX_TOOL_ROUNDS + 1):
+        content = ""
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        async for chunk in stream_completion(
+            deadline,
+            messages=messages,
+            model=SOMMELIER.model,
+            tools=TOOL_SCHEMAS,
+            # The last round has to answer with what has been looked up so far
+            tool_choice="auto" if round_number < MAX_TOOL_ROUNDS else "none",
+            parallel_tool_calls=SOMMELIER.parallel_tool_calls,
+            temperature=0.5,
+            max_tokens=700,
+        ):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content += delta.content
+                yield delta.content
+            for call in delta.tool_calls or []:
+                entry = tool_calls.setdefault(
+                    call.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}
+                )
+                if call.id:
+                    entry["id"] = call.id
+                if call.function and call.function.name:
+                    entry["function"]["name"] += call.function.name
+                if call.function and call.function.arguments:
+                    entry["function"]["arguments"] += call.function.arguments
+
+        if not tool_calls:
+            return
+
+        tool_stats["tool_rounds"] += 1
+        calls = [tool_calls[index] for index in sorted(tool_calls)]
+        messages.append({"role": "assistant", "content": content or None, "tool_calls": calls})
+        results = await asyncio.wait_for(
+            asyncio.gather(*(_run_tool(call, context_variables) for call in calls)),
+            timeout=max(deadline - loop.time(), 0)
+        )
+        messages.extend(results)
+
+def get_tool_stats() -> Dict[str, Any]:
+    return {**tool_stats, "model": SOMMELIER.model, "max_tool_rounds": MAX_TOOL_ROUNDS}
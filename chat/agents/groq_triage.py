@@ -1,8 +1,14 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-from groq import Groq
-from typing import List, Dict, Optional
-from database_connection.wine_queries import get_user_wine_collection, analyze_wine_collection
+from groq import AsyncGroq
+from typing import Any, AsyncGenerator, List, Dict, Optional
+from database_connection.wine_queries import get_user_wine_collection
+from database_connection.user_stats import get_user_stats
+from chat.context_cache import cached_collection_context
+from chat.retrieval import BM25Index, select_documents
+from chat.history import compact_history
+from llm_gateway import call_with_retries, chat_completion, llm_slot
 from decimal import Decimal
 
 # Load environment variables
@@ -12,19 +18,47 @@ os.environ['GROQ_API_KEY'] = os.getenv('GROQ_API_KEY')
 if "GROQ_API_KEY" not in os.environ:
     raise ValueError("GROQ_API_KEY environment variable is not set")
 
-# Initialize Groq client
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# Upper bound in seconds for one reply, from the request until the last token
+CHAT_TIMEOUT = float(os.getenv("GROQ_CHAT_TIMEOUT", "60"))
 
-async def get_wine_collection_summary(user_id: int) -> str:
-    """Create a summary of the user's wine collection for the agent's context."""
-    wines = await get_user_wine_collection(user_id)
-    if not wines:
-        return "No wines found in collection."
-    
-    # Get analytics
-    stats = await analyze_wine_collection(wines)
+# Length limits for the summaries that replace old conversation turns
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_SUMMARY_MAX_TOKENS", "300"))
+HISTORY_SUMMARY_TURN_CHARS = 2000
+
+#CHAT_MODEL = "llama-3.1-70b-versatile"
+CHAT_MODEL = "llama-3.1-8b-instant"
+
+# Initialize Groq client; retries are handled by the LLM gateway
+client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"), timeout=CHAT_TIMEOUT, max_retries=0)
+
+async def get_wine_collection_summary(user_id: int, query: str = "") -> str:
+    """
+    Summary of the user's wine collection for the agent's context.
+
+    Always carries the collection-wide analytics; the individual wines are the ones most
+    relevant to query, within CHAT_RETRIEVAL_TOP_K and CHAT_CONTEXT_TOKEN_BUDGET.
+    """
+    context = await cached_collection_context(user_id, build_collection_context)
+    if not context["wines"]:
+        return context["header"]
+
+    selected = select_documents(context["wines"], context["index"], query)
+    summary = context["header"]
+    if len(selected) < len(context["wines"]):
+        summary += f"(showing the {len(selected)} of {len(context['wines'])} wines most relevant to the question)\n"
+    return summary + "".join(context["wines"][i] for i in selected)
+
+async def build_collection_context(user_id: int) -> Dict[str, Any]:
+    """Render the collection analytics and one entry per wine, plus a search index over the entries."""
+    # Analytics are aggregated in PostgreSQL alongside the wine list fetch
+    wines, stats = await asyncio.gather(
+        get_user_wine_collection(user_id),
+        get_user_stats(user_id),
+    )
+    if not wines or "error" in stats:
+        return {"header": "No wines found in collection.", "wines": [], "index": None}
     
-    summary = f"""Wine Collection Summary:
+    header = f"""Wine Collection Summary:
 Total bottles: {stats['total_bottles']}
 Unique wines: {stats['total_unique_wines']}
 Total collection value: ${stats['total_value']:,.2f}
@@ -45,31 +79,77 @@ Bottles by country:
 Individual Wines:
 """
     
+    entries = []
     for wine in wines:
         wine_value = Decimal(str(wine['price'])) * Decimal(str(wine['quantity']))
-        summary += f"- {wine['wine_name']} ({wine['year']}) by {wine['producer']}\n"
-        summary += f"  Region: {wine['country']}, {wine['region']}\n"
-        summary += f"  Grapes: {wine['grapes']}\n"
-        summary += f"  Quantity: {wine['quantity']} x {wine['bottle_size']}\n"
-        summary += f"  Value: ${wine_value:,.2f} (${wine['price']:,.2f} per bottle)\n"
+        entry = f"- {wine['wine_name']} ({wine['year']}) by {wine['producer']}\n"
+        entry += f"  Region: {wine['country']}, {wine['region']}\n"
+        entry += f"  Grapes: {wine['grapes']}\n"
+        entry += f"  Quantity: {wine['quantity']} x {wine['bottle_size']}\n"
+        entry += f"  Value: ${wine_value:,.2f} (${wine['price']:,.2f} per bottle)\n"
         if wine['note_text']:
-            summary += f"  Notes: {wine['note_text']}\n"
-        summary += "\n"
+            entry += f"  Notes: {wine['note_text']}\n"
+        entry += "\n"
+        entries.append(entry)
     
-    return summary
+    return {"header": header, "wines": entries, "index": BM25Index(entries)}
 
-async def get_agent_response(
+async def summarize_conversation(previous_summary: str, turns: List[Dict[str, str]]) -> str:
+    """Extend a conversation summary with more turns; used to compact long histories."""
+    transcript = "\n".join(
+        f"{turn['role']}: {turn['content'][:HISTORY_SUMMARY_TURN_CHARS]}" for turn in turns
+    )
+    completion = await chat_completion(
+        client,
+        messages=[
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a conversation between a user and a wine sommelier. "
+                           "Merge the new turns into the existing summary. Keep facts the user shared "
+                           "(preferences, occasions, dishes, wines discussed) and recommendations given. "
+                           "Reply with the summary only, in at most a few short paragraphs."
+            },
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+            }
+        ],
+        model=CHAT_MODEL,
+        temperature=0.2,
+        max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+    )
+    return completion.choices[0].message.content.strip()
+
+def clean_history(history: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """User and assistant turns with content, stripped of anything else the client sent."""
+    turns = []
+    for turn in history or []:
+        role = turn.get("role")
+        content = (turn.get("content") or "").strip()
+        if role in ("user", "assistant") and content:
+            turns.append({"role": role, "content": content})
+    return turns
+
+async def build_messages(
     message: str,
     user_id: int,
     history: Optional[List[Dict[str, str]]] = None,
-) -> List[str]:
+) -> List[Dict[str, str]]:
     """
-    Get response from Groq about the user's wine collection.
+    Build the sommelier prompt: system prompt with the user's collection, prior turns, message.
 
     history: prior turns as [{role: "user"|"assistant", content: str}, ...]
     (does not include the current message).
     """
-    wine_collection = await get_wine_collection_summary(user_id)
+    turns = clean_history(history)
+
+    # Follow-up questions often only make sense together with the previous one
+    previous = [turn["content"] for turn in turns if turn["role"] == "user"]
+    query = " ".join(previous[-1:] + [message])
+    wine_collection, (history_summary, recent_turns) = await asyncio.gather(
+        get_wine_collection_summary(user_id, query),
+        compact_history(turns, summarize_conversation),
+    )
 
     system_prompt = f"""You are a knowledgeable wine sommelier. Your responsibilities include:
     - Answering questions about wines in the user's collection
@@ -89,36 +169,92 @@ Here is the user's current wine collection:
 
     messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
 
-    for turn in history or []:
-        role = turn.get("role")
-        content = (turn.get("content") or "").strip()
-        if role in ("user", "assistant") and content:
-            messages.append({"role": role, "content": content})
+    if history_summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{history_summary}"
+        })
+    messages.extend(recent_turns)
 
     messages.append({"role": "user", "content": message})
+    return messages
 
-    completion = client.chat.completions.create(
+async def stream_completion(deadline: float, **kwargs) -> AsyncGenerator[Any, None]:
+    """
+    Yield the chunks of one streamed Groq chat completion.
+
+    deadline is in event loop time; asyncio.TimeoutError is raised once it passes. The
+    provider stream is closed on timeout and when the consumer stops early or is cancelled,
+    e.g. because the client disconnected.
+    """
+    loop = asyncio.get_running_loop()
+    model = kwargs["model"]
+
+    # The slot is held until the stream is finished, so it caps concurrent generations
+    async with llm_slot("groq", model):
+        completion = await asyncio.wait_for(
+            call_with_retries("groq", model, lambda: client.chat.completions.create(stream=True, **kwargs)),
+            timeout=max(deadline - loop.time(), 0)
+        )
+
+        stream = completion.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        stream.__anext__(), timeout=max(deadline - loop.time(), 0)
+                    )
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            await completion.close()
+
+async def stream_agent_response(
+    message: str,
+    user_id: int,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Yield the sommelier's reply token by token as Groq delivers it.
+
+    Raises asyncio.TimeoutError once the reply takes longer than GROQ_CHAT_TIMEOUT.
+    """
+    messages = await build_messages(message, user_id, history)
+    deadline = asyncio.get_running_loop().time() + CHAT_TIMEOUT
+
+    async for chunk in stream_completion(
+        deadline,
         messages=messages,
-        #model="llama-3.1-70b-versatile",
-        model="llama-3.1-8b-instant",
+        model=CHAT_MODEL,
         temperature=0.5, # 0.7
         max_tokens=700, # 1000
         top_p=1,
-        stream=True
-    )
-    
-    # Process the streaming response
+    ):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def get_agent_response(
+    message: str,
+    user_id: int,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> List[str]:
+    """
+    Get response from Groq about the user's wine collection, collected into chunks.
+
+    history: prior turns as [{role: "user"|"assistant", content: str}, ...]
+    (does not include the current message).
+    """
     chunks = []
     current_chunk = ""
     
-    for chunk in completion:
-        if chunk.choices[0].delta.content:
-            current_chunk += chunk.choices[0].delta.content
-            if len(current_chunk) >= 80:  # Send chunks of reasonable size
-                chunks.append(current_chunk)
-                current_chunk = ""
+    async for token in stream_agent_response(message, user_id, history):
+        current_chunk += token
+        if len(current_chunk) >= 80:  # Send chunks of reasonable size
+            chunks.append(current_chunk)
+            current_chunk = ""
     
     if current_chunk:  # Don't forget the last chunk
         chunks.append(current_chunk)
         
-    return chunks
\ No newline at end of file
+    return chunks
@@ -1,15 +1,15 @@
-from .openai_client import OpenAIClient
-from .anthropic_client import AnthropicClient
-from .groq_client import GroqClient
-
 class LLMFactory:
     @staticmethod
     def create(llm_type):
+        # Provider SDKs are imported on first use, so importing the package only loads the one in use
         if llm_type == 'openai':
+            from .openai_client import OpenAIClient
             return OpenAIClient()
         elif llm_type == 'anthropic':
+            from .anthropic_client import AnthropicClient
             return AnthropicClient()
         elif llm_type == 'groq':
+            from .groq_client import GroqClient
             return GroqClient()
         else:
-            raise ValueError(f"Unsupported LLM type: {llm_type}")
\ No newline at end of file
+            raise ValueError(f"Unsupported LLM type: {llm_type}")
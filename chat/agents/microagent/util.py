@@ -1,6 +1,9 @@
 import inspect
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Union, get_args, get_origin
+
+# Injected by the caller at run time, so never shown to the model
+CONTEXT_VARIABLES = "context_variables"
 
 def debug_print(debug: bool, *args: str) -> None:
     if not debug:
@@ -56,8 +59,14 @@ def function_to_json(func) -> dict:
 
     parameters = {}
     for param in signature.parameters.values():
+        if param.name == CONTEXT_VARIABLES:
+            continue
+        annotation = param.annotation
+        if get_origin(annotation) is Union:
+            # Optional[int] is described as an integer
+            annotation = next((arg for arg in get_args(annotation) if arg is not type(None)), annotation)
         try:
-            param_type = type_map.get(param.annotation, "string")
+            param_type = type_map.get(annotation, "string")
         except KeyError as e:
             raise KeyError(
                 f"Unknown type annotation {param.annotation} for parameter {param.name}: {str(e)}"
@@ -67,14 +76,14 @@ def function_to_json(func) -> dict:
     required = [
         param.name
         for param in signature.parameters.values()
-        if param.default == inspect._empty
+        if param.default == inspect._empty and param.name != CONTEXT_VARIABLES
     ]
 
     return {
         "type": "function",
         "function": {
             "name": func.__name__,
-            "description": func.__doc__ or "",
+            "description": inspect.getdoc(func) or "",
             "parameters": {
                 "type": "object",
                 "properties": parameters,
@@ -1,6 +1,12 @@
-import asyncio
+from os import getenv
 from typing import AsyncGenerator, Dict, List, Optional
-from .agents.groq_triage import get_agent_response
+from .agents.groq_triage import stream_agent_response
+from .agents.groq_tools import stream_tool_agent_response
+from .fast_path import answer_from_stats
+
+# "context": the relevant part of the collection is put in the prompt (see groq_triage.py)
+# "tools": the model looks up what it needs through user-scoped tools (see groq_tools.py)
+SOMMELIER_MODE = getenv("SOMMELIER_MODE", "context").lower()
 
 async def generate_response(
     message: str,
@@ -16,12 +22,14 @@ async def generate_response(
         history: Prior conversation turns (not including the current message)
         
     Yields:
-        str: Response chunks from the sommelier
+        str: Response tokens from the sommelier, as the provider delivers them
     """
-    chunks = await get_agent_response(message, user_id, history)
-    
-    for chunk in chunks:
-        # Add a small delay to simulate processing
-        await asyncio.sleep(0.5)
-        yield chunk
+    # Plain quantitative questions are answered from the collection stats, without the LLM
+    answer = await answer_from_stats(message, user_id)
+    if answer is not None:
+        yield answer
+        return
 
+    stream = stream_tool_agent_response if SOMMELIER_MODE == "tools" else stream_agent_response
+    async for token in stream(message, user_id, history):
+        yield token
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from os import getenv
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from database_connection.wine_queries import get_collection_fingerprint
+
+# Collection contexts for the sommelier prompt (rendered entries and their search index), least recently used first.
+# An entry is reused while the collection's fingerprint (counts and latest ids of the user's
+# wines and notes) is unchanged, so every turn after the first in a conversation costs one
+# small query instead of a full fetch and render. The fingerprint doesn't see wines or notes
+# edited in place: whatever edits them calls POST /chat/context/invalidate, which only
+# reaches the worker that handles it, and entries are rendered again after
+# CHAT_CONTEXT_CACHE_TTL seconds in any case.
+CONTEXT_CACHE_MAX_USERS = int(getenv("CHAT_CONTEXT_CACHE_MAX_USERS", "512"))
+CONTEXT_CACHE_TTL = float(getenv("CHAT_CONTEXT_CACHE_TTL", "300"))
+
+# user_id -> (fingerprint, rendered at, rendered context)
+_contexts: "OrderedDict[int, Tuple[tuple, float, Any]]" = OrderedDict()
+
+context_cache_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "evictions": 0,
+    "invalidations": 0,
+}
+
+async def cached_collection_context(
+    user_id: int,
+    render: Callable[[int], Awaitable[Any]],
+) -> Any:
+    """Return the cached context for user_id, or render() it when the collection changed."""
+    # Taken before rendering: a change made meanwhile leaves the entry stale, never wrong
+    fingerprint = await get_collection_fingerprint(user_id)
+
+    entry = _contexts.get(user_id)
+    if entry is not None:
+        if entry[0] == fingerprint and monotonic() - entry[1] < CONTEXT_CACHE_TTL:
+            context_cache_stats["hits"] += 1
+            _contexts.move_to_end(user_id)
+            return entry[2]
+        context_cache_stats["stale"] += 1
+
+    context_cache_stats["misses"] += 1
+    context = await render(user_id)
+    _contexts[user_id] = (fingerprint, monotonic(), context)
+    _contexts.move_to_end(user_id)
+    while len(_contexts) > CONTEXT_CACHE_MAX_USERS:
+        _contexts.popitem(last=False)
+        context_cache_stats["evictions"] += 1
+    return context
+
+def invalidate_collection_context(user_id: Optional[int] = None) -> None:
+    """Drop the cached context of one user, or of everyone when user_id is None."""
+    if user_id is None:
+        context_cache_stats["invalidations"] += len(_contexts)
+        _contexts.clear()
+    elif _contexts.pop(user_id, None) is not None:
+        context_cache_stats["invalidations"] += 1
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    lookups = context_cache_stats["hits"] + context_cache_stats["misses"]
+    return {
+        **context_cache_stats,
+        "hit_rate": round(context_cache_stats["hits"] / lookups, 3) if lookups else None,
+        "entries": len(_contexts),
+        "max_entries": CONTEXT_CACHE_MAX_USERS,
+        "ttl_seconds": CONTEXT_CACHE_TTL,
+    }
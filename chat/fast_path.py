@@ -0,0 +1,214 @@
+import re
+from decimal import Decimal
+from os import getenv
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from database_connection.user_stats import get_user_stats
+from .retrieval import TOKEN_PATTERN, fold_accents
+
+# Quantitative questions ("how many bottles do I have", "value of my French wines") are
+# answered straight from the collection stats. Anything the matcher isn't sure about goes
+# to the LLM as before: a message is only answered when every word in it is accounted for
+# by the question itself or by a country, region, grape or producer in the collection. A
+# wine name, vintage or colour the stats can't filter on ("my 2015 Barolo", "my red wines")
+# leaves words over and is deferred.
+FAST_PATH_ENABLED = getenv("CHAT_FAST_PATH", "true").lower() == "true"
+# Longer messages are rarely a single factual question
+FAST_PATH_MAX_WORDS = 16
+
+MOST_EXPENSIVE = re.compile(r"\b(most expensive|priciest|most costly|most valuable (wine|bottle))\b")
+AVERAGE_VALUE = re.compile(r"\baverage\b.*\b(price|value|cost)\b|\b(price|value|cost) per bottle\b")
+TOTAL_VALUE = re.compile(r"\b(value|worth|cost|costs|spent)\b")
+# Value questions must be about the user's own wines, not the price of a wine or a bottle
+OWN_COLLECTION = re.compile(r"\b(my|our)( \w+){0,4}? (collection|cellar|wines|bottles)\b")
+BOTTLE_COUNT = re.compile(r"\b(how many bottles|number of bottles|bottle count)\b")
+WINE_COUNT = re.compile(r"\b(how many (different |unique |distinct )?wines|number of (different |unique )?wines)\b")
+
+# Questions that need judgement rather than a number
+NEEDS_LLM = re.compile(
+    r"\b(pair|pairing|pairs|recommend|suggest|should|why|compare|versus|vs|best|drink|open|"
+    r"food|dish|taste|tastes|like|ready|age|aging|cellar them|sell|buy)\b"
+)
+
+# Words that may appear around a question without changing it. Anything else in the
+# message must be a recognised filter
+QUESTION_WORDS = frozenset("""
+    a all altogether an are average bottle bottles can cellar collection combined cost
+    costly costs count different distinct do does entire expensive from have how i in is
+    many me most much my number of our overall own per price priciest s spent tell the
+    there total unique value valuable what whats whole wine wines worth
+""".split())
+
+# Country adjectives, mapped to the names a collection may use for the country
+DEMONYMS = {
+    "french": ("France",),
+    "italian": ("Italy", "Italia"),
+    "spanish": ("Spain", "España"),
+    "german": ("Germany", "Deutschland"),
+    "portuguese": ("Portugal",),
+    "austrian": ("Austria", "Österreich"),
+    "swiss": ("Switzerland", "Schweiz", "Suisse"),
+    "american": ("USA", "United States", "US", "United States of America"),
+    "australian": ("Australia",),
+    "new zealand": ("New Zealand",),
+    "chilean": ("Chile",),
+    "argentinian": ("Argentina",),
+    "argentine": ("Argentina",),
+    "south african": ("South Africa",),
+    "greek": ("Greece",),
+    "hungarian": ("Hungary",),
+    "lebanese": ("Lebanon",),
+}
+
+# Shorter names ("US") are too easily matched by accident
+MIN_ENTITY_CHARS = 3
+
+# Dimension -> (bottle counter, value dict) in the stats dict, and how to name it in a reply
+DIMENSIONS = {
+    "country": ("countries", "value_by_country", "from"),
+    "region": ("regions", "value_by_region", "from"),
+    "grape": ("grapes", "value_by_grape", "made from"),
+    "producer": ("producers", "value_by_producer", "by"),
+}
+
+fast_path_stats: Dict[str, int] = {
+    "answered": 0,
+    "fallbacks": 0,
+}
+
+def _fold(text: str) -> str:
+    # Unlike retrieval.tokenize, keeps the stopwords the patterns rely on
+    return " ".join(TOKEN_PATTERN.findall(fold_accents(text)))
+
+def _contains(folded_message: str, phrase: str) -> bool:
+    folded_phrase = _fold(phrase)
+    return bool(folded_phrase) and re.search(rf"\b{re.escape(folded_phrase)}\b", folded_message) is not None
+
+def _find_entities(folded_message: str, stats: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """(dimension, key) pairs named in the message, longest names first, without overlaps."""
+    candidates = []
+    for dimension, (counter_key, _, _) in DIMENSIONS.items():
+        for key in stats[counter_key]:
+            if key and len(str(key)) >= MIN_ENTITY_CHARS and _contains(folded_message, str(key)):
+                candidates.append((len(str(key)), dimension, key))
+
+    entities = []
+    claimed: List[str] = []
+    for _, dimension, key in sorted(candidates, key=lambda candidate: -candidate[0]):
+        name = _fold(str(key))
+        # "Pinot Noir" also contains "Pinot"; a region may share its country's name
+        if any(re.search(rf"\b{re.escape(name)}\b", longer) for longer in claimed):
+            continue
+        claimed.append(name)
+        entities.append((dimension, key))
+    return entities
+
+def _find_demonym(folded_message: str) -> Optional[str]:
+    for demonym in sorted(DEMONYMS, key=len, reverse=True):
+        if re.search(rf"\b{demonym}\b", folded_message):
+            return demonym
+    return None
+
+def _country_key(stats: Dict[str, Any], names: Iterable[str]) -> Optional[str]:
+    wanted = {_fold(name) for name in names}
+    for key in stats["countries"]:
+        if key and _fold(key) in wanted:
+            return key
+    return None
+
+def _money(value: Any) -> str:
+    return f"${Decimal(str(value)):,.2f}"
+
+def _match_intent(folded_message: str) -> Optional[str]:
+    if len(folded_message.split()) > FAST_PATH_MAX_WORDS or NEEDS_LLM.search(folded_message):
+        return None
+    for intent, pattern in (
+        ("most_expensive", MOST_EXPENSIVE),
+        ("average_value", AVERAGE_VALUE),
+        ("bottle_count", BOTTLE_COUNT),
+        ("wine_count", WINE_COUNT),
+        ("total_value", TOTAL_VALUE),
+    ):
+        if pattern.search(folded_message):
+            if intent == "total_value" and not OWN_COLLECTION.search(folded_message):
+                return None
+            return intent
+    return None
+
+def _leftover_words(folded_message: str, filters: Iterable[str]) -> List[str]:
+    """Words of the message that are neither part of the question nor a recognised filter."""
+    remaining = folded_message
+    for phrase in sorted(filters, key=len, reverse=True):
+        remaining = re.sub(rf"\b{re.escape(phrase)}\b", " ", remaining)
+    return [word for word in remaining.split() if word not in QUESTION_WORDS]
+
+def answer_from_stats_dict(message: str, stats: Dict[str, Any]) -> Optional[str]:
+    """Templated answer for a quantitative question, or None when unsure."""
+    if message.count("?") > 1:
+        # Several questions at once
+        return None
+    folded_message = _fold(message)
+    intent = _match_intent(folded_message)
+    if intent is None:
+        return None
+    if "error" in stats:
+        return "You don't have any wines in your collection yet."
+
+    entities = _find_entities(folded_message, stats)
+    demonym = _find_demonym(folded_message)
+    filters = [_fold(str(key)) for _, key in entities] + ([demonym] if demonym else [])
+    if _leftover_words(folded_message, filters):
+        # Something the stats can't filter on, such as a wine name, vintage or colour
+        return None
+    if demonym is not None:
+        country = _country_key(stats, DEMONYMS[demonym])
+        if country is None:
+            # A recognised country the collection simply doesn't have
+            if intent in ("bottle_count", "total_value", "wine_count"):
+                return f"You don't have any wines from {DEMONYMS[demonym][0]} in your collection."
+            return None
+        entities = [("country", country)] + [entity for entity in entities if entity != ("country", country)]
+
+    if len(entities) > 1:
+        return None
+
+    if not entities:
+        if intent == "bottle_count":
+            return (f"You have {stats['total_bottles']} bottles in your collection, "
+                    f"across {stats['total_unique_wines']} different wines.")
+        if intent == "wine_count":
+            return (f"Your collection has {stats['total_unique_wines']} different wines, "
+                    f"{stats['total_bottles']} bottles in total.")
+        if intent == "total_value":
+            return (f"Your collection is worth {_money(stats['total_value'])} "
+                    f"({stats['total_bottles']} bottles).")
+        if intent == "average_value":
+            return f"Your average bottle is worth {_money(stats['average_bottle_value'])}."
+        most_expensive = stats["most_expensive"]
+        if not most_expensive.get("wine"):
+            return None
+        return (f"Your most expensive wine is {most_expensive['wine']} ({most_expensive['year']}) "
+                f"by {most_expensive['producer']}, at {_money(most_expensive['price'])} per bottle.")
+
+    dimension, key = entities[0]
+    counter_key, value_key, preposition = DIMENSIONS[dimension]
+    bottles = stats[counter_key].get(key, 0)
+    value = stats[value_key].get(key, Decimal("0"))
+    if intent == "bottle_count":
+        return f"You have {bottles} bottles {preposition} {key}."
+    if intent == "total_value":
+        return f"Your wines {preposition} {key} are worth {_money(value)} ({bottles} bottles)."
+    if intent == "average_value" and bottles:
+        return f"Your wines {preposition} {key} average {_money(Decimal(str(value)) / bottles)} per bottle."
+    # Per-wine counts and maxima aren't broken down by dimension
+    return None
+
+async def answer_from_stats(message: str, user_id: int) -> Optional[str]:
+    """Answer message from the user's collection stats when it is a plain quantitative question."""
+    if not FAST_PATH_ENABLED or _match_intent(_fold(message)) is None:
+        return None
+    answer = answer_from_stats_dict(message, await get_user_stats(user_id))
+    fast_path_stats["answered" if answer is not None else "fallbacks"] += 1
+    return answer
+
+def get_fast_path_stats() -> Dict[str, Any]:
+    return {**fast_path_stats, "enabled": FAST_PATH_ENABLED}
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from .retrieval import estimate_tokens
+
+# Prompt tokens the verbatim history may take; older turns are folded into a summary
+HISTORY_TOKEN_BUDGET = int(getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+# Turns are folded this many at a time, so the summary only changes every few turns
+HISTORY_FOLD_STEP = int(getenv("CHAT_HISTORY_FOLD_STEP", "4"))
+HISTORY_SUMMARY_TIMEOUT = float(getenv("CHAT_HISTORY_SUMMARY_TIMEOUT", "10"))
+SUMMARY_CACHE_MAX_ENTRIES = int(getenv("CHAT_SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+
+# Per-message overhead of the chat format
+TURN_OVERHEAD_TOKENS = 4
+# Longest excerpt per turn in the fallback summary
+FALLBACK_EXCERPT_CHARS = 200
+
+Turn = Dict[str, str]
+Summarizer = Callable[[str, List[Turn]], Awaitable[str]]
+
+# Summary of a conversation prefix, keyed by a hash of the turns it covers. A client resends
+# the same prefix every turn, so this works without any conversation id.
+_summaries: "OrderedDict[str, str]" = OrderedDict()
+
+history_stats: Dict[str, int] = {
+    "compacted": 0,
+    "summary_hits": 0,
+    "summary_extensions": 0,
+    "summary_fallbacks": 0,
+}
+
+def turn_tokens(turn: Turn) -> int:
+    return estimate_tokens(turn["content"]) + TURN_OVERHEAD_TOKENS
+
+def _prefix_keys(turns: List[Turn]) -> List[str]:
+    """keys[i] identifies turns[:i + 1]."""
+    digest = hashlib.sha256()
+    keys = []
+    for turn in turns:
+        digest.update(f"{turn['role']}\0{turn['content']}\0".encode())
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+def _fallback_summary(previous: str, turns: List[Turn]) -> str:
+    lines = [previous] if previous else []
+    lines += [
+        f"{turn['role']}: {turn['content'][:FALLBACK_EXCERPT_CHARS]}"
+        for turn in turns if turn["role"] == "user"
+    ]
+    return "\n".join(lines)
+
+def _store(key: str, summary: str) -> None:
+    _summaries[key] = summary
+    _summaries.move_to_end(key)
+    while len(_summaries) > SUMMARY_CACHE_MAX_ENTRIES:
+        _summaries.popitem(last=False)
+
+async def _rolling_summary(folded: List[Turn], summarize: Summarizer) -> str:
+    keys = _prefix_keys(folded)
+    if keys[-1] in _summaries:
+        history_stats["summary_hits"] += 1
+        _summaries.move_to_end(keys[-1])
+        return _summaries[keys[-1]]
+
+    # Extend the longest prefix summarized so far instead of starting over
+    covered, previous = 0, ""
+    for count in range(len(folded) - 1, 0, -1):
+        if keys[count - 1] in _summaries:
+            covered, previous = count, _summaries[keys[count - 1]]
+            break
+
+    try:
+        summary = await asyncio.wait_for(
+            summarize(previous, folded[covered:]), timeout=HISTORY_SUMMARY_TIMEOUT
+        )
+        history_stats["summary_extensions"] += 1
+    except Exception as e:
+        # Not cached, so the next turn tries the model again
+        logging.warning(f"History summary failed, using excerpts: {str(e)}")
+        history_stats["summary_fallbacks"] += 1
+        return _fallback_summary(previous, folded[covered:])
+
+    _store(keys[-1], summary)
+    return summary
+
+async def compact_history(history: List[Turn], summarize: Summarizer) -> Tuple[str, List[Turn]]:
+    """
+    Fit history into HISTORY_TOKEN_BUDGET.
+
+    Returns (summary, recent turns): the most recent turns verbatim and a rolling summary
+    of everything older ("" when the whole history fits). summarize(previous_summary, turns)
+    extends a summary with more turns.
+    """
+    costs = [turn_tokens(turn) for turn in history]
+    remaining = sum(costs)
+    if remaining <= HISTORY_TOKEN_BUDGET:
+        return "", history
+
+    folded_count = 0
+    while remaining > HISTORY_TOKEN_BUDGET and folded_count < len(history):
+        step_end = min(folded_count + HISTORY_FOLD_STEP, len(history))
+        remaining -= sum(costs[folded_count:step_end])
+        folded_count = step_end
+
+    history_stats["compacted"] += 1
+    summary = await _rolling_summary(history[:folded_count], summarize)
+    return summary, history[folded_count:]
+
+def get_history_stats() -> Dict[str, Any]:
+    return {
+        **history_stats,
+        "cached_summaries": len(_summaries),
+        "token_budget": HISTORY_TOKEN_BUDGET,
+    }
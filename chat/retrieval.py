@@ -0,0 +1,99 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from os import getenv
+from typing import List, Optional
+
+# How many wines the sommelier sees per message, and roughly how many prompt tokens they may take
+RETRIEVAL_TOP_K = int(getenv("CHAT_RETRIEVAL_TOP_K", "40"))
+CONTEXT_TOKEN_BUDGET = int(getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Words that say nothing about which wine is meant
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from have how i in is it me my of on or our
+    should some that the this to what which with would you your wine wines bottle bottles
+""".split())
+
+def fold_accents(text: str) -> str:
+    # Lowercase without accents, so "rhone" matches "Rhône"
+    folded = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in folded if not unicodedata.combining(ch))
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(fold_accents(text)) if token not in STOPWORDS]
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose
+    return len(text) // 4 + 1
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents."""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(document)) for document in documents]
+        self.doc_lengths = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avg_doc_length = sum(self.doc_lengths) / len(documents) if documents else 0.0
+
+        doc_freqs: Counter = Counter()
+        for freqs in self.term_freqs:
+            doc_freqs.update(freqs.keys())
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = [0.0] * len(self.term_freqs)
+        if not terms:
+            return scores
+
+        for index, freqs in enumerate(self.term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / (self.avg_doc_length or 1))
+            score = 0.0
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores[index] = score
+        return scores
+
+def select_documents(
+    documents: List[str],
+    index: BM25Index,
+    query: str,
+    top_k: Optional[int] = None,
+    token_budget: Optional[int] = None,
+) -> List[int]:
+    """
+    Indices of the documents to show for query, best match first.
+
+    Everything is returned, in order, when it fits the budget. Otherwise the top_k best
+    matches are taken while they fit; documents that don't match at all keep their original
+    order, so a vague question still gets a representative slice of the collection.
+    """
+    top_k = RETRIEVAL_TOP_K if top_k is None else top_k
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+
+    costs = [estimate_tokens(document) for document in documents]
+    if len(documents) <= top_k and sum(costs) <= token_budget:
+        return list(range(len(documents)))
+
+    scores = index.scores(query)
+    ranked = sorted(range(len(documents)), key=lambda i: -scores[i])
+
+    selected = []
+    used = 0
+    for i in ranked:
+        if len(selected) >= top_k:
+            break
+        if used + costs[i] > token_budget:
+            continue
+        selected.append(i)
+        used += costs[i]
+    return selected
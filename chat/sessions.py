@@ -0,0 +1,199 @@
+import json
+import logging
+import secrets
+from collections import OrderedDict
+from os import getenv
+from time import time
+from typing import Any, Dict, List, Optional
+from database_connection import get_db_connection
+from database_connection.metrics import acquire_connection
+
+# Server-side chat sessions: clients send a session id and the new message instead of the
+# whole history. Sessions live in an in-process LRU and expire after CHAT_SESSION_TTL
+# seconds without activity. With CHAT_SESSION_PERSIST=true they are written through to
+# Postgres, which then is the source of truth, so they survive restarts and are shared
+# between workers; turns are appended there atomically, so concurrent turns handled by
+# different workers are all kept.
+#
+# Without persistence a session only exists in the worker that created it, and requests
+# reaching any other worker or instance get a 404. Run a single long-lived worker or set
+# CHAT_SESSION_PERSIST=true.
+SESSION_TTL = float(getenv("CHAT_SESSION_TTL", "86400"))
+SESSION_MAX_ENTRIES = int(getenv("CHAT_SESSION_MAX_ENTRIES", "2048"))
+# Oldest turns beyond this are dropped; the prompt is compacted separately (see history.py)
+SESSION_MAX_TURNS = int(getenv("CHAT_SESSION_MAX_TURNS", "200"))
+# On by default on Vercel (which sets VERCEL=1), where consecutive requests rarely reach
+# the same instance
+SESSION_PERSIST = getenv("CHAT_SESSION_PERSIST", "true" if getenv("VERCEL") else "false").lower() == "true"
+# Worker processes per instance, as set for uvicorn and gunicorn
+WORKERS = int(getenv("WEB_CONCURRENCY", "1"))
+
+SESSION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wine_chat_sessions (
+        session_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        turns JSONB NOT NULL DEFAULT '[]',
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    CREATE INDEX IF NOT EXISTS wine_chat_sessions_updated_at_idx ON wine_chat_sessions (updated_at);
+"""
+
+# session_id -> {"user_id", "turns", "last_used"}, least recently used first
+_sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+session_stats: Dict[str, int] = {
+    "created": 0,
+    "hits": 0,
+    "loaded": 0,
+    "expired": 0,
+    "evictions": 0,
+    "persist_errors": 0,
+}
+
+def _remember(session_id: str, session: Dict[str, Any]) -> None:
+    _sessions[session_id] = session
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > SESSION_MAX_ENTRIES:
+        _sessions.popitem(last=False)
+        session_stats["evictions"] += 1
+
+async def _persist(session_id: str, session: Dict[str, Any]) -> None:
+    if not SESSION_PERSIST:
+        return
+    try:
+        pool = await get_db_connection()
+        async with acquire_connection(pool, "chat_session_save") as conn:
+            await conn.execute("""
+                INSERT INTO wine_chat_sessions (session_id, user_id, turns, updated_at)
+                VALUES ($1, $2, $3, now())
+            """, session_id, session["user_id"], json.dumps(session["turns"]))
+    except Exception as e:
+        # The in-memory copy still serves this worker
+        session_stats["persist_errors"] += 1
+        logging.error(f"Failed to persist chat session: {str(e)}")
+
+async def _append_persisted(session_id: str, turns: List[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+    """Append turns in Postgres in one statement, keeping the last SESSION_MAX_TURNS. Returns all turns."""
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "chat_session_append") as conn:
+        row = await conn.fetchrow("""
+            UPDATE wine_chat_sessions
+            SET turns = (
+                    SELECT COALESCE(jsonb_agg(turn ORDER BY n), '[]'::jsonb)
+                    FROM jsonb_array_elements(wine_chat_sessions.turns || $2::jsonb) WITH ORDINALITY AS t(turn, n)
+                    WHERE n > jsonb_array_length(wine_chat_sessions.turns || $2::jsonb) - $3
+                ),
+                updated_at = now()
+            WHERE session_id = $1
+            RETURNING turns
+        """, session_id, json.dumps(turns), SESSION_MAX_TURNS)
+    return json.loads(row["turns"]) if row is not None else None
+
+async def _load(session_id: str) -> Optional[Dict[str, Any]]:
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "chat_session_load") as conn:
+        row = await conn.fetchrow("""
+            SELECT user_id, turns, EXTRACT(EPOCH FROM updated_at)::float8 AS updated_at
+            FROM wine_chat_sessions
+            WHERE session_id = $1 AND updated_at > now() - make_interval(secs => $2)
+        """, session_id, SESSION_TTL)
+    if row is None:
+        return None
+    session_stats["loaded"] += 1
+    return {"user_id": row["user_id"], "turns": json.loads(row["turns"]), "last_used": row["updated_at"]}
+
+async def create_session(user_id: int, turns: Optional[List[Dict[str, str]]] = None) -> str:
+    """Start a session for user_id, optionally seeded with earlier turns. Returns its id."""
+    session_id = secrets.token_urlsafe(24)
+    session = {"user_id": user_id, "turns": list(turns or [])[-SESSION_MAX_TURNS:], "last_used": time()}
+    _remember(session_id, session)
+    session_stats["created"] += 1
+    await _persist(session_id, session)
+    return session_id
+
+async def get_session_turns(session_id: str, user_id: int) -> Optional[List[Dict[str, str]]]:
+    """Turns of a live session owned by user_id, or None if it is unknown or expired."""
+    session = _sessions.get(session_id)
+    if session is not None and time() - session["last_used"] > SESSION_TTL:
+        session_stats["expired"] += 1
+        del _sessions[session_id]
+        session = None
+
+    if SESSION_PERSIST:
+        # Postgres is authoritative: another worker may have added turns since
+        try:
+            session = await _load(session_id)
+        except Exception as e:
+            # Fall back to this worker's copy, if it has one
+            session_stats["persist_errors"] += 1
+            logging.error(f"Failed to load chat session: {str(e)}")
+        if session is not None:
+            _remember(session_id, session)
+        else:
+            _sessions.pop(session_id, None)
+    elif session is not None:
+        session_stats["hits"] += 1
+        _sessions.move_to_end(session_id)
+
+    if session is None:
+        return None
+    if session["user_id"] != user_id:
+        return None
+    return list(session["turns"])
+
+async def append_turns(session_id: str, turns: List[Dict[str, str]]) -> None:
+    session = _sessions.get(session_id)
+    if SESSION_PERSIST:
+        try:
+            stored = await _append_persisted(session_id, turns)
+        except Exception as e:
+            session_stats["persist_errors"] += 1
+            logging.error(f"Failed to persist chat session: {str(e)}")
+        else:
+            if session is not None and stored is not None:
+                session["turns"] = stored
+                session["last_used"] = time()
+            return
+    if session is None:
+        return
+    session["turns"] = (session["turns"] + turns)[-SESSION_MAX_TURNS:]
+    session["last_used"] = time()
+
+async def delete_session(session_id: str) -> None:
+    _sessions.pop(session_id, None)
+    if not SESSION_PERSIST:
+        return
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "chat_session_delete") as conn:
+        await conn.execute("DELETE FROM wine_chat_sessions WHERE session_id = $1", session_id)
+
+async def ensure_session_schema() -> None:
+    """Create the sessions table when persistence is enabled, and drop expired sessions."""
+    if not SESSION_PERSIST:
+        if WORKERS > 1:
+            logging.warning(
+                f"Chat sessions are kept in memory but WEB_CONCURRENCY={WORKERS}: a session only "
+                "works on the worker that created it. Set CHAT_SESSION_PERSIST=true."
+            )
+        return
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "ensure_session_schema") as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wine_chat_sessions'))")
+            await conn.execute(SESSION_SCHEMA)
+        deleted = await conn.execute(
+            "DELETE FROM wine_chat_sessions WHERE updated_at < now() - make_interval(secs => $1)",
+            SESSION_TTL
+        )
+        logging.info(f"Chat sessions ready ({deleted.split()[-1]} expired sessions removed)")
+
+def get_session_stats() -> Dict[str, Any]:
+    return {
+        **session_stats,
+        "active": len(_sessions),
+        "max_entries": SESSION_MAX_ENTRIES,
+        "ttl_seconds": SESSION_TTL,
+        "persisted": SESSION_PERSIST,
+        "workers": WORKERS,
+    }
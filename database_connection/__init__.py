@@ -1,3 +1,6 @@
-from .database_connection import init_db_pool, get_db_connection, close_db_pool
+from .database_connection import init_db_pool, get_db_connection, get_read_connection, close_db_pool, get_pool_status
+from .statements import fetch_statement, fetchrow_statement, fetchval_statement, get_statement, get_statement_stats
 
-__all__ = ['init_db_pool', 'get_db_connection', 'close_db_pool'] 
\ No newline at end of file
+__all__ = ['init_db_pool', 'get_db_connection', 'get_read_connection', 'close_db_pool', 'get_pool_status',
+           'fetch_statement', 'fetchrow_statement', 'fetchval_statement', 'get_statement',
+           'get_statement_stats'] 
\ No newline at end of file
@@ -2,97 +2,344 @@ from os import getenv
 from fastapi import HTTPException
 import asyncpg
 import logging
-from typing import Optional
+from typing import Optional, Dict, Any
 import asyncio
+import random
+from time import time, perf_counter
+from .statements import StatementConnection, prepare_statements
 
-# Global pool variable
-pool: Optional[asyncpg.Pool] = None
+PRIMARY = "primary"
+REPLICA = "replica"
+
+# Global pools: the primary takes all writes, the optional replica serves read-only work
+pools: Dict[str, Optional[asyncpg.Pool]] = {PRIMARY: None, REPLICA: None}
+
+# Pool sizing and timeouts; size DB_POOL_MAX_SIZE x workers against the server's max_connections
+POOL_MIN_SIZE = int(getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(getenv("DB_POOL_MAX_SIZE", "10"))
+COMMAND_TIMEOUT = float(getenv("DB_COMMAND_TIMEOUT", "60"))
+MAX_INACTIVE_CONNECTION_LIFETIME = float(getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", "300"))
+ACQUIRE_TIMEOUT = float(getenv("DB_ACQUIRE_TIMEOUT", "10"))
+
+# Background health monitor settings
+HEALTH_CHECK_INTERVAL = float(getenv("DB_HEALTH_CHECK_INTERVAL", "15"))
+HEALTH_CHECK_TIMEOUT = float(getenv("DB_HEALTH_CHECK_TIMEOUT", "5"))
+HEALTH_FAILURE_THRESHOLD = int(getenv("DB_HEALTH_FAILURE_THRESHOLD", "3"))
+REBUILD_BACKOFF_BASE = float(getenv("DB_REBUILD_BACKOFF_BASE", "1"))
+REBUILD_BACKOFF_MAX = float(getenv("DB_REBUILD_BACKOFF_MAX", "60"))
+POOL_CLOSE_TIMEOUT = 10.0
+
+# Replica reads fall back to the primary once replay lag exceeds this
+REPLICA_MAX_LAG_SECONDS = float(getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+
+# Zero when the server is a primary or has replayed everything it received
+REPLICATION_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::float8
+"""
+
+def _new_health() -> Dict[str, Any]:
+    return {
+        "healthy": False,
+        "consecutive_failures": 0,
+        "total_failures": 0,
+        "last_probe_at": None,
+        "last_probe_latency_ms": None,
+        "last_error": None,
+        "rebuild_count": 0,
+        "rebuild_attempts": 0,
+        "next_rebuild_at": None,
+        "replication_lag_seconds": None,
+    }
+
+# Pool health as seen by the background monitor
+pool_health: Dict[str, Dict[str, Any]] = {PRIMARY: _new_health(), REPLICA: _new_health()}
+
+# Where read-only work ended up
+routing_stats: Dict[str, int] = {"replica_reads": 0, "primary_fallback_reads": 0}
+
+_monitor_task: Optional[asyncio.Task] = None
+_pool_locks: Dict[str, asyncio.Lock] = {PRIMARY: asyncio.Lock(), REPLICA: asyncio.Lock()}
+
+def replica_configured() -> bool:
+    return bool(getenv("REPLICA_DB_HOST"))
+
+def connection_settings(role: str) -> Dict[str, Optional[str]]:
+    settings = {
+        "database": getenv('DATABASE'),
+        "user": getenv('DB_USER'),
+        "password": getenv('DB_PASSWORD'),
+        "host": getenv('DB_HOST'),
+        "port": getenv('DB_PORT'),
+    }
+    if role == REPLICA:
+        # Anything not set for the replica is shared with the primary
+        settings.update({
+            "database": getenv('REPLICA_DATABASE', settings["database"]),
+            "user": getenv('REPLICA_DB_USER', settings["user"]),
+            "password": getenv('REPLICA_DB_PASSWORD', settings["password"]),
+            "host": getenv('REPLICA_DB_HOST'),
+            "port": getenv('REPLICA_DB_PORT', settings["port"]),
+        })
+    return settings
+
+async def _create_pool(role: str = PRIMARY) -> asyncpg.Pool:
+    settings = connection_settings(role)
 
-async def init_db_pool():
-    global pool
-    
-    # If pool already exists and is active, return it
-    if pool is not None:
-        try:
-            # Test the connection with a simple query
-            async with pool.acquire() as conn:
-                await conn.fetchval('SELECT 1')
-            return pool
-        except Exception as e:
-            logging.error(f"Pool test failed: {str(e)}")
-            # If the test fails, the pool is not usable
-            try:
-                await pool.close()
-            except Exception:
-                pass
-            pool = None
-    
     # Validate environment variables first
-    required_env_vars = ['DATABASE', 'DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT']
-    missing_vars = [var for var in required_env_vars if not getenv(var)]
-    
+    missing_vars = [name for name, value in settings.items() if not value]
     if missing_vars:
-        error_msg = f"Missing required environment variables: {', '.join(missing_vars)}"
+        error_msg = f"Missing {role} database settings: {', '.join(missing_vars)}"
         logging.error(error_msg)
         raise RuntimeError(error_msg)
 
     try:
-        pool = await asyncpg.create_pool(
-            database=getenv('DATABASE'),
-            user=getenv('DB_USER'),
-            password=getenv('DB_PASSWORD'),
-            host=getenv('DB_HOST'),
-            port=getenv('DB_PORT'),
-            min_size=1,
-            max_size=10,
-            command_timeout=60,
-            max_inactive_connection_lifetime=300.0,  # 5 minutes
-            server_settings={'application_name': 'mywine_fastapi'}
+        return await asyncpg.create_pool(
+            **settings,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            command_timeout=COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=MAX_INACTIVE_CONNECTION_LIFETIME,
+            server_settings={'application_name': f'mywine_fastapi_{role}'},
+            connection_class=StatementConnection,
+            init=prepare_statements
         )
-        return pool
     except asyncpg.PostgresError as e:
-        logging.error(f"PostgreSQL error: {str(e)}")
+        logging.error(f"PostgreSQL error ({role}): {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="Database connection failed - PostgreSQL error"
         )
     except Exception as e:
-        logging.error(f"Unexpected database connection error: {str(e)}")
+        logging.error(f"Unexpected database connection error ({role}): {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="Database connection failed - unexpected error"
         )
 
+async def _init_pool(role: str) -> asyncpg.Pool:
+    async with _pool_locks[role]:
+        # Health is tracked by the background monitor, so an existing pool is reused as is
+        if pools[role] is not None:
+            return pools[role]
+
+        pools[role] = await _create_pool(role)
+        pool_health[role]["healthy"] = True
+        pool_health[role]["consecutive_failures"] = 0
+        return pools[role]
+
+async def init_db_pool():
+    primary_pool = await _init_pool(PRIMARY)
+
+    if replica_configured():
+        try:
+            await _init_pool(REPLICA)
+            # Measure lag up front so reads can move to the replica right away
+            await check_pool_health(REPLICA)
+        except Exception as e:
+            # Reads fall back to the primary until the monitor brings the replica up
+            logging.error(f"Replica pool unavailable, reading from primary: {str(e)}")
+
+    start_pool_monitor()
+    return primary_pool
+
 async def get_db_connection():
-    global pool
+    """Return the primary pool without probing it; the background monitor keeps it healthy."""
+    if pools[PRIMARY] is not None:
+        return pools[PRIMARY]
+    try:
+        return await init_db_pool()
+    except Exception as e:
+        logging.error(f"Failed to create pool: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Database connection failed"
+        )
+
+def _replica_usable() -> bool:
+    health = pool_health[REPLICA]
+    lag = health["replication_lag_seconds"]
+    return (
+        pools[REPLICA] is not None
+        and health["healthy"]
+        and health["consecutive_failures"] == 0
+        and lag is not None
+        and lag <= REPLICA_MAX_LAG_SECONDS
+    )
+
+async def get_read_connection():
+    """
+    Return the pool for read-only work.
+
+    Uses the replica when one is configured, healthy and within REPLICA_MAX_LAG_SECONDS
+    of the primary; otherwise falls back to the primary pool.
+    """
+    if _replica_usable():
+        routing_stats["replica_reads"] += 1
+        return pools[REPLICA]
+
+    if replica_configured():
+        routing_stats["primary_fallback_reads"] += 1
+    return await get_db_connection()
+
+async def _close_pool(old_pool: asyncpg.Pool) -> None:
     try:
-        if pool is None:
-            pool = await init_db_pool()
-        # Test the connection
-        async with pool.acquire() as conn:
-            await conn.fetchval('SELECT 1')
-        return pool
+        await asyncio.wait_for(old_pool.close(), timeout=POOL_CLOSE_TIMEOUT)
     except Exception as e:
-        logging.error(f"Error getting DB connection: {str(e)}")
-        # Try to recreate the pool
+        logging.warning(f"Graceful pool close failed, terminating: {str(e)}")
+        old_pool.terminate()
+
+async def _probe_pool(role: str) -> None:
+    current_pool = pools[role]
+    if current_pool is None:
+        raise RuntimeError(f"Database {role} pool is not initialized")
+
+    start = perf_counter()
+    async with current_pool.acquire(timeout=HEALTH_CHECK_TIMEOUT) as conn:
+        if role == REPLICA:
+            lag = await conn.fetchval(REPLICATION_LAG_QUERY, timeout=HEALTH_CHECK_TIMEOUT)
+            pool_health[role]["replication_lag_seconds"] = round(lag, 3)
+        else:
+            await conn.fetchval('SELECT 1', timeout=HEALTH_CHECK_TIMEOUT)
+    pool_health[role]["last_probe_latency_ms"] = round((perf_counter() - start) * 1000, 2)
+
+async def _rebuild_pool(role: str) -> None:
+    health = pool_health[role]
+
+    # Back off between rebuild attempts so an unreachable database is not hammered
+    if health["next_rebuild_at"] and time() < health["next_rebuild_at"]:
+        return
+
+    async with _pool_locks[role]:
+        old_pool = pools[role]
         try:
-            if pool:
-                await pool.close()
-            pool = None
-            return await init_db_pool()
+            pools[role] = await _create_pool(role)
         except Exception as e:
-            logging.error(f"Failed to recreate pool: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail="Database connection failed"
+            health["rebuild_attempts"] += 1
+            delay = min(
+                REBUILD_BACKOFF_BASE * 2 ** (health["rebuild_attempts"] - 1),
+                REBUILD_BACKOFF_MAX
             )
+            health["next_rebuild_at"] = time() + delay + random.uniform(0, delay / 2)
+            logging.error(f"{role.capitalize()} pool rebuild failed, next attempt in {delay:.1f}s: {str(e)}")
+            return
+
+    health["rebuild_count"] += 1
+    health["rebuild_attempts"] = 0
+    health["next_rebuild_at"] = None
+    health["consecutive_failures"] = 0
+    health["healthy"] = True
+    logging.warning(f"Database {role} pool rebuilt (rebuild #{health['rebuild_count']})")
+
+    if old_pool is not None:
+        await _close_pool(old_pool)
+
+async def check_pool_health(role: str = PRIMARY) -> None:
+    """Probe one pool once and rebuild it after repeated failures."""
+    health = pool_health[role]
+    health["last_probe_at"] = time()
+    try:
+        await _probe_pool(role)
+        health["healthy"] = True
+        health["consecutive_failures"] = 0
+        health["last_error"] = None
+        return
+    except Exception as e:
+        health["consecutive_failures"] += 1
+        health["total_failures"] += 1
+        health["last_error"] = str(e)
+        logging.error(
+            f"{role.capitalize()} pool health probe failed "
+            f"({health['consecutive_failures']} in a row): {str(e)}"
+        )
+
+    if pools[role] is None or health["consecutive_failures"] >= HEALTH_FAILURE_THRESHOLD:
+        health["healthy"] = False
+        await _rebuild_pool(role)
+
+async def _monitor_pool() -> None:
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        roles = [PRIMARY, REPLICA] if replica_configured() else [PRIMARY]
+        for role in roles:
+            try:
+                await check_pool_health(role)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Pool monitor error ({role}): {str(e)}")
+
+def start_pool_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is not None and not _monitor_task.done():
+        return
+    _monitor_task = asyncio.create_task(_monitor_pool())
+
+async def stop_pool_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is None:
+        return
+    _monitor_task.cancel()
+    try:
+        await _monitor_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        _monitor_task = None
+
+def _pool_snapshot(role: str) -> Dict[str, Any]:
+    current_pool = pools[role]
+    status = {
+        "initialized": current_pool is not None,
+        "size": None,
+        "idle": None,
+        "in_use": None,
+        "min_size": None,
+        "max_size": None,
+        **{key: value for key, value in pool_health[role].items() if key != "rebuild_attempts"},
+    }
+    if current_pool is None:
+        return status
+
+    size = current_pool.get_size()
+    idle = current_pool.get_idle_size()
+    status.update({
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": current_pool.get_min_size(),
+        "max_size": current_pool.get_max_size(),
+    })
+    return status
+
+def get_pool_status() -> Dict[str, Any]:
+    """Snapshot of pool sizing, health and read routing for monitoring endpoints."""
+    status = {
+        "monitor_running": _monitor_task is not None and not _monitor_task.done(),
+        PRIMARY: _pool_snapshot(PRIMARY),
+        REPLICA: None,
+    }
+    if replica_configured():
+        status[REPLICA] = {
+            **_pool_snapshot(REPLICA),
+            "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+            "serving_reads": _replica_usable(),
+            **routing_stats,
+        }
+    return status
 
 async def close_db_pool():
-    global pool
-    if pool is not None:
+    await stop_pool_monitor()
+    for role, current_pool in pools.items():
+        if current_pool is None:
+            continue
         try:
-            await pool.close()
+            await current_pool.close()
         except Exception as e:
-            logging.error(f"Error closing pool: {str(e)}")
+            logging.error(f"Error closing {role} pool: {str(e)}")
         finally:
-            pool = None
\ No newline at end of file
+            pools[role] = None
+            pool_health[role]["healthy"] = False
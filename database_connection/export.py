@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import zlib
+from os import getenv
+from typing import AsyncGenerator, Optional
+from sql_generate.database_structure import SCHEMA
+from .database_connection import get_read_connection
+from .metrics import acquire_connection
+
+# Tables admins may export, with their columns in schema order
+EXPORT_TABLES = {
+    table: list(definition["columns"]) for table, definition in SCHEMA.items()
+}
+
+# COPY chunks buffered between Postgres and the client; a slow client pauses the COPY
+EXPORT_QUEUE_CHUNKS = int(getenv("DB_EXPORT_QUEUE_CHUNKS", "64"))
+EXPORT_GZIP_LEVEL = int(getenv("DB_EXPORT_GZIP_LEVEL", "6"))
+
+_DONE = object()
+
+async def _copy_table(table: str, after_id: int, queue: asyncio.Queue) -> None:
+    columns = EXPORT_TABLES[table]
+    pool = await get_read_connection()
+    async with acquire_connection(pool, f"export_{table}") as conn:
+        if after_id:
+            await conn.copy_from_query(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE id > $1 ORDER BY id",
+                after_id,
+                output=queue.put,
+                format="csv",
+                header=True
+            )
+        else:
+            await conn.copy_from_table(
+                table,
+                columns=columns,
+                output=queue.put,
+                format="csv",
+                header=True
+            )
+
+async def stream_table_csv(
+    table: str,
+    after_id: int = 0,
+    compress: bool = False
+) -> AsyncGenerator[bytes, None]:
+    """
+    Stream a table as CSV straight from COPY TO STDOUT, optionally gzip-compressed.
+
+    COPY output is passed through chunk by chunk without decoding rows, and the bounded
+    queue keeps memory constant however large the table is.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    copy_error: Optional[BaseException] = None
+
+    async def run_copy() -> None:
+        nonlocal copy_error
+        try:
+            await _copy_table(table, after_id, queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            copy_error = e
+        await queue.put(_DONE)
+
+    copy_task = asyncio.create_task(run_copy())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is _DONE:
+                break
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+
+        if copy_error is not None:
+            # Headers are already sent; the client sees a truncated file
+            logging.error(f"Export of {table} failed: {str(copy_error)}")
+        elif compressor is not None:
+            yield compressor.flush()
+    finally:
+        # Stops the COPY and returns the connection if the client went away
+        if not copy_task.done():
+            copy_task.cancel()
+            try:
+                await copy_task
+            except asyncio.CancelledError:
+                pass
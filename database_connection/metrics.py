@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, AsyncIterator, Dict, Optional
+from . import database_connection as connection
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# endpoint -> {"acquire_wait" | "hold" | "query": histogram}
+endpoint_metrics: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+# Per pool role: coroutines currently queued for a connection, high-water mark and timeouts
+acquire_waiters: Dict[str, Dict[str, int]] = {}
+
+_current_endpoint: ContextVar[Optional[str]] = ContextVar("db_endpoint", default=None)
+
+def _new_histogram() -> Dict[str, Any]:
+    return {
+        "count": 0,
+        "sum_ms": 0.0,
+        "max_ms": 0.0,
+        "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+def _observe(endpoint: str, metric: str, elapsed_ms: float) -> None:
+    metrics = endpoint_metrics.setdefault(endpoint, {})
+    histogram = metrics.setdefault(metric, _new_histogram())
+    histogram["count"] += 1
+    histogram["sum_ms"] += elapsed_ms
+    histogram["max_ms"] = max(histogram["max_ms"], elapsed_ms)
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            histogram["buckets"][index] += 1
+            return
+    histogram["buckets"][-1] += 1
+
+def observe_query(elapsed_ms: float) -> None:
+    """Attribute query time to the endpoint holding the current connection."""
+    endpoint = _current_endpoint.get()
+    if endpoint is not None:
+        _observe(endpoint, "query", elapsed_ms)
+
+def _pool_role(pool) -> str:
+    for role, current_pool in connection.pools.items():
+        if current_pool is pool:
+            return role
+    return "unknown"
+
+@asynccontextmanager
+async def acquire_connection(pool, endpoint: str) -> AsyncIterator[Any]:
+    """
+    Instrumented replacement for ``pool.acquire()``.
+
+    Records how long the caller queued for a connection, how long it held it and,
+    through observe_query(), how much of that was spent in queries.
+    """
+    waiters = acquire_waiters.setdefault(
+        _pool_role(pool), {"waiting": 0, "max_waiting": 0, "timeouts": 0}
+    )
+    token = _current_endpoint.set(endpoint)
+    try:
+        waiters["waiting"] += 1
+        waiters["max_waiting"] = max(waiters["max_waiting"], waiters["waiting"])
+        start = perf_counter()
+        try:
+            conn = await pool.acquire(timeout=connection.ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            waiters["timeouts"] += 1
+            logging.error(
+                f"Timed out after {connection.ACQUIRE_TIMEOUT}s waiting for a connection ({endpoint})"
+            )
+            raise
+        finally:
+            waiters["waiting"] -= 1
+
+        acquired = perf_counter()
+        _observe(endpoint, "acquire_wait", (acquired - start) * 1000)
+        try:
+            yield conn
+        finally:
+            _observe(endpoint, "hold", (perf_counter() - acquired) * 1000)
+            await pool.release(conn)
+    finally:
+        _current_endpoint.reset(token)
+
+def _summarize(histogram: Dict[str, Any]) -> Dict[str, Any]:
+    count = histogram["count"]
+    return {
+        "count": count,
+        "avg_ms": round(histogram["sum_ms"] / count, 2) if count else 0.0,
+        "max_ms": round(histogram["max_ms"], 2),
+        "buckets": {
+            **{f"le_{bound}": n for bound, n in zip(LATENCY_BUCKETS_MS, histogram["buckets"])},
+            "inf": histogram["buckets"][-1],
+        },
+    }
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """Acquire/hold/query histograms per endpoint plus a saturation view per pool."""
+    status = connection.get_pool_status()
+    saturation = {}
+    for role, waiters in acquire_waiters.items():
+        pool_status = status.get(role) or {}
+        max_size = pool_status.get("max_size")
+        in_use = pool_status.get("in_use")
+        utilization = round(in_use / max_size, 3) if max_size else None
+        saturation[role] = {
+            **waiters,
+            "in_use": in_use,
+            "max_size": max_size,
+            "utilization": utilization,
+            # Requests are queueing for connections, or about to
+            "saturated": waiters["waiting"] > 0 or (utilization is not None and utilization >= 1),
+        }
+
+    return {
+        "acquire_timeout_seconds": connection.ACQUIRE_TIMEOUT,
+        "saturation": saturation,
+        "endpoints": {
+            endpoint: {metric: _summarize(histogram) for metric, histogram in metrics.items()}
+            for endpoint, metrics in endpoint_metrics.items()
+        },
+    }
@@ -0,0 +1,177 @@
+# Query-plan regression check for the fixed queries.
+#
+# Builds a scratch schema shaped like sql_generate.database_structure.SCHEMA, applies the
+# declared INDEXES, seeds it with synthetic data and runs EXPLAIN (ANALYZE, BUFFERS) on each
+# query in PLAN_CHECKS. Fails when a plan falls back to a sequential scan of a guarded table.
+#
+#     python -m database_connection.plan_check --dsn postgresql://localhost/scratch [--users N] [--wines-per-user N] [--keep]
+#
+# It drops and seeds its own schema, so it never uses the app's DB_* settings: the database
+# must be given explicitly with --dsn or PLAN_CHECK_DATABASE_URL. It needs CREATE there.
+import argparse
+import asyncio
+import json
+import sys
+from os import getenv
+from typing import Any, Dict, Iterator, List
+import asyncpg
+from sql_generate.database_structure import SCHEMA
+from .schema import create_indexes, missing_indexes
+from .statements import STATEMENTS
+
+PLAN_CHECK_SCHEMA = "wine_plan_check"
+
+# query, sample arguments and the tables it must reach through an index
+PLAN_CHECKS: Dict[str, Dict[str, Any]] = {
+    "wine_notes": {
+        "sql": STATEMENTS["wine_notes"],
+        "args": (0, 100),
+        "guarded": {"wine_notes", "wine_table"},
+    },
+    "empty_notes": {
+        "sql": STATEMENTS["empty_notes"],
+        "args": (0, 100),
+        "guarded": {"wine_notes", "wine_table"},
+    },
+    "user_wine_collection": {
+        "sql": STATEMENTS["user_wine_collection"],
+        "args": (42,),
+        "guarded": {"wine_table", "wine_notes"},
+    },
+    "user_collection_stats": {
+        "sql": STATEMENTS["user_collection_stats"],
+        "args": (42,),
+        "guarded": {"wine_table"},
+    },
+    "search_user_wines": {
+        "sql": STATEMENTS["search_user_wines"],
+        "args": (42, ["wine"], None, "grape 3", None, None, 10),
+        "guarded": {"wine_table"},
+    },
+    "user_wine_notes": {
+        "sql": STATEMENTS["user_wine_notes"],
+        "args": (42, None, 10),
+        "guarded": {"wine_table", "wine_notes"},
+    },
+    "cached_aisummary": {
+        "sql": STATEMENTS["cached_aisummary"],
+        "args": (["wine 4242", "wine 4243"], ["producer 242", "producer 243"], None),
+        "guarded": {"wine_table", "wine_aisummaries"},
+    },
+    "wines_missing_aisummary": {
+        "sql": STATEMENTS["wines_missing_aisummary"],
+        "args": (0, 100),
+        # A third of the wines have a summary, so a hash anti-join over a sequential scan of
+        # wine_aisummaries is the right plan; only the paging through wine_table must use its key
+        "guarded": {"wine_table"},
+    },
+    "wine_aisummaries_by_wine": {
+        "sql": "SELECT summary FROM wine_aisummaries WHERE wine_id = $1",
+        "args": (4242,),
+        "guarded": {"wine_aisummaries"},
+    },
+}
+
+SEED_SQL = """
+    INSERT INTO wine_users (username, email)
+    SELECT 'user' || n, 'user' || n || '@example.com'
+    FROM generate_series(1, {users}) AS n;
+
+    INSERT INTO wine_table (user_id, name, producer, grapes, country, region, year, quantity, bottle_size, price)
+    SELECT
+        1 + (n % {users}),
+        'Wine ' || n,
+        'Producer ' || (n % 500),
+        'Grape ' || (n % 40) || ', Grape ' || (n % 17),
+        'Country ' || (n % 20),
+        'Region ' || (n % 120),
+        1980 + (n % 40),
+        1 + (n % 12),
+        0.75,
+        (n % 300) + 0.5
+    FROM generate_series(1, {users} * {wines_per_user}) AS n;
+
+    -- Every wine gets a note, one in fifty of them empty
+    INSERT INTO wine_notes (wine_id, note_text)
+    SELECT id, CASE WHEN id % 50 = 0 THEN '' ELSE 'Tasting note ' || id END
+    FROM wine_table;
+
+    INSERT INTO wine_aisummaries (wine_id, summary)
+    SELECT id, 'Summary ' || id
+    FROM wine_table
+    WHERE id % 3 = 0;
+"""
+
+def _create_tables_sql() -> str:
+    return "".join(
+        f"CREATE TABLE {table} ({', '.join(f'{column} {ddl}' for column, ddl in definition['columns'].items())});\n"
+        for table, definition in SCHEMA.items()
+    )
+
+def _plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+async def _seed(conn, users: int, wines_per_user: int) -> None:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {PLAN_CHECK_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {PLAN_CHECK_SCHEMA}")
+    await conn.execute(f"SET search_path TO {PLAN_CHECK_SCHEMA}")
+    await conn.execute(_create_tables_sql())
+    await conn.execute(SEED_SQL.format(users=int(users), wines_per_user=int(wines_per_user)))
+    await create_indexes(conn, await missing_indexes(conn))
+    await conn.execute("ANALYZE")
+
+async def _check_plan(conn, name: str, check: Dict[str, Any]) -> List[str]:
+    raw = await conn.fetchval(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {check['sql'].strip().rstrip(';')}",
+        *check["args"]
+    )
+    explained = json.loads(raw)[0]
+    plan = explained["Plan"]
+
+    problems = [
+        f"sequential scan on {node['Relation Name']}"
+        for node in _plan_nodes(plan)
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in check["guarded"]
+    ]
+    print(
+        f"{'FAIL' if problems else 'ok':4} {name}: "
+        f"{explained['Execution Time']:.2f} ms, "
+        f"shared hit={plan.get('Shared Hit Blocks', 0)} read={plan.get('Shared Read Blocks', 0)}"
+        + (f" ({'; '.join(problems)})" if problems else "")
+    )
+    return problems
+
+async def run_plan_checks(dsn: str, users: int, wines_per_user: int, keep: bool = False) -> int:
+    conn = await asyncpg.connect(dsn)
+    try:
+        await _seed(conn, users, wines_per_user)
+        failures = 0
+        for name, check in PLAN_CHECKS.items():
+            if await _check_plan(conn, name, check):
+                failures += 1
+        return failures
+    finally:
+        if not keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {PLAN_CHECK_SCHEMA} CASCADE")
+        await conn.close()
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Fail when a fixed query's plan degrades to sequential scans")
+    parser.add_argument(
+        "--dsn", default=getenv("PLAN_CHECK_DATABASE_URL"),
+        help="scratch database to seed (defaults to PLAN_CHECK_DATABASE_URL)"
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--wines-per-user", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help=f"keep the {PLAN_CHECK_SCHEMA} schema for inspection")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("give the scratch database with --dsn or PLAN_CHECK_DATABASE_URL; it is seeded with test data")
+
+    failures = asyncio.run(run_plan_checks(args.dsn, args.users, args.wines_per_user, args.keep))
+    sys.exit(1 if failures else 0)
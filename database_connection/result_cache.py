@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from os import getenv
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import asyncpg
+from .database_connection import PRIMARY, connection_settings, get_db_connection
+from .metrics import acquire_connection
+
+# In-process cache for the admin stats endpoints. Entries are dropped when a trigger on one
+# of the tables they were built from fires a NOTIFY, and expire after RESULT_CACHE_TTL anyway
+# in case a notification is missed while the listener is reconnecting. Missing triggers are
+# created at startup; `python -m database_connection.result_cache [check|apply]` does the same.
+RESULT_CACHE_TTL = float(getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MAX_ENTRIES = int(getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+INVALIDATION_CHANNEL = "wine_cache_invalidate"
+LISTENER_KEEPALIVE = 30.0
+LISTENER_BACKOFF_MAX = 60.0
+
+CACHED_TABLES = ("wine_users", "wine_table", "wine_notes", "wine_aisummaries", "wine_contact")
+
+CACHE_NOTIFY_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION wine_cache_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{INVALIDATION_CHANNEL}', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Cached tables of the current schema without the NOTIFY trigger. Creating a trigger locks
+# its table, so existing ones are left alone rather than recreated at every startup.
+MISSING_CACHE_TRIGGERS_QUERY = """
+    SELECT t.table_name
+    FROM unnest($1::text[]) AS t(table_name)
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM pg_trigger tg
+        JOIN pg_class c ON c.oid = tg.tgrelid
+        WHERE c.relname = t.table_name
+          AND c.relnamespace = current_schema()::regnamespace
+          AND tg.tgname = 'wine_cache_notify'
+          AND NOT tg.tgisinternal
+    )
+"""
+
+def cache_trigger_ddl(table: str) -> str:
+    return f"""
+        CREATE TRIGGER wine_cache_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION wine_cache_notify()
+    """
+
+# key -> (expires_at, tables the result was built from, value), least recently used first
+_entries: "OrderedDict[Hashable, Tuple[float, frozenset, Any]]" = OrderedDict()
+
+# Bumped on every invalidation, per table and for invalidate_all(). A load that saw any
+# of its tables change while it ran may have read old data, so its result isn't cached.
+_table_generations: Dict[str, int] = {}
+_global_generation = 0
+
+cache_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "expirations": 0,
+    "evictions": 0,
+    "invalidations": 0,
+    "notifications": 0,
+    "stale_loads": 0,
+}
+
+_listener_task: Optional[asyncio.Task] = None
+_listener_connected = False
+
+def _generation(tables: frozenset) -> Tuple[int, ...]:
+    return (_global_generation, *(_table_generations.get(table, 0) for table in sorted(tables)))
+
+async def cached_result(
+    key: Hashable,
+    tables: Iterable[str],
+    loader: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    Return the cached value for key, or run loader() and cache what it returns.
+
+    loader() should read from the primary: invalidations are notified by the primary, and
+    a replica may not have caught up with the write that triggered one yet.
+    """
+    entry = _entries.get(key)
+    if entry is not None:
+        expires_at, _, value = entry
+        if expires_at > monotonic():
+            cache_stats["hits"] += 1
+            _entries.move_to_end(key)
+            return value
+        cache_stats["expirations"] += 1
+        _entries.pop(key, None)
+
+    cache_stats["misses"] += 1
+    tables = frozenset(tables)
+    generation = _generation(tables)
+    value = await loader()
+    if _generation(tables) != generation:
+        cache_stats["stale_loads"] += 1
+        return value
+    _entries[key] = (monotonic() + RESULT_CACHE_TTL, tables, value)
+    _entries.move_to_end(key)
+    while len(_entries) > RESULT_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        cache_stats["evictions"] += 1
+    return value
+
+def invalidate_table(table: str) -> None:
+    _table_generations[table] = _table_generations.get(table, 0) + 1
+    stale = [key for key, (_, tables, _) in _entries.items() if table in tables]
+    for key in stale:
+        del _entries[key]
+    cache_stats["invalidations"] += len(stale)
+
+def invalidate_all() -> None:
+    global _global_generation
+    _global_generation += 1
+    cache_stats["invalidations"] += len(_entries)
+    _entries.clear()
+
+def _on_notification(conn, pid, channel: str, payload: str) -> None:
+    cache_stats["notifications"] += 1
+    invalidate_table(payload)
+
+async def missing_cache_triggers(conn) -> List[str]:
+    rows = await conn.fetch(MISSING_CACHE_TRIGGERS_QUERY, list(CACHED_TABLES))
+    return [row["table_name"] for row in rows]
+
+async def create_cache_triggers(conn) -> List[str]:
+    """Create the NOTIFY triggers that are missing. Returns the tables they were created on."""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wine_cache_notify'))")
+        # Checked again under the lock, another worker may just have created them
+        missing = await missing_cache_triggers(conn)
+        if missing:
+            await conn.execute(CACHE_NOTIFY_FUNCTION)
+            for table in missing:
+                await conn.execute(cache_trigger_ddl(table))
+    return missing
+
+async def ensure_cache_triggers() -> None:
+    """Install the statement-level NOTIFY triggers on the cached tables that don't have one yet."""
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "ensure_cache_triggers") as conn:
+        if not await missing_cache_triggers(conn):
+            return
+        created = await create_cache_triggers(conn)
+    if created:
+        logging.info(f"Created cache invalidation triggers on {', '.join(created)}")
+
+async def _listen_for_invalidations() -> None:
+    global _listener_connected
+    attempts = 0
+    while True:
+        try:
+            # LISTEN needs a dedicated session on the primary; NOTIFY is not replicated
+            conn = await asyncpg.connect(
+                **connection_settings(PRIMARY),
+                server_settings={'application_name': 'mywine_fastapi_cache_listener'}
+            )
+        except Exception as e:
+            attempts += 1
+            delay = min(2 ** attempts, LISTENER_BACKOFF_MAX)
+            logging.error(f"Cache listener connect failed, retrying in {delay}s: {str(e)}")
+            await asyncio.sleep(delay + random.uniform(0, 1))
+            continue
+
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _: closed.set())
+        try:
+            await conn.add_listener(INVALIDATION_CHANNEL, _on_notification)
+            # Anything cached while we were not listening may be stale
+            invalidate_all()
+            _listener_connected = True
+            attempts = 0
+            while not closed.is_set():
+                try:
+                    await asyncio.wait_for(closed.wait(), timeout=LISTENER_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Surfaces a silently dropped connection
+                    await conn.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Cache listener lost its connection: {str(e)}")
+        finally:
+            _listener_connected = False
+            if not conn.is_closed():
+                conn.terminate()
+
+def start_cache_listener() -> None:
+    global _listener_task
+    if _listener_task is not None and not _listener_task.done():
+        return
+    _listener_task = asyncio.create_task(_listen_for_invalidations())
+
+async def stop_cache_listener() -> None:
+    global _listener_task
+    if _listener_task is None:
+        return
+    _listener_task.cancel()
+    try:
+        await _listener_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        _listener_task = None
+
+def get_cache_stats() -> Dict[str, Any]:
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    return {
+        **cache_stats,
+        "hit_rate": round(cache_stats["hits"] / lookups, 3) if lookups else None,
+        "entries": len(_entries),
+        "max_entries": RESULT_CACHE_MAX_ENTRIES,
+        "ttl_seconds": RESULT_CACHE_TTL,
+        "listener_connected": _listener_connected,
+    }
+
+async def _run_command(command: str) -> int:
+    conn = await asyncpg.connect(**connection_settings(PRIMARY))
+    try:
+        missing = await missing_cache_triggers(conn)
+        if command == "apply" and missing:
+            created = await create_cache_triggers(conn)
+            missing = [table for table in missing if table not in created]
+    finally:
+        await conn.close()
+
+    for table in CACHED_TABLES:
+        print(f"{'MISSING' if table in missing else 'ok':8} wine_cache_notify ON {table}")
+    return 1 if missing else 0
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Check or create the cache invalidation triggers")
+    parser.add_argument("command", choices=["check", "apply"], nargs="?", default="check")
+    raise SystemExit(asyncio.run(_run_command(parser.parse_args().command)))
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import logging
+from os import getenv
+from typing import Dict, List, Optional
+import asyncpg
+from sql_generate.database_structure import INDEXES
+from .database_connection import PRIMARY, connection_settings, get_db_connection
+from .metrics import acquire_connection
+
+# Create missing indexes at startup instead of only warning about them
+AUTO_CREATE_INDEXES = getenv("DB_AUTO_CREATE_INDEXES", "false").lower() == "true"
+
+# Index builds on large tables take a while; don't let command_timeout cut them short
+INDEX_BUILD_TIMEOUT = float(getenv("DB_INDEX_BUILD_TIMEOUT", "3600"))
+
+# Valid indexes on the given tables of the current schema. A failed CONCURRENTLY build
+# leaves an invalid index behind that IF NOT EXISTS would silently keep, so those count
+# as missing.
+EXISTING_INDEXES_QUERY = """
+    SELECT c.relname, t.relname AS table_name, pg_get_indexdef(i.indexrelid) AS definition
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_class t ON t.oid = i.indrelid
+    WHERE t.relnamespace = current_schema()::regnamespace
+      AND t.relname = ANY($1::text[])
+      AND i.indisvalid
+"""
+
+def index_ddl(name: str, spec: Dict[str, str], concurrently: bool = True) -> str:
+    ddl = f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} ON {spec['table']} ({', '.join(spec['columns'])})"
+    if spec.get("where"):
+        ddl += f" WHERE {spec['where']}"
+    return ddl
+
+def _index_body(definition: str) -> str:
+    # "CREATE [UNIQUE] INDEX name ON table USING btree (...) [WHERE ...]" without name and table
+    return definition[definition.index(" USING "):]
+
+async def _declared_bodies(conn) -> Dict[str, str]:
+    """
+    The declared indexes as PostgreSQL prints them, so expressions and predicates compare
+    the same however they are spelled. Built on empty temporary copies of their tables.
+    """
+    bodies = {}
+    async with conn.transaction():
+        for table in sorted({spec["table"] for spec in INDEXES.values()}):
+            await conn.execute(f"CREATE TEMP TABLE index_probe_{table} (LIKE {table}) ON COMMIT DROP")
+        for name, spec in INDEXES.items():
+            probe = f"index_probe_{name}"
+            await conn.execute(index_ddl(probe, {**spec, "table": f"index_probe_{spec['table']}"}, concurrently=False))
+            bodies[name] = _index_body(await conn.fetchval("SELECT pg_get_indexdef($1::regclass)", probe))
+    return bodies
+
+async def missing_indexes(conn) -> List[str]:
+    """
+    Declared indexes without a valid equivalent on their table. Indexes are compared by
+    definition, so one that exists under another name counts as present.
+    """
+    existing = await conn.fetch(EXISTING_INDEXES_QUERY, list({spec["table"] for spec in INDEXES.values()}))
+    try:
+        declared = await _declared_bodies(conn)
+    except asyncpg.PostgresError as e:
+        # Without temporary tables only the names can be compared
+        logging.warning(f"Could not compare index definitions, comparing names: {str(e)}")
+        names = {row["relname"] for row in existing}
+        return [name for name in INDEXES if name not in names]
+
+    present = {(row["table_name"], _index_body(row["definition"])) for row in existing}
+    return [name for name, spec in INDEXES.items() if (spec["table"], declared[name]) not in present]
+
+async def create_indexes(conn, names: List[str]) -> List[str]:
+    """Build the given indexes without blocking writes. Returns the ones created."""
+    # CONCURRENTLY can't run in a transaction, so take a session lock; a worker that
+    # doesn't get it leaves the build to whoever holds it
+    if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('wine_indexes'))"):
+        logging.info("Another process is building indexes, skipping")
+        return []
+
+    created = []
+    try:
+        for name in names:
+            try:
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=INDEX_BUILD_TIMEOUT)
+                await conn.execute(index_ddl(name, INDEXES[name]), timeout=INDEX_BUILD_TIMEOUT)
+            except (asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                logging.error(f"Failed to create index {name}: {str(e)}")
+                continue
+            created.append(name)
+            logging.info(f"Created index {name}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext('wine_indexes'))")
+    return created
+
+async def ensure_indexes(create: Optional[bool] = None) -> List[str]:
+    """
+    Check the indexes declared in INDEXES and build the missing ones when create is set
+    (defaults to DB_AUTO_CREATE_INDEXES). Returns the indexes still missing afterwards.
+    """
+    if create is None:
+        create = AUTO_CREATE_INDEXES
+
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "ensure_indexes") as conn:
+        missing = await missing_indexes(conn)
+        if missing and create:
+            created = await create_indexes(conn, missing)
+            missing = [name for name in missing if name not in created]
+
+    if missing:
+        logging.warning(
+            f"Missing indexes: {', '.join(missing)}. "
+            "Run `python -m database_connection.schema apply` or set DB_AUTO_CREATE_INDEXES=true"
+        )
+    return missing
+
+async def _run_command(command: str) -> int:
+    conn = await asyncpg.connect(**connection_settings(PRIMARY))
+    try:
+        missing = await missing_indexes(conn)
+        if command == "apply" and missing:
+            created = await create_indexes(conn, missing)
+            missing = [name for name in missing if name not in created]
+    finally:
+        await conn.close()
+
+    for name in INDEXES:
+        print(f"{'MISSING' if name in missing else 'ok':8} {name}: {index_ddl(name, INDEXES[name])}")
+    return 1 if missing else 0
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Check or apply the indexes the wine queries depend on")
+    parser.add_argument("command", choices=["check", "apply"], nargs="?", default="check")
+    raise SystemExit(asyncio.run(_run_command(parser.parse_args().command)))
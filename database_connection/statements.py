@@ -0,0 +1,437 @@
+import logging
+from time import perf_counter
+from typing import Any, Dict, List
+import asyncpg
+from .metrics import observe_query
+
+# Fixed queries, prepared once per pooled connection and executed by name.
+# List queries page by keyset: $1 is the last id already seen, $2 the page size (NULL = no limit).
+STATEMENTS: Dict[str, str] = {
+    "wine_notes": """
+        SELECT
+            wn.id,
+            wn.note_text,
+            wn.wine_id,
+            wt.name AS wine_name,
+            wt.user_id,
+            wu.username,
+            wu.email
+        FROM
+            wine_notes wn
+        JOIN
+            wine_table wt ON wn.wine_id = wt.id
+        JOIN
+            wine_users wu ON wt.user_id = wu.id
+        WHERE
+            wn.id > $1
+        ORDER BY
+            wn.id
+        LIMIT $2;
+    """,
+    "empty_notes": """
+        SELECT
+            wn.id,
+            wn.note_text,
+            wn.wine_id,
+            wt.name AS wine_name,
+            wt.user_id,
+            wu.username,
+            wu.email
+        FROM
+            wine_notes wn
+        JOIN
+            wine_table wt ON wn.wine_id = wt.id
+        JOIN
+            wine_users wu ON wt.user_id = wu.id
+        WHERE
+            wn.note_text = ''
+            AND wn.id > $1
+        ORDER BY
+            wn.id
+        LIMIT $2;
+    """,
+    "contact_messages": """
+        SELECT *
+        FROM wine_contact
+        WHERE id > $1
+        ORDER BY id
+        LIMIT $2;
+    """,
+    "wines_per_user": """
+        SELECT
+            wt.user_id,
+            wu.username,
+            wu.email,
+        COUNT(*) AS wine_entries,
+        COUNT(wn.id) AS wines_with_notes,
+        COUNT(was.id) AS wines_with_aisummaries
+        FROM
+            wine_table wt
+        JOIN
+            wine_users wu ON wt.user_id = wu.id
+        LEFT JOIN
+            wine_notes wn ON wt.id = wn.wine_id
+        LEFT JOIN
+            wine_aisummaries was ON wt.id = was.wine_id
+        GROUP BY
+            GROUPING SETS ((wt.user_id, wu.username, wu.email), ())
+        ORDER BY
+        wt.user_id NULLS LAST;
+    """,
+    "user_list": """
+        SELECT
+            wu.id,
+            wu.username,
+            wu.email,
+            COUNT(wt.id) AS wine_count,
+            COUNT(DISTINCT wn.wine_id) AS wines_with_notes,
+            COUNT(DISTINCT was.wine_id) AS wines_with_ai_summary
+        FROM
+            wine_users wu
+        LEFT JOIN
+            wine_table wt ON wu.id = wt.user_id
+        LEFT JOIN
+            wine_notes wn ON wt.id = wn.wine_id
+        LEFT JOIN
+            wine_aisummaries was ON wt.id = was.wine_id
+        GROUP BY
+            wu.id, wu.username, wu.email;
+    """,
+    "update_pro_status": """
+        UPDATE wine_users
+        SET has_proaccount = $1
+        WHERE id = $2
+        RETURNING id
+    """,
+    "user_wine_collection": """
+        SELECT
+            wu.username,
+            wu.email,
+            wt.name AS wine_name,
+            wt.producer,
+            wt.grapes,
+            wt.country,
+            wt.region,
+            wt.year,
+            COALESCE(wt.price, 0) as price,
+            wt.quantity,
+            wt.bottle_size,
+            wn.note_text
+        FROM
+            wine_users wu
+        JOIN
+            wine_table wt ON wu.id = wt.user_id
+        LEFT JOIN
+            wine_notes wn ON wt.id = wn.wine_id
+        WHERE
+            wu.id = $1;
+    """,
+    # Sommelier tool lookups. NULL filters match everything; each term in $2 must appear
+    # somewhere in the wine's name, producer, grapes, country or region.
+    "search_user_wines": """
+        SELECT
+            wt.id,
+            wt.name AS wine_name,
+            wt.producer,
+            wt.grapes,
+            wt.country,
+            wt.region,
+            wt.year,
+            COALESCE(wt.price, 0) AS price,
+            wt.quantity,
+            wt.bottle_size
+        FROM
+            wine_table wt
+        WHERE
+            wt.user_id = $1
+            AND ($2::text[] IS NULL OR (
+                SELECT bool_and(
+                    concat_ws(' ', wt.name, wt.producer, wt.grapes, wt.country, wt.region)
+                    ILIKE '%' || term || '%'
+                )
+                FROM unnest($2::text[]) AS term
+            ))
+            AND ($3::text IS NULL OR wt.country ILIKE $3)
+            AND ($4::text IS NULL OR wt.grapes ILIKE '%' || $4 || '%')
+            AND ($5::numeric IS NULL OR COALESCE(wt.price, 0) <= $5)
+            AND ($6::int IS NULL OR wt.year = $6)
+        ORDER BY
+            wt.price DESC NULLS LAST, wt.id
+        LIMIT $7;
+    """,
+    "user_wine_notes": """
+        SELECT
+            wt.name AS wine_name,
+            wt.producer,
+            wt.year,
+            wn.note_text,
+            wn.created_at
+        FROM
+            wine_notes wn
+        JOIN
+            wine_table wt ON wn.wine_id = wt.id
+        WHERE
+            wt.user_id = $1
+            AND wn.note_text <> ''
+            AND ($2::text IS NULL OR concat_ws(' ', wt.name, wt.producer) ILIKE '%' || $2 || '%')
+        ORDER BY
+            wn.created_at DESC, wn.id DESC
+        LIMIT $3;
+    """,
+    # AI summary cache (groq_summary/cache.py). Wines are matched on normalized name and
+    # producer, the same expressions as wine_table_name_producer_idx; $1 and $2 are the
+    # names and producers of every spelling known for the wine (groq_summary/identity.py).
+    "cached_aisummary": """
+        SELECT
+            was.summary,
+            EXTRACT(EPOCH FROM was.created_at)::float8 AS created_at,
+            lower(regexp_replace(btrim(wt.name), '\\s+', ' ', 'g')) AS name_key,
+            lower(regexp_replace(btrim(wt.producer), '\\s+', ' ', 'g')) AS producer_key
+        FROM
+            wine_table wt
+        JOIN
+            wine_aisummaries was ON was.wine_id = wt.id
+        WHERE
+            (lower(regexp_replace(btrim(wt.name), '\\s+', ' ', 'g')),
+             lower(regexp_replace(btrim(wt.producer), '\\s+', ' ', 'g')))
+                IN (SELECT * FROM unnest($1::text[], $2::text[]))
+            AND was.summary <> ''
+            AND ($3::float8 IS NULL OR was.created_at > now() - make_interval(secs => $3))
+        ORDER BY
+            was.created_at DESC
+        LIMIT 1;
+    """,
+    # Normalized names and producers of wines with a summary, to seed the identity index
+    "aisummary_wine_keys": """
+        SELECT DISTINCT
+            lower(regexp_replace(btrim(wt.name), '\\s+', ' ', 'g')) AS name_key,
+            lower(regexp_replace(btrim(wt.producer), '\\s+', ' ', 'g')) AS producer_key
+        FROM
+            wine_table wt
+        JOIN
+            wine_aisummaries was ON was.wine_id = wt.id
+        WHERE
+            was.summary <> ''
+        LIMIT $1;
+    """,
+    # Attaches a generated summary to the requesting wine, if it is that wine and has none yet
+    "store_aisummary": """
+        WITH wine AS (
+            SELECT wt.id
+            FROM wine_table wt
+            WHERE
+                wt.id = $1
+                AND lower(regexp_replace(btrim(wt.name), '\\s+', ' ', 'g')) = $2
+                AND lower(regexp_replace(btrim(wt.producer), '\\s+', ' ', 'g')) = $3
+                AND NOT EXISTS (
+                    SELECT 1 FROM wine_aisummaries
+                    WHERE wine_id = wt.id
+                        AND summary <> ''
+                        AND ($5::float8 IS NULL OR created_at > now() - make_interval(secs => $5))
+                )
+        ),
+        refreshed AS (
+            UPDATE wine_aisummaries was
+            SET summary = $4, created_at = CURRENT_TIMESTAMP
+            FROM wine
+            WHERE was.wine_id = wine.id
+            RETURNING was.id
+        ),
+        inserted AS (
+            INSERT INTO wine_aisummaries (wine_id, summary)
+            SELECT wine.id, $4
+            FROM wine
+            WHERE NOT EXISTS (SELECT 1 FROM wine_aisummaries WHERE wine_id = wine.id)
+            RETURNING id
+        )
+        SELECT id FROM refreshed
+        UNION ALL
+        SELECT id FROM inserted
+        LIMIT 1;
+    """,
+    # Wines without an AI summary, for precomputing them (jobs/summaries.py). Pages by keyset.
+    "wines_missing_aisummary": """
+        SELECT
+            wt.id,
+            wt.name,
+            wt.producer
+        FROM
+            wine_table wt
+        WHERE
+            wt.id > $1
+            AND btrim(wt.name) <> ''
+            AND btrim(wt.producer) <> ''
+            AND NOT EXISTS (SELECT 1 FROM wine_aisummaries was WHERE was.wine_id = wt.id)
+        ORDER BY
+            wt.id
+        LIMIT $2;
+    """,
+    # One row per (dimension, key) plus the totals and the most expensive wine.
+    # Reads wine_table only, so wines with several notes are counted once.
+    "user_collection_stats": """
+        WITH wines AS (
+            SELECT
+                id,
+                name,
+                producer,
+                grapes,
+                country,
+                region,
+                year,
+                COALESCE(quantity, 0) AS quantity,
+                COALESCE(price, 0) AS price,
+                COALESCE(price, 0) * COALESCE(quantity, 0) AS value
+            FROM
+                wine_table
+            WHERE
+                user_id = $1
+        ),
+        grapes AS (
+            SELECT
+                btrim(grape) AS grape,
+                quantity,
+                value
+            FROM
+                wines
+            CROSS JOIN LATERAL
+                unnest(string_to_array(grapes, ',')) AS grape
+            WHERE
+                btrim(grape) <> ''
+        )
+        SELECT 'total' AS dimension, NULL AS key, COUNT(*) AS wines,
+               COALESCE(SUM(quantity), 0) AS bottles, COALESCE(SUM(value), 0) AS value,
+               NULL AS producer, NULL::int AS year, NULL::numeric AS price
+        FROM wines
+        UNION ALL
+        SELECT 'country', country, COUNT(*), SUM(quantity), SUM(value), NULL, NULL, NULL
+        FROM wines GROUP BY country
+        UNION ALL
+        SELECT 'region', region, COUNT(*), SUM(quantity), SUM(value), NULL, NULL, NULL
+        FROM wines GROUP BY region
+        UNION ALL
+        SELECT 'producer', producer, COUNT(*), SUM(quantity), SUM(value), NULL, NULL, NULL
+        FROM wines GROUP BY producer
+        UNION ALL
+        SELECT 'year', year::text, COUNT(*), SUM(quantity), SUM(value), NULL, NULL, NULL
+        FROM wines WHERE year IS NOT NULL GROUP BY year
+        UNION ALL
+        SELECT 'grape', grape, COUNT(*), SUM(quantity), SUM(value), NULL, NULL, NULL
+        FROM grapes GROUP BY grape
+        UNION ALL
+        (
+            SELECT 'most_expensive', name, 1, quantity, value, producer, year, price
+            FROM wines
+            WHERE price > 0
+            ORDER BY price DESC, id
+            LIMIT 1
+        )
+        ORDER BY value DESC;
+    """,
+    # Cheap change detector for a user's collection: counts and high-water marks, read from
+    # the user_id and wine_id indexes, catch inserts and deletes. Edits in place don't change
+    # them; the frontend reports those through POST /chat/context/invalidate
+    "collection_fingerprint": """
+        SELECT
+            w.wine_count,
+            w.max_wine_id,
+            w.max_wine_created_at,
+            n.note_count,
+            n.max_note_id,
+            n.max_note_created_at
+        FROM
+            (
+                SELECT COUNT(*) AS wine_count, MAX(id) AS max_wine_id, MAX(created_at) AS max_wine_created_at
+                FROM wine_table
+                WHERE user_id = $1
+            ) w,
+            (
+                SELECT COUNT(*) AS note_count, MAX(wn.id) AS max_note_id, MAX(wn.created_at) AS max_note_created_at
+                FROM wine_notes wn
+                JOIN wine_table wt ON wn.wine_id = wt.id
+                WHERE wt.user_id = $1
+            ) n;
+    """,
+}
+
+# Registry counters, exposed through get_statement_stats()
+statement_stats: Dict[str, Any] = {
+    "prepare_count": 0,
+    "cache_hits": 0,
+    "statements": {},
+}
+
+class StatementConnection(asyncpg.Connection):
+    """Pool connection class that keeps the registry's prepared statements."""
+    __slots__ = ('_prepared_statements',)
+
+async def _prepare(conn, name: str) -> asyncpg.prepared_stmt.PreparedStatement:
+    statement = await conn.prepare(STATEMENTS[name])
+    conn._prepared_statements[name] = statement
+    statement_stats["prepare_count"] += 1
+    return statement
+
+async def prepare_statements(conn) -> None:
+    """Pool ``init`` hook: prepare every registered statement on a new connection."""
+    conn._prepared_statements = {}
+    for name in STATEMENTS:
+        try:
+            await _prepare(conn, name)
+        except asyncpg.PostgresError as e:
+            # Leave it to be prepared lazily so a single bad statement can't break the pool
+            logging.warning(f"Could not prepare statement '{name}': {str(e)}")
+
+async def get_statement(conn, name: str) -> asyncpg.prepared_stmt.PreparedStatement:
+    if name not in STATEMENTS:
+        raise KeyError(f"Unknown statement: {name}")
+
+    statement = conn._prepared_statements.get(name)
+    if statement is None:
+        return await _prepare(conn, name)
+
+    statement_stats["cache_hits"] += 1
+    return statement
+
+def _record_execution(name: str, elapsed_ms: float) -> None:
+    stats = statement_stats["statements"].setdefault(
+        name, {"executions": 0, "total_ms": 0.0, "max_ms": 0.0}
+    )
+    stats["executions"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    observe_query(elapsed_ms)
+
+async def _run_statement(conn, name: str, method: str, *args) -> Any:
+    statement = await get_statement(conn, name)
+    start = perf_counter()
+    try:
+        return await getattr(statement, method)(*args)
+    except asyncpg.exceptions.InvalidCachedStatementError:
+        # The schema changed under the prepared plan; prepare again and retry once
+        statement = await _prepare(conn, name)
+        return await getattr(statement, method)(*args)
+    finally:
+        _record_execution(name, (perf_counter() - start) * 1000)
+
+async def fetch_statement(conn, name: str, *args) -> List[asyncpg.Record]:
+    return await _run_statement(conn, name, "fetch", *args)
+
+async def fetchrow_statement(conn, name: str, *args) -> Any:
+    return await _run_statement(conn, name, "fetchrow", *args)
+
+async def fetchval_statement(conn, name: str, *args) -> Any:
+    return await _run_statement(conn, name, "fetchval", *args)
+
+def get_statement_stats() -> Dict[str, Any]:
+    return {
+        "prepare_count": statement_stats["prepare_count"],
+        "cache_hits": statement_stats["cache_hits"],
+        "statements": {
+            name: {
+                **stats,
+                "total_ms": round(stats["total_ms"], 2),
+                "max_ms": round(stats["max_ms"], 2),
+                "avg_ms": round(stats["total_ms"] / stats["executions"], 2) if stats["executions"] else 0.0,
+            }
+            for name, stats in statement_stats["statements"].items()
+        },
+    }
@@ -0,0 +1,39 @@
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from os import getenv
+from typing import Any, AsyncGenerator
+from .database_connection import get_read_connection
+from .metrics import acquire_connection
+from .statements import get_statement
+
+# Rows fetched per cursor round trip while streaming
+STREAM_PREFETCH = int(getenv("DB_STREAM_PREFETCH", "500"))
+
+def _json_default(value: Any) -> Any:
+    # Match what FastAPI's jsonable_encoder produces for the JSON endpoints
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+async def stream_statement_ndjson(name: str, *args) -> AsyncGenerator[bytes, None]:
+    """
+    Stream a registered statement as NDJSON through a server-side cursor.
+
+    The connection is acquired inside the generator so it is held only while the
+    response body is being written, and at most STREAM_PREFETCH rows are in memory.
+    """
+    pool = await get_read_connection()
+    async with acquire_connection(pool, f"stream_{name}") as conn:
+        statement = await get_statement(conn, name)
+        try:
+            async with conn.transaction(readonly=True):
+                async for row in statement.cursor(*args, prefetch=STREAM_PREFETCH):
+                    yield (json.dumps(dict(row), default=_json_default) + "\n").encode()
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logging.error(f"Streaming statement '{name}' failed: {str(e)}")
+            yield (json.dumps({"status": "error", "message": "Database query failed"}) + "\n").encode()
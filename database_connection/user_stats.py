@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import logging
+from decimal import Decimal
+from os import getenv
+from typing import Any, Dict, List, Optional
+import asyncpg
+from .database_connection import PRIMARY, connection_settings, get_db_connection, get_read_connection
+from .metrics import acquire_connection
+from .statements import STATEMENTS
+from .wine_queries import collection_stats_from_rows, get_wine_collection_stats
+
+# Per-user collection statistics, stored precomputed in wine_user_stats so the chat paths
+# read one row instead of aggregating the cellar on every turn.
+#
+# Statement-level triggers on wine_table only append the affected user ids to
+# wine_user_stats_changes; they take no lock that concurrent writes would queue on. A
+# background reconciler drains that change log every USER_STATS_RECONCILE_INTERVAL seconds
+# and recomputes the stats of the users in it. A user with pending changes is served the
+# live aggregate until then, so answers are never older than the database itself.
+#
+# The stats only depend on wine_table (notes and AI summaries aren't part of them).
+# Install the tables and triggers and build every user's stats with
+# `python -m database_connection.user_stats install`; `rebuild` recomputes them all again.
+# Until it is installed, stats are aggregated on every read.
+USER_STATS_RECONCILE_INTERVAL = float(getenv("USER_STATS_RECONCILE_INTERVAL", "5"))
+# Users recomputed per reconciler transaction
+USER_STATS_RECONCILE_BATCH = int(getenv("USER_STATS_RECONCILE_BATCH", "100"))
+
+USER_STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wine_user_stats (
+        user_id INTEGER PRIMARY KEY,
+        stats_rows JSONB NOT NULL,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    CREATE TABLE IF NOT EXISTS wine_user_stats_changes (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS wine_user_stats_changes_user_id_idx ON wine_user_stats_changes (user_id);
+
+    CREATE OR REPLACE FUNCTION wine_user_stats_log_new() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO wine_user_stats_changes (user_id)
+        SELECT DISTINCT user_id FROM new_rows WHERE user_id IS NOT NULL;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION wine_user_stats_log_old() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO wine_user_stats_changes (user_id)
+        SELECT DISTINCT user_id FROM old_rows WHERE user_id IS NOT NULL;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION wine_user_stats_log_moved() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO wine_user_stats_changes (user_id)
+        SELECT user_id FROM new_rows WHERE user_id IS NOT NULL
+        UNION
+        SELECT user_id FROM old_rows WHERE user_id IS NOT NULL;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS wine_user_stats_insert ON wine_table;
+    CREATE TRIGGER wine_user_stats_insert
+        AFTER INSERT ON wine_table REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION wine_user_stats_log_new();
+    DROP TRIGGER IF EXISTS wine_user_stats_update ON wine_table;
+    CREATE TRIGGER wine_user_stats_update
+        AFTER UPDATE ON wine_table REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION wine_user_stats_log_moved();
+    DROP TRIGGER IF EXISTS wine_user_stats_delete ON wine_table;
+    CREATE TRIGGER wine_user_stats_delete
+        AFTER DELETE ON wine_table REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION wine_user_stats_log_old();
+"""
+
+# Every user with wines, queued for a full rebuild
+QUEUE_ALL_USERS = """
+    INSERT INTO wine_user_stats_changes (user_id)
+    SELECT DISTINCT user_id FROM wine_table WHERE user_id IS NOT NULL;
+"""
+
+# Oldest pending users, with the change ids seen for them. Only those ids are deleted
+# once the users are recomputed; changes committed meanwhile stay for the next round.
+PENDING_USERS = """
+    SELECT user_id, array_agg(id) AS change_ids
+    FROM wine_user_stats_changes
+    GROUP BY user_id
+    ORDER BY min(id)
+    LIMIT $1;
+"""
+
+STORED_USER_STATS = """
+    SELECT
+        s.stats_rows,
+        EXISTS (SELECT 1 FROM wine_user_stats_changes c WHERE c.user_id = s.user_id) AS pending
+    FROM
+        wine_user_stats s
+    WHERE
+        s.user_id = $1;
+"""
+
+STORE_USER_STATS = """
+    INSERT INTO wine_user_stats (user_id, stats_rows, refreshed_at)
+    VALUES ($1, $2, now())
+    ON CONFLICT (user_id) DO UPDATE SET stats_rows = EXCLUDED.stats_rows, refreshed_at = now();
+"""
+
+_installed = False
+_reconciler_task: Optional[asyncio.Task] = None
+
+user_stats_stats: Dict[str, int] = {
+    "stored_reads": 0,
+    "live_reads": 0,
+    "recomputed": 0,
+    "errors": 0,
+}
+
+def _decode_rows(stats_rows: str) -> List[Dict[str, Any]]:
+    rows = json.loads(stats_rows)
+    for row in rows:
+        for field in ("value", "price"):
+            if row.get(field) is not None:
+                row[field] = Decimal(row[field])
+    return rows
+
+async def get_user_stats(user_id: int) -> Dict[str, Any]:
+    """
+    Collection statistics for one user, as get_wine_collection_stats() returns them. Read
+    from wine_user_stats when they are current, aggregated from wine_table otherwise.
+    """
+    if _installed:
+        try:
+            pool = await get_read_connection()
+            async with acquire_connection(pool, "get_user_stats") as conn:
+                row = await conn.fetchrow(STORED_USER_STATS, user_id)
+            if row is not None and not row["pending"]:
+                user_stats_stats["stored_reads"] += 1
+                return collection_stats_from_rows(_decode_rows(row["stats_rows"]))
+        except Exception as e:
+            user_stats_stats["errors"] += 1
+            logging.error(f"Failed to read stored user stats: {str(e)}")
+    user_stats_stats["live_reads"] += 1
+    return await get_wine_collection_stats(user_id)
+
+async def reconcile_user_stats(conn) -> int:
+    """Recompute the stats of up to USER_STATS_RECONCILE_BATCH pending users. Returns how many."""
+    async with conn.transaction():
+        # One reconciler at a time; the others find the work done
+        if not await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext('wine_user_stats'))"):
+            return 0
+        pending = await conn.fetch(PENDING_USERS, USER_STATS_RECONCILE_BATCH)
+        for row in pending:
+            # Also run from the CLI's plain connection, which has no prepared statements
+            stats_rows = await conn.fetch(STATEMENTS["user_collection_stats"], row["user_id"])
+            await conn.execute(
+                STORE_USER_STATS, row["user_id"], json.dumps([dict(r) for r in stats_rows], default=str)
+            )
+        await conn.execute(
+            "DELETE FROM wine_user_stats_changes WHERE id = ANY($1::bigint[])",
+            [change_id for row in pending for change_id in row["change_ids"]]
+        )
+    user_stats_stats["recomputed"] += len(pending)
+    return len(pending)
+
+async def _is_installed(conn) -> bool:
+    return await conn.fetchval(
+        "SELECT to_regclass('wine_user_stats') IS NOT NULL AND to_regclass('wine_user_stats_changes') IS NOT NULL"
+    )
+
+async def _reconcile_forever() -> None:
+    global _installed
+    while True:
+        try:
+            pool = await get_db_connection()
+            async with acquire_connection(pool, "user_stats_check") as conn:
+                installed = await _is_installed(conn)
+            break
+        except Exception as e:
+            logging.error(f"Failed to check for the user stats tables: {str(e)}")
+            await asyncio.sleep(USER_STATS_RECONCILE_INTERVAL)
+    if not installed:
+        logging.info("User stats are not installed; run `python -m database_connection.user_stats install`")
+        return
+    _installed = True
+
+    while True:
+        try:
+            async with acquire_connection(pool, "reconcile_user_stats") as conn:
+                while await reconcile_user_stats(conn) == USER_STATS_RECONCILE_BATCH:
+                    pass
+        except Exception as e:
+            user_stats_stats["errors"] += 1
+            logging.error(f"User stats reconciliation failed: {str(e)}")
+        await asyncio.sleep(USER_STATS_RECONCILE_INTERVAL)
+
+def start_user_stats_reconciler() -> None:
+    global _reconciler_task
+    if _reconciler_task is not None and not _reconciler_task.done():
+        return
+    _reconciler_task = asyncio.create_task(_reconcile_forever())
+
+async def stop_user_stats_reconciler() -> None:
+    global _reconciler_task
+    if _reconciler_task is None:
+        return
+    _reconciler_task.cancel()
+    try:
+        await _reconciler_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        _reconciler_task = None
+
+def get_user_stats_stats() -> Dict[str, Any]:
+    return {
+        **user_stats_stats,
+        "installed": _installed,
+        "reconcile_interval": USER_STATS_RECONCILE_INTERVAL,
+    }
+
+async def _run_command(command: str) -> int:
+    conn = await asyncpg.connect(**connection_settings(PRIMARY))
+    try:
+        if command == "install":
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wine_user_stats_schema'))")
+                await conn.execute(USER_STATS_SCHEMA)
+        installed = await _is_installed(conn)
+        if installed and command in ("install", "rebuild"):
+            await conn.execute(QUEUE_ALL_USERS)
+            users = 0
+            while True:
+                done = await reconcile_user_stats(conn)
+                users += done
+                if done < USER_STATS_RECONCILE_BATCH:
+                    break
+            print(f"Recomputed the stats of {users} users")
+        pending = await conn.fetchval("SELECT COUNT(DISTINCT user_id) FROM wine_user_stats_changes") if installed else None
+    finally:
+        await conn.close()
+
+    print(f"wine_user_stats: {'installed' if installed else 'not installed'}"
+          + (f", {pending} users pending" if installed else ""))
+    return 0 if installed else 1
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Install, rebuild or check the precomputed per-user collection stats")
+    parser.add_argument("command", choices=["check", "install", "rebuild"], nargs="?", default="check")
+    raise SystemExit(asyncio.run(_run_command(parser.parse_args().command)))
@@ -1,5 +1,7 @@
-from typing import List, Dict, Any
-from .database_connection import get_db_connection
+from typing import List, Dict, Any, Mapping, Optional
+from .database_connection import get_read_connection
+from .metrics import acquire_connection
+from .statements import fetch_statement, fetchrow_statement
 from collections import Counter
 from decimal import Decimal
 
@@ -13,35 +15,158 @@ async def get_user_wine_collection(user_id: int) -> List[Dict[str, Any]]:
     Returns:
         List[Dict[str, Any]]: List of wine details including user info and notes
     """
-    query = """
-    SELECT 
-        wu.username,
-        wu.email,
-        wt.name AS wine_name,
-        wt.producer,
-        wt.grapes,
-        wt.country,
-        wt.region,
-        wt.year,
-        COALESCE(wt.price, 0) as price,
-        wt.quantity,
-        wt.bottle_size,
-        wn.note_text
-    FROM 
-        wine_users wu
-    JOIN 
-        wine_table wt ON wu.id = wt.user_id
-    LEFT JOIN 
-        wine_notes wn ON wt.id = wn.wine_id
-    WHERE 
-        wu.id = $1;
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "get_user_wine_collection") as conn:
+        results = await fetch_statement(conn, "user_wine_collection", user_id)
+        return [dict(row) for row in results]
+
+async def search_user_wines(
+    user_id: int,
+    terms: Optional[List[str]] = None,
+    country: Optional[str] = None,
+    grape: Optional[str] = None,
+    max_price: Optional[Decimal] = None,
+    year: Optional[int] = None,
+    limit: int = 10,
+) -> List[Dict[str, Any]]:
     """
+    Find wines in a user's collection, most expensive first.
     
-    pool = await get_db_connection()
-    async with pool.acquire() as conn:
-        results = await conn.fetch(query, user_id)
+    Args:
+        user_id: The ID of the user whose collection to search
+        terms: Words that must all appear in the name, producer, grapes, country or region
+        country: Exact country (case-insensitive)
+        grape: Grape variety contained in the wine's grapes
+        max_price: Highest price per bottle
+        year: Vintage
+        limit: Maximum number of wines returned
+        
+    Returns:
+        List[Dict[str, Any]]: Matching wines, without notes
+    """
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "search_user_wines") as conn:
+        results = await fetch_statement(
+            conn, "search_user_wines", user_id, terms or None, country, grape, max_price, year, limit
+        )
+        return [dict(row) for row in results]
+
+async def get_user_wine_notes(user_id: int, wine: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Fetch a user's tasting notes, newest first.
+    
+    Args:
+        user_id: The ID of the user whose notes to fetch
+        wine: Only notes on wines whose name or producer contains this
+        limit: Maximum number of notes returned
+        
+    Returns:
+        List[Dict[str, Any]]: Notes with the wine's name, producer and year
+    """
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "get_user_wine_notes") as conn:
+        results = await fetch_statement(conn, "user_wine_notes", user_id, wine, limit)
         return [dict(row) for row in results]
 
+async def get_collection_fingerprint(user_id: int) -> tuple:
+    """
+    Fingerprint of a user's wines and notes; it changes when either is added or removed.
+    
+    Args:
+        user_id: The ID of the user whose collection to fingerprint
+        
+    Returns:
+        tuple: Opaque, comparable value
+    """
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "get_collection_fingerprint") as conn:
+        row = await fetchrow_statement(conn, "collection_fingerprint", user_id)
+        return tuple(row.values())
+
+async def get_wine_collection_stats(user_id: int) -> Dict[str, Any]:
+    """
+    Aggregate a user's collection in PostgreSQL in a single round trip.
+    
+    Args:
+        user_id: The ID of the user whose wine collection to analyze
+        
+    Returns:
+        Dict of collection stats, see collection_stats_from_rows()
+    """
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "get_wine_collection_stats") as conn:
+        rows = await fetch_statement(conn, "user_collection_stats", user_id)
+    return collection_stats_from_rows(rows)
+
+def collection_stats_from_rows(rows: List[Mapping[str, Any]]) -> Dict[str, Any]:
+    """
+    Assemble the stats dict from the rows of the user_collection_stats statement.
+    
+    Args:
+        rows: user_collection_stats rows, as records or dicts
+        
+    Returns:
+        Dict with total_bottles, total_unique_wines, total_value and average_bottle_value;
+        bottle Counters by countries, regions, grapes, producers and years; value_by_country,
+        value_by_region, value_by_producer and value_by_grape sorted by value, descending;
+        and most_expensive {"wine", "price", "producer", "year"}. {"error"} when the user
+        has no wines
+    """
+    totals = next(row for row in rows if row["dimension"] == "total")
+    if not totals["wines"]:
+        return {"error": "No wines found in collection"}
+    
+    stats = {
+        "total_bottles": totals["bottles"],
+        "total_unique_wines": totals["wines"],
+        "countries": Counter(),
+        "regions": Counter(),
+        "grapes": Counter(),
+        "most_expensive": {"wine": None, "price": Decimal('0'), "producer": None, "year": None},
+        "years": Counter(),
+        "producers": Counter(),
+        "total_value": totals["value"],
+        "value_by_country": {},
+        "value_by_region": {},
+        "value_by_producer": {},
+        "value_by_grape": {},
+        "average_bottle_value": Decimal('0')
+    }
+    
+    # Rows arrive ordered by value, so the value_by_* dicts come out sorted descending
+    for row in rows:
+        dimension, key = row["dimension"], row["key"]
+        if dimension == "country":
+            stats["countries"][key] += row["bottles"]
+            stats["value_by_country"][key] = row["value"]
+        elif dimension == "region":
+            stats["regions"][key] += row["bottles"]
+            stats["value_by_region"][key] = row["value"]
+        elif dimension == "producer":
+            if key:
+                stats["producers"][key] += row["bottles"]
+            stats["value_by_producer"][key] = row["value"]
+        elif dimension == "grape":
+            stats["grapes"][key] += row["bottles"]
+            stats["value_by_grape"][key] = row["value"]
+        elif dimension == "year":
+            stats["years"][int(key)] += row["bottles"]
+        elif dimension == "most_expensive":
+            stats["most_expensive"] = {
+                "wine": key,
+                "price": row["price"],
+                "producer": row["producer"],
+                "year": row["year"]
+            }
+    
+    if stats["total_bottles"] > 0:
+        stats["average_bottle_value"] = stats["total_value"] / Decimal(str(stats["total_bottles"]))
+    
+    return stats
+
+# Python version of get_wine_collection_stats(), over rows of get_user_wine_collection().
+# Nothing in the app calls it any more; it is kept as the reference the SQL aggregation was
+# checked against, and for chat/agents/groq_triage_backup.py.
 async def analyze_wine_collection(wines: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Analyze the wine collection to provide useful statistics including value calculations.
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+from os import getenv
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from fastapi import HTTPException
+from .cache import get_cached_summary, store_summary, summary_key
+from .canonical import CanonicalKey
+from .identity import resolve_identity
+from .summary import generate_identity_summary
+
+# Summaries generated at once for one batch request. The LLM gateway still caps the total
+# across requests; this keeps a single large import from taking every slot.
+BATCH_CONCURRENCY = int(getenv("AI_SUMMARY_BATCH_CONCURRENCY", "4"))
+# Cache lookups and stores at once for one batch request, so a large batch doesn't queue
+# up on the database pool ahead of every other request
+BATCH_LOOKUP_CONCURRENCY = int(getenv("AI_SUMMARY_BATCH_LOOKUP_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(getenv("AI_SUMMARY_BATCH_MAX_ITEMS", "500"))
+
+def _line(item: Dict[str, Any]) -> bytes:
+    return json.dumps(item).encode() + b"\n"
+
+def _wine_details(wine: Dict[str, str]) -> Dict[str, str]:
+    return {"wine_id": wine["wine_id"], "name": wine["wine_name"], "producer": wine["wine_producer"]}
+
+def _wine_id(wine_id: str) -> Optional[int]:
+    return int(wine_id) if wine_id.isdigit() else None
+
+async def _resolve(
+    identity: CanonicalKey,
+    wines: List[Dict[str, str]],
+    lookups: asyncio.Semaphore,
+    generations: asyncio.Semaphore,
+    store_cached: bool = False,
+) -> List[Dict[str, Any]]:
+    """One summary for every wine of one identity: cached, or generated. Both are bounded."""
+    first = wines[0]
+    key = summary_key(first["wine_name"], first["wine_producer"])
+    try:
+        async with lookups:
+            summary = await get_cached_summary(key, identity)
+        cached = summary is not None
+        if not cached:
+            async with generations:
+                # Another batch may have generated it while this one waited
+                summary = await get_cached_summary(key, identity)
+                cached = summary is not None
+                if not cached:
+                    summary = await generate_identity_summary(first["wine_name"], first["wine_producer"], identity)
+            if not summary:
+                raise HTTPException(status_code=500, detail="Failed to generate summary: No content received")
+        if store_cached or not cached:
+            async with lookups:
+                for wine in wines:
+                    await store_summary(
+                        summary_key(wine["wine_name"], wine["wine_producer"]), summary,
+                        _wine_id(wine["wine_id"]), identity
+                    )
+        result = {"summary": summary, "cached": cached}
+    except HTTPException as e:
+        result = {"error": e.detail, "status_code": e.status_code}
+    except Exception as e:
+        logging.error(f"Batch summary failed: {str(e)}")
+        result = {"error": f"Failed to generate summary: {str(e)}", "status_code": 500}
+
+    return [{**_wine_details(wine), **result} for wine in wines]
+
+async def summarize_wines(
+    wines: List[Dict[str, str]],
+    store_cached: bool = False,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Summaries for a batch of wines, one result per wine, in the order they complete.
+
+    Wines with the same canonical identity share one lookup or generation. At
+    most AI_SUMMARY_BATCH_LOOKUP_CONCURRENCY cache lookups or stores run and
+    AI_SUMMARY_BATCH_CONCURRENCY summaries are generated at a time. Failures are
+    reported per wine as {"error", "status_code"} results. Pending work is cancelled when
+    the consumer goes away. With store_cached, summaries found in the cache (for a spelling
+    variant of the wine, say) are also stored for each wine, as generated ones are.
+    """
+    groups: Dict[CanonicalKey, List[Dict[str, str]]] = {}
+    for wine in wines:
+        if not wine["wine_name"] or not wine["wine_producer"]:
+            yield {**_wine_details(wine), "error": "Wine name and producer are required", "status_code": 400}
+            continue
+        identity = resolve_identity(summary_key(wine["wine_name"], wine["wine_producer"]))
+        groups.setdefault(identity, []).append(wine)
+
+    lookups = asyncio.Semaphore(BATCH_LOOKUP_CONCURRENCY)
+    generations = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_resolve(identity, group, lookups, generations, store_cached))
+        for identity, group in groups.items()
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def stream_wine_summaries(wines: List[Dict[str, str]]) -> AsyncGenerator[bytes, None]:
+    """summarize_wines() as NDJSON, one line per wine."""
+    results = summarize_wines(wines)
+    try:
+        async for result in results:
+            yield _line(result)
+    finally:
+        await results.aclose()
@@ -0,0 +1,130 @@
+import logging
+from collections import OrderedDict
+from os import getenv
+from time import time
+from typing import Any, Dict, Optional, Tuple
+from database_connection import get_db_connection, get_read_connection, fetchrow_statement, fetchval_statement
+from database_connection.metrics import acquire_connection
+from .canonical import CanonicalKey, SummaryKey
+from .identity import add_identity, get_identity_stats, identity_keys, resolve_identity
+
+# Read-through cache for AI summaries. Many users own the same wine, so a summary generated
+# for one of them serves everyone: first from an in-process LRU, then from wine_aisummaries
+# (any wine with the same normalized name and producer), and only then from the LLM.
+# Both are keyed on the wine's canonical identity (identity.py), so spelling variants of a
+# wine ("Château Margaux 2015", "chateau margaux") share one summary.
+SUMMARY_CACHE_MAX_ENTRIES = int(getenv("AI_SUMMARY_CACHE_MAX_ENTRIES", "4096"))
+# Summaries older than this are generated again; 0 keeps them forever
+SUMMARY_MAX_AGE_DAYS = float(getenv("AI_SUMMARY_MAX_AGE_DAYS", "180"))
+# Attach generated summaries to the requesting wine in wine_aisummaries
+SUMMARY_STORE = getenv("AI_SUMMARY_STORE", "true").lower() == "true"
+
+# canonical (name, producer) -> (summary, created_at), least recently used first
+_summaries: "OrderedDict[CanonicalKey, Tuple[str, float]]" = OrderedDict()
+
+summary_cache_stats: Dict[str, int] = {
+    "memory_hits": 0,
+    "database_hits": 0,
+    "misses": 0,
+    "stored": 0,
+    "evictions": 0,
+    "errors": 0,
+}
+
+def _normalize(text: str) -> str:
+    # Same as lower(regexp_replace(btrim(...), '\s+', ' ', 'g')) in the cache statements
+    return " ".join(text.split()).lower()
+
+def summary_key(wine_name: str, wine_producer: str) -> SummaryKey:
+    return _normalize(wine_name), _normalize(wine_producer)
+
+def _max_age() -> Optional[float]:
+    return SUMMARY_MAX_AGE_DAYS * 86400 if SUMMARY_MAX_AGE_DAYS > 0 else None
+
+def _remember(key: CanonicalKey, summary: str, created_at: float) -> None:
+    _summaries[key] = (summary, created_at)
+    _summaries.move_to_end(key)
+    while len(_summaries) > SUMMARY_CACHE_MAX_ENTRIES:
+        _summaries.popitem(last=False)
+        summary_cache_stats["evictions"] += 1
+
+async def get_cached_summary(key: SummaryKey, identity: Optional[CanonicalKey] = None) -> Optional[str]:
+    """
+    A fresh summary for the wine or a spelling variant of it, or None. Database errors count
+    as a miss. identity is resolve_identity(key), when the caller already has it.
+    """
+    max_age = _max_age()
+    if identity is None:
+        identity = resolve_identity(key)
+    entry = _summaries.get(identity)
+    if entry is not None:
+        summary, created_at = entry
+        if max_age is None or time() - created_at < max_age:
+            summary_cache_stats["memory_hits"] += 1
+            _summaries.move_to_end(identity)
+            return summary
+        del _summaries[identity]
+
+    keys = [key] + [known for known in identity_keys(identity) if known != key]
+    try:
+        pool = await get_read_connection()
+        async with acquire_connection(pool, "cached_aisummary") as conn:
+            row = await fetchrow_statement(
+                conn, "cached_aisummary", [name for name, _ in keys], [producer for _, producer in keys], max_age
+            )
+    except Exception as e:
+        summary_cache_stats["errors"] += 1
+        logging.error(f"AI summary cache lookup failed: {str(e)}")
+        row = None
+
+    if row is None:
+        summary_cache_stats["misses"] += 1
+        return None
+    summary_cache_stats["database_hits"] += 1
+    add_identity(identity, (row["name_key"], row["producer_key"]))
+    _remember(identity, row["summary"], row["created_at"])
+    return row["summary"]
+
+async def store_summary(
+    key: SummaryKey,
+    summary: str,
+    wine_id: Optional[int] = None,
+    identity: Optional[CanonicalKey] = None,
+) -> None:
+    """
+    Cache a freshly generated summary. With AI_SUMMARY_STORE it is also saved for wine_id,
+    provided that wine has this name and producer and no fresh summary yet; an expired one
+    is replaced. identity is resolve_identity(key), when the caller already has it.
+    """
+    if identity is None:
+        identity = resolve_identity(key)
+    add_identity(identity)
+    _remember(identity, summary, time())
+    if not SUMMARY_STORE or wine_id is None:
+        return
+    try:
+        pool = await get_db_connection()
+        async with acquire_connection(pool, "store_aisummary") as conn:
+            async with conn.transaction():
+                # Serializes concurrent stores for the same wine, so it gets one summary
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wine_aisummaries'), $1)", wine_id)
+                stored = await fetchval_statement(
+                    conn, "store_aisummary", wine_id, key[0], key[1], summary, _max_age()
+                )
+        if stored is not None:
+            summary_cache_stats["stored"] += 1
+            add_identity(identity, key)
+    except Exception as e:
+        # The summary was still generated and returned; the next miss generates it again
+        summary_cache_stats["errors"] += 1
+        logging.error(f"Failed to store AI summary: {str(e)}")
+
+def get_summary_cache_stats() -> Dict[str, Any]:
+    return {
+        **summary_cache_stats,
+        "entries": len(_summaries),
+        "max_entries": SUMMARY_CACHE_MAX_ENTRIES,
+        "max_age_days": SUMMARY_MAX_AGE_DAYS,
+        "store": SUMMARY_STORE,
+        "identity": get_identity_stats(),
+    }
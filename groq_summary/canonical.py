@@ -0,0 +1,101 @@
+import re
+import unicodedata
+from typing import Dict, FrozenSet, Optional, Tuple
+
+# Canonical form of the free-text wine names and producers users type in, so spelling
+# variants of one wine share one AI summary: "Château Margaux 2015", "chateau  margaux"
+# and "Ch. Margaux" are all named "chateau margaux".
+#
+# Names and producers are Unicode-folded (NFKD, accents stripped, casefolded), punctuation
+# is dropped and common abbreviations are spelled out. The vintage is taken out of the
+# name: summaries describe the wine, not a single year. Producers also lose legal forms
+# and generic estate words ("Domaine Leflaive" is "leflaive").
+
+# Spelled-out forms of abbreviations, for names and producers alike
+ABBREVIATIONS: Dict[str, str] = {
+    "ch": "chateau",
+    "chat": "chateau",
+    "cht": "chateau",
+    "dom": "domaine",
+    "st": "saint",
+    "ste": "sainte",
+    "mt": "mont",
+    "et": "and",
+    "und": "and",
+    "y": "and",
+    "e": "and",
+}
+
+# Words dropped from producers, as long as something is left
+PRODUCER_STOPWORDS: FrozenSet[str] = frozenset({
+    # Legal forms
+    "sa", "sas", "sarl", "earl", "gaec", "scea", "gmbh", "ag", "kg", "srl", "spa", "sl",
+    "llc", "inc", "ltd", "co",
+    # Generic estate words
+    "domaine", "chateau", "weingut", "winery", "wines", "estate", "estates", "vineyards",
+    "cellars", "bodega", "bodegas", "tenuta", "cantina", "cantine", "azienda", "agricola",
+    "maison", "clos", "quinta", "the", "de", "du", "des", "la", "le", "les", "di", "del",
+    "von", "van", "and",
+})
+
+# Producers known under several names, by canonical form
+PRODUCER_ALIASES: Dict[str, str] = {
+    "drc": "romanee conti",
+    "mouton": "mouton rothschild",
+    "lafite": "lafite rothschild",
+    "moet": "moet chandon",
+    "veuve clicquot ponsardin": "veuve clicquot",
+}
+
+# Vintage years and non-vintage markers
+_VINTAGE = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+_NON_VINTAGE = {"nv", "mv", "sa"}
+_NON_WORD = re.compile(r"\W+")
+
+# Normalized (lowercased, whitespace collapsed) name and producer, as matched in SQL
+SummaryKey = Tuple[str, str]
+CanonicalKey = Tuple[str, str]
+
+def fold(text: str) -> str:
+    """Lowercase ASCII-ish form: accents stripped, compatibility characters decomposed."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return stripped.casefold().replace("ß", "ss").replace("œ", "oe").replace("æ", "ae")
+
+def _words(text: str) -> list:
+    text = _NON_WORD.sub(" ", fold(text).replace("&", " and "))
+    return [ABBREVIATIONS.get(word, word) for word in text.split()]
+
+def split_vintage(wine_name: str) -> Tuple[str, Optional[int]]:
+    """The name without its vintage, and the vintage (None for non-vintage wines)."""
+    vintages = _VINTAGE.findall(wine_name)
+    name = _VINTAGE.sub(" ", wine_name)
+    return name, int(vintages[-1]) if vintages else None
+
+def canonical_name(wine_name: str) -> str:
+    name, _ = split_vintage(wine_name)
+    words = [word for word in _words(name) if word not in _NON_VINTAGE]
+    return " ".join(words)
+
+def canonical_producer(wine_producer: str) -> str:
+    words = _words(wine_producer)
+    kept = [word for word in words if word not in PRODUCER_STOPWORDS]
+    producer = " ".join(kept or words)
+    return PRODUCER_ALIASES.get(producer, producer)
+
+def canonical_key(wine_name: str, wine_producer: str) -> CanonicalKey:
+    return canonical_name(wine_name), canonical_producer(wine_producer)
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Trigrams of each word padded like pg_trgm: two spaces in front, one behind."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Share of trigrams in common, as pg_trgm's similarity()."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from math import ceil
+from os import getenv
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+from database_connection import get_read_connection, fetch_statement
+from database_connection.metrics import acquire_connection
+from .canonical import CanonicalKey, SummaryKey, canonical_key, similarity, trigrams
+
+# In-process index of the wines this app knows, by canonical identity (see canonical.py).
+# A wine is first reduced to its canonical key; when that key is new, the closest known
+# producer and then the closest of its wines are looked up by trigram similarity, so typos
+# and leftover variants ("chateau margau") still land on the known wine. Candidates come
+# from trigram postings; only the rarest few trigrams of the looked-up text are read, as
+# any text similar enough must share at least one of them.
+#
+# Each identity also remembers a few exact (normalized) name/producer pairs of wines that
+# have a stored summary, which is how the summary cache finds it in wine_aisummaries.
+# Seeded from wine_aisummaries in the background at startup and kept current as summaries
+# are stored; until the seed is done, summaries are still found by their exact name.
+MATCH_THRESHOLD = float(getenv("AI_SUMMARY_MATCH_THRESHOLD", "0.8"))
+IDENTITY_MAX_ENTRIES = int(getenv("AI_SUMMARY_IDENTITY_MAX_ENTRIES", "50000"))
+# Exact pairs kept per identity for the database lookup
+KEYS_PER_IDENTITY = 8
+# Seed rows indexed between yields to the event loop
+LOAD_CHUNK = 200
+
+# canonical producer -> {"trigrams", "names": {canonical name -> {"trigrams", "keys"}},
+#                        "postings": {trigram -> canonical names containing it}}
+_producers: Dict[str, Dict[str, Any]] = {}
+# trigram -> canonical producers containing it
+_producer_postings: Dict[str, Set[str]] = {}
+_entries = 0
+_loader_task: Optional[asyncio.Task] = None
+
+identity_stats: Dict[str, int] = {
+    "exact": 0,
+    "fuzzy": 0,
+    "unknown": 0,
+    "full": 0,
+}
+
+def _closest(
+    postings: Dict[str, Set[str]],
+    entries: Dict[str, Dict[str, Any]],
+    target: FrozenSet[str],
+) -> Optional[str]:
+    """The entry most similar to target, at least MATCH_THRESHOLD, or None."""
+    if not target:
+        return None
+    # Similarity >= t needs at least ceil(t * |target|) shared trigrams, so a match shares
+    # one of any |target| - shared + 1 of them; the rarest have the shortest postings
+    shared = max(1, ceil(MATCH_THRESHOLD * len(target) - 1e-9))
+    rarest = sorted(target, key=lambda gram: len(postings.get(gram, ())))[:len(target) - shared + 1]
+    candidates = set().union(*(postings.get(gram, ()) for gram in rarest))
+
+    best, best_score = None, MATCH_THRESHOLD
+    for text in candidates:
+        grams = entries[text]["trigrams"]
+        if len(grams) < shared or len(grams) * MATCH_THRESHOLD > len(target):
+            continue
+        score = similarity(grams, target)
+        if score >= best_score:
+            best, best_score = text, score
+    return best
+
+def _closest_producer(producer: str) -> Optional[str]:
+    if producer in _producers:
+        return producer
+    if MATCH_THRESHOLD >= 1:
+        return None
+    return _closest(_producer_postings, _producers, trigrams(producer))
+
+def _match(key: SummaryKey) -> Tuple[CanonicalKey, str]:
+    name, producer = canonical_key(*key)
+    known_producer = _closest_producer(producer)
+    if known_producer is None:
+        return (name, producer), "unknown"
+
+    entry = _producers[known_producer]
+    if name in entry["names"]:
+        return (name, known_producer), "exact" if known_producer == producer else "fuzzy"
+    known_name = None if MATCH_THRESHOLD >= 1 else _closest(entry["postings"], entry["names"], trigrams(name))
+    if known_name is None:
+        return (name, known_producer), "unknown"
+    return (known_name, known_producer), "fuzzy"
+
+def resolve_identity(key: SummaryKey) -> CanonicalKey:
+    """Canonical identity of the wine with this normalized name and producer."""
+    identity, outcome = _match(key)
+    identity_stats[outcome] += 1
+    return identity
+
+def add_identity(identity: CanonicalKey, key: Optional[SummaryKey] = None) -> None:
+    """Make identity known, with key as one of its wines that has a stored summary."""
+    global _entries
+    name, producer = identity
+    entry = _producers.get(producer, {}).get("names", {}).get(name)
+    if entry is None:
+        if _entries >= IDENTITY_MAX_ENTRIES:
+            identity_stats["full"] += 1
+            return
+        if producer not in _producers:
+            grams = trigrams(producer)
+            _producers[producer] = {"trigrams": grams, "names": {}, "postings": {}}
+            for gram in grams:
+                _producer_postings.setdefault(gram, set()).add(producer)
+        known = _producers[producer]
+        entry = known["names"][name] = {"trigrams": trigrams(name), "keys": []}
+        for gram in entry["trigrams"]:
+            known["postings"].setdefault(gram, set()).add(name)
+        _entries += 1
+    if key is not None and key not in entry["keys"] and len(entry["keys"]) < KEYS_PER_IDENTITY:
+        entry["keys"].append(key)
+
+def identity_keys(identity: CanonicalKey) -> List[SummaryKey]:
+    """Exact name/producer pairs known to have a summary for this identity."""
+    name, producer = identity
+    entry = _producers.get(producer, {}).get("names", {}).get(name)
+    return list(entry["keys"]) if entry is not None else []
+
+async def load_wine_identities() -> int:
+    """Index the wines that already have a summary. Returns the number of pairs read."""
+    try:
+        pool = await get_read_connection()
+        async with acquire_connection(pool, "aisummary_wine_keys") as conn:
+            rows = await fetch_statement(conn, "aisummary_wine_keys", IDENTITY_MAX_ENTRIES)
+    except Exception as e:
+        # The index fills up as summaries are generated
+        logging.error(f"Failed to load wine identities: {str(e)}")
+        return 0
+
+    for start in range(0, len(rows), LOAD_CHUNK):
+        for row in rows[start:start + LOAD_CHUNK]:
+            key = (row["name_key"], row["producer_key"])
+            add_identity(_match(key)[0], key)
+        # Requests keep being served while a large seed is indexed
+        await asyncio.sleep(0)
+    logging.info(f"Indexed {len(rows)} wines with AI summaries into {_entries} identities")
+    return len(rows)
+
+def start_identity_loader() -> None:
+    """Run load_wine_identities() in the background, so startup doesn't wait for it."""
+    global _loader_task
+    if _loader_task is not None and not _loader_task.done():
+        return
+    _loader_task = asyncio.create_task(load_wine_identities())
+
+async def stop_identity_loader() -> None:
+    global _loader_task
+    if _loader_task is None:
+        return
+    _loader_task.cancel()
+    try:
+        await _loader_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        _loader_task = None
+
+def get_identity_stats() -> Dict[str, Any]:
+    return {
+        **identity_stats,
+        "producers": len(_producers),
+        "identities": _entries,
+        "max_entries": IDENTITY_MAX_ENTRIES,
+        "match_threshold": MATCH_THRESHOLD,
+        "loading": _loader_task is not None and not _loader_task.done(),
+    }
@@ -1,8 +1,12 @@
 import os
-from typing import Optional
+from typing import Optional, Tuple
 from groq import AsyncGroq
 from fastapi import HTTPException
 import logging
+from llm_gateway import shared_chat_completion, single_flight
+from .cache import get_cached_summary, store_summary, summary_key
+from .canonical import CanonicalKey, split_vintage
+from .identity import resolve_identity
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +20,8 @@ if not GROQ_API_KEY:
 
 # Initialize Groq client
 try:
-    client = AsyncGroq(api_key=GROQ_API_KEY)
+    # Retries are handled by the LLM gateway
+    client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
 except Exception as e:
     logger.error(f"Failed to initialize Groq client: {str(e)}")
     raise RuntimeError(f"Failed to initialize Groq client: {str(e)}")
@@ -31,7 +36,8 @@ async def generate_wine_summary(wine_name: str, wine_producer: str) -> Optional[
         user_prompt = f"Please provide a brief summary of {wine_name} from {wine_producer}."
         
         logger.info("Sending request to Groq API")
-        response = await client.chat.completions.create(
+        response = await shared_chat_completion(
+            client,
             messages=[
                 {
                     "role": "system",
@@ -60,10 +66,50 @@ async def generate_wine_summary(wine_name: str, wine_producer: str) -> Optional[
         logger.info(f"Successfully generated wine summary: {summary}")
         return summary
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating wine summary: {str(e)}")
         # Include the specific error in the exception
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate summary: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+async def generate_identity_summary(
+    wine_name: str,
+    wine_producer: str,
+    identity: Optional[CanonicalKey] = None,
+) -> Optional[str]:
+    """
+    generate_wine_summary(), shared with concurrent requests for spelling variants of the wine.
+
+    The summary serves every vintage of the wine, so it is generated for the name without
+    its vintage.
+    """
+    if identity is None:
+        identity = resolve_identity(summary_key(wine_name, wine_producer))
+    name = " ".join(split_vintage(wine_name)[0].split()) or wine_name
+    return await single_flight(
+        f"aisummary:{identity[0]}|{identity[1]}",
+        lambda: generate_wine_summary(name, wine_producer)
+    )
+
+async def get_wine_summary(wine_name: str, wine_producer: str, wine_id: Optional[int] = None) -> Tuple[str, bool]:
+    """
+    Summary of a wine, from the summary cache when possible; generated and cached otherwise.
+
+    Returns (summary, cached). wine_id is the requesting wine, which a generated summary is
+    stored for.
+    """
+    key = summary_key(wine_name, wine_producer)
+    identity = resolve_identity(key)
+    summary = await get_cached_summary(key, identity)
+    if summary is not None:
+        logger.info(f"Serving cached summary for wine: {wine_name} from {wine_producer}")
+        return summary, True
+
+    summary = await generate_identity_summary(wine_name, wine_producer, identity)
+    if summary:
+        await store_summary(key, summary, wine_id, identity)
+    return summary, False
@@ -16,9 +16,9 @@ ALGORITHM = "HS256"
 
 security = HTTPBearer()
 
-async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+def decode_token(token: str) -> dict:
+    """Decode and validate a user JWT. Raises a 401 HTTPException when it is invalid or expired."""
     try:
-        token = credentials.credentials
         logging.info(f"Attempting to verify token: {token[:10]}...")
         
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
@@ -34,6 +34,8 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
             )
             
         return payload
+    except HTTPException:
+        raise
     except JWTError as e:
         logging.error(f"JWT Error during token verification: {str(e)}")
         raise HTTPException(
@@ -49,6 +51,9 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return decode_token(credentials.credentials)
+
 def create_admin_token(data: dict, expires_delta: timedelta) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
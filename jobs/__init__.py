@@ -0,0 +1,7 @@
+from .queue import (register_job, submit_job, get_job, ensure_job_schema, start_job_workers,
+                    stop_job_workers, get_job_stats)
+from .summaries import AISUMMARIES_JOB, PRECOMPUTE_JOB, PRECOMPUTE_ON_STARTUP, submit_precompute
+
+__all__ = ['register_job', 'submit_job', 'get_job', 'ensure_job_schema', 'start_job_workers',
+           'stop_job_workers', 'get_job_stats', 'AISUMMARIES_JOB', 'PRECOMPUTE_JOB',
+           'PRECOMPUTE_ON_STARTUP', 'submit_precompute']
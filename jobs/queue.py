@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import secrets
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncpg
+from database_connection import get_db_connection
+from database_connection.metrics import acquire_connection
+
+# Background jobs, persisted in wine_jobs so they survive restarts and are shared between
+# workers. Each app worker runs JOBS_WORKERS asyncio tasks that claim queued jobs with
+# FOR UPDATE SKIP LOCKED, run the handler registered for the job's kind and store its
+# result. While a job runs its worker renews the lease every third of JOBS_LEASE_SECONDS;
+# a job whose lease runs out (its worker died) is picked up again, and failed jobs are
+# retried with backoff, both up to JOBS_MAX_ATTEMPTS times. Outcomes are only recorded by
+# the worker that holds the current attempt, so a worker that lost its lease can't
+# overwrite the result of the one that took over.
+JOBS_ENABLED = getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_WORKERS = int(getenv("JOBS_WORKERS", "2"))
+# Idle workers look for new jobs this often; jobs submitted by this worker wake them at once
+JOBS_POLL_INTERVAL = float(getenv("JOBS_POLL_INTERVAL", "5"))
+JOBS_LEASE_SECONDS = float(getenv("JOBS_LEASE_SECONDS", "900"))
+JOBS_MAX_ATTEMPTS = int(getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETRY_DELAY = float(getenv("JOBS_RETRY_DELAY", "30"))
+# Finished jobs are deleted after this long
+JOBS_RETENTION_SECONDS = float(getenv("JOBS_RETENTION_SECONDS", "604800"))
+
+JOB_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wine_jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        dedupe_key TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result JSONB,
+        error TEXT,
+        run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+        locked_until TIMESTAMPTZ,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    );
+
+    CREATE INDEX IF NOT EXISTS wine_jobs_queued_idx ON wine_jobs (run_after) WHERE status = 'queued';
+    CREATE INDEX IF NOT EXISTS wine_jobs_running_idx ON wine_jobs (locked_until) WHERE status = 'running';
+    CREATE INDEX IF NOT EXISTS wine_jobs_finished_at_idx ON wine_jobs (finished_at);
+    -- At most one waiting job per dedupe key; a running job may queue its own follow-up
+    CREATE UNIQUE INDEX IF NOT EXISTS wine_jobs_dedupe_key_idx ON wine_jobs (dedupe_key)
+        WHERE status = 'queued';
+"""
+
+# Oldest due job, or a running one whose worker stopped renewing its lease
+CLAIM_JOB = """
+    UPDATE wine_jobs
+    SET status = 'running', attempts = attempts + 1, started_at = now(),
+        locked_until = now() + make_interval(secs => $1)
+    WHERE job_id = (
+        SELECT job_id FROM wine_jobs
+        WHERE (status = 'queued' AND run_after <= now())
+           OR (status = 'running' AND locked_until < now() AND attempts < $2)
+        ORDER BY run_after, created_at
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING job_id, kind, payload, attempts;
+"""
+
+# Jobs whose worker died on every attempt, so they aren't claimed again forever
+EXPIRE_JOBS = """
+    UPDATE wine_jobs
+    SET status = 'failed', error = 'Lease expired on the last attempt', finished_at = now(),
+        locked_until = NULL
+    WHERE status = 'running' AND locked_until < now() AND attempts >= $1;
+"""
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# kind -> coroutine taking the payload and returning a JSON-serializable result
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+job_stats: Dict[str, int] = {
+    "submitted": 0,
+    "deduplicated": 0,
+    "started": 0,
+    "succeeded": 0,
+    "retried": 0,
+    "failed": 0,
+    "expired": 0,
+    "leases_lost": 0,
+    "errors": 0,
+}
+
+def register_job(kind: str, handler: JobHandler) -> None:
+    JOB_HANDLERS[kind] = handler
+
+def _job_dict(row) -> Dict[str, Any]:
+    job = dict(row)
+    for field in ("payload", "result"):
+        if job.get(field) is not None:
+            job[field] = json.loads(job[field])
+    return job
+
+async def submit_job(kind: str, payload: Optional[Dict[str, Any]] = None, dedupe_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Queue a job of a registered kind. Returns {"job_id", "status"}.
+
+    With a dedupe_key, a job with the same key that is still waiting to run is returned
+    instead of queueing another one.
+    """
+    if kind not in JOB_HANDLERS:
+        raise KeyError(f"Unknown job kind: {kind}")
+
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "submit_job") as conn:
+        row = await conn.fetchrow("""
+            INSERT INTO wine_jobs (job_id, kind, payload, dedupe_key)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (dedupe_key) WHERE status = 'queued' DO NOTHING
+            RETURNING job_id, status
+        """, secrets.token_urlsafe(16), kind, json.dumps(payload or {}), dedupe_key)
+        if row is None:
+            job_stats["deduplicated"] += 1
+            row = await conn.fetchrow("""
+                SELECT job_id, status FROM wine_jobs
+                WHERE dedupe_key = $1 AND status = 'queued'
+            """, dedupe_key)
+            if row is not None:
+                return dict(row)
+            # It was claimed in between; queue a fresh one
+            return await submit_job(kind, payload, dedupe_key)
+
+    job_stats["submitted"] += 1
+    if _wakeup is not None:
+        _wakeup.set()
+    return dict(row)
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "get_job") as conn:
+        row = await conn.fetchrow("""
+            SELECT job_id, kind, payload, status, attempts, result, error,
+                   created_at, started_at, finished_at
+            FROM wine_jobs
+            WHERE job_id = $1
+        """, job_id)
+    return _job_dict(row) if row is not None else None
+
+async def _claim_job() -> Optional[Dict[str, Any]]:
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "claim_job") as conn:
+        expired = await conn.execute(EXPIRE_JOBS, JOBS_MAX_ATTEMPTS)
+        job_stats["expired"] += int(expired.split()[-1])
+        row = await conn.fetchrow(CLAIM_JOB, JOBS_LEASE_SECONDS, JOBS_MAX_ATTEMPTS)
+    return _job_dict(row) if row is not None else None
+
+def _updated(status: str) -> bool:
+    return status.split()[-1] != "0"
+
+def _lease_lost(job: Dict[str, Any]) -> None:
+    job_stats["leases_lost"] += 1
+    logging.warning(f"Job {job['job_id']} attempt {job['attempts']} lost its lease; not recording its outcome")
+
+async def _renew_lease(job: Dict[str, Any]) -> bool:
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "renew_job_lease") as conn:
+        status = await conn.execute("""
+            UPDATE wine_jobs
+            SET locked_until = now() + make_interval(secs => $3)
+            WHERE job_id = $1 AND status = 'running' AND attempts = $2
+        """, job["job_id"], job["attempts"], JOBS_LEASE_SECONDS)
+    return _updated(status)
+
+async def _heartbeat(job: Dict[str, Any], handler: asyncio.Task) -> None:
+    """Keep the job's lease while handler runs; cancel handler once another worker owns the job."""
+    while True:
+        await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+        try:
+            renewed = await _renew_lease(job)
+        except Exception as e:
+            # Tried again on the next beat, well before the lease runs out
+            job_stats["errors"] += 1
+            logging.error(f"Failed to renew the lease of job {job['job_id']}: {str(e)}")
+            continue
+        if not renewed:
+            _lease_lost(job)
+            handler.cancel()
+            return
+
+async def _finish_job(job: Dict[str, Any], result: Any) -> None:
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "finish_job") as conn:
+        status = await conn.execute("""
+            UPDATE wine_jobs
+            SET status = 'succeeded', result = $3, error = NULL, finished_at = now(), locked_until = NULL
+            WHERE job_id = $1 AND status = 'running' AND attempts = $2
+        """, job["job_id"], job["attempts"], json.dumps(result, default=str))
+    if not _updated(status):
+        _lease_lost(job)
+        return
+    job_stats["succeeded"] += 1
+
+async def _fail_job(job: Dict[str, Any], error: str) -> None:
+    retry = job["attempts"] < JOBS_MAX_ATTEMPTS
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "fail_job") as conn:
+        if retry:
+            try:
+                status = await conn.execute("""
+                    UPDATE wine_jobs
+                    SET status = 'queued', error = $3, locked_until = NULL,
+                        run_after = now() + make_interval(secs => $4)
+                    WHERE job_id = $1 AND status = 'running' AND attempts = $2
+                """, job["job_id"], job["attempts"], error, JOBS_RETRY_DELAY * 2 ** (job["attempts"] - 1))
+            except asyncpg.UniqueViolationError:
+                # An equivalent job is already waiting and does the work instead
+                retry = False
+        if not retry:
+            status = await conn.execute("""
+                UPDATE wine_jobs
+                SET status = 'failed', error = $3, finished_at = now(), locked_until = NULL
+                WHERE job_id = $1 AND status = 'running' AND attempts = $2
+            """, job["job_id"], job["attempts"], error)
+    if not _updated(status):
+        _lease_lost(job)
+        return
+    job_stats["retried" if retry else "failed"] += 1
+
+async def _run_job(job: Dict[str, Any]) -> None:
+    job_stats["started"] += 1
+    handler = JOB_HANDLERS.get(job["kind"])
+    if handler is None:
+        # Submitted by a worker running newer code; retried in case one of those claims it
+        await _fail_job(job, f"Unknown job kind: {job['kind']}")
+        return
+    run = asyncio.create_task(handler(job["payload"]))
+    heartbeat = asyncio.create_task(_heartbeat(job, run))
+    try:
+        result = await run
+    except asyncio.CancelledError:
+        if heartbeat.done() and not heartbeat.cancelled():
+            # Another worker took the job over
+            return
+        raise
+    except Exception as e:
+        logging.error(f"Job {job['job_id']} ({job['kind']}) failed: {str(e)}")
+        await _fail_job(job, str(e))
+        return
+    finally:
+        heartbeat.cancel()
+    await _finish_job(job, result)
+
+async def _worker() -> None:
+    while True:
+        # Cleared before looking, so a job submitted meanwhile still wakes this worker
+        _wakeup.clear()
+        try:
+            job = await _claim_job()
+        except Exception as e:
+            job_stats["errors"] += 1
+            logging.error(f"Failed to claim a job: {str(e)}")
+            job = None
+
+        if job is not None:
+            try:
+                await _run_job(job)
+            except Exception as e:
+                # Storing the outcome failed; the lease runs out and the job is run again
+                job_stats["errors"] += 1
+                logging.error(f"Failed to record the outcome of job {job['job_id']}: {str(e)}")
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOBS_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def ensure_job_schema() -> None:
+    """Create the jobs table if needed and drop finished jobs past their retention."""
+    pool = await get_db_connection()
+    async with acquire_connection(pool, "ensure_job_schema") as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wine_jobs'))")
+            await conn.execute(JOB_SCHEMA)
+        deleted = await conn.execute(
+            "DELETE FROM wine_jobs WHERE finished_at < now() - make_interval(secs => $1)",
+            JOBS_RETENTION_SECONDS
+        )
+        logging.info(f"Job queue ready ({deleted.split()[-1]} finished jobs removed)")
+
+def start_job_workers() -> None:
+    global _wakeup
+    if not JOBS_ENABLED or _workers:
+        return
+    _wakeup = asyncio.Event()
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(JOBS_WORKERS))
+
+async def stop_job_workers() -> None:
+    # A job interrupted here keeps its lease and is run again once the lease runs out
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+async def get_job_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {
+        **job_stats,
+        "workers": len(_workers),
+        "kinds": sorted(JOB_HANDLERS),
+    }
+    try:
+        pool = await get_db_connection()
+        async with acquire_connection(pool, "job_stats") as conn:
+            rows = await conn.fetch("SELECT status, COUNT(*) AS jobs FROM wine_jobs GROUP BY status")
+        stats["queue"] = {row["status"]: row["jobs"] for row in rows}
+    except Exception as e:
+        logging.error(f"Failed to read job counts: {str(e)}")
+        stats["queue"] = None
+    return stats
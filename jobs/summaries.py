@@ -0,0 +1,63 @@
+import logging
+from os import getenv
+from typing import Any, Dict, List
+from database_connection import get_read_connection, fetch_statement
+from database_connection.metrics import acquire_connection
+from groq_summary.batch import summarize_wines
+from .queue import register_job, submit_job
+
+# AI summaries as background jobs: summaries requested by a client, and precomputing the
+# summaries of wines that have none yet so users rarely wait for a cold one.
+#
+# Precomputation pages through wine_table by id, AI_SUMMARY_PRECOMPUTE_BATCH wines per
+# job; each job queues the next page, so none of them holds its lease for long.
+PRECOMPUTE_ON_STARTUP = getenv("AI_SUMMARY_PRECOMPUTE", "false").lower() == "true"
+PRECOMPUTE_BATCH = int(getenv("AI_SUMMARY_PRECOMPUTE_BATCH", "200"))
+
+AISUMMARIES_JOB = "aisummaries"
+PRECOMPUTE_JOB = "precompute_aisummaries"
+
+async def _summaries_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    summaries = [result async for result in summarize_wines(payload["wines"])]
+    return {"summaries": summaries}
+
+async def _precompute_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    after_id = payload.get("after_id", 0)
+    pool = await get_read_connection()
+    async with acquire_connection(pool, "wines_missing_aisummary") as conn:
+        rows = await fetch_statement(conn, "wines_missing_aisummary", after_id, PRECOMPUTE_BATCH)
+
+    wines: List[Dict[str, str]] = [
+        {"wine_id": str(row["id"]), "wine_name": row["name"], "wine_producer": row["producer"]}
+        for row in rows
+    ]
+    generated = cached = failed = 0
+    # A summary cached for another spelling or owner still has to be stored for these wines,
+    # or they stay missing and are looked up again on every run
+    async for result in summarize_wines(wines, store_cached=True):
+        if "error" in result:
+            failed += 1
+        elif result["cached"]:
+            cached += 1
+        else:
+            generated += 1
+
+    next_after_id = rows[-1]["id"] if len(rows) == PRECOMPUTE_BATCH else None
+    if next_after_id is not None:
+        await submit_job(PRECOMPUTE_JOB, {"after_id": next_after_id}, dedupe_key=PRECOMPUTE_JOB)
+    logging.info(f"Precomputed AI summaries for {len(rows)} wines after id {after_id}: "
+                 f"{generated} generated, {cached} cached, {failed} failed")
+    return {
+        "wines": len(rows),
+        "generated": generated,
+        "cached": cached,
+        "failed": failed,
+        "next_after_id": next_after_id,
+    }
+
+async def submit_precompute() -> Dict[str, Any]:
+    """Queue precomputation of every missing AI summary, unless it is already waiting to run."""
+    return await submit_job(PRECOMPUTE_JOB, {"after_id": 0}, dedupe_key=PRECOMPUTE_JOB)
+
+register_job(AISUMMARIES_JOB, _summaries_job)
+register_job(PRECOMPUTE_JOB, _precompute_job)
@@ -2,12 +2,28 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import logging
 from database_connection import init_db_pool, close_db_pool
+from database_connection.schema import ensure_indexes
+from database_connection.user_stats import start_user_stats_reconciler, stop_user_stats_reconciler
+from chat.sessions import ensure_session_schema
+from database_connection.result_cache import ensure_cache_triggers, start_cache_listener, stop_cache_listener
+from groq_summary.identity import start_identity_loader, stop_identity_loader
+from jobs import PRECOMPUTE_ON_STARTUP, ensure_job_schema, start_job_workers, stop_job_workers, submit_precompute
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     try:
         await init_db_pool()
+        await ensure_indexes()
+        await ensure_cache_triggers()
+        start_cache_listener()
+        start_user_stats_reconciler()
+        await ensure_session_schema()
+        start_identity_loader()
+        await ensure_job_schema()
+        start_job_workers()
+        if PRECOMPUTE_ON_STARTUP:
+            await submit_precompute()
         logging.info("Application startup complete")
     except Exception as e:
         logging.error(f"Startup error: {str(e)}")
@@ -16,6 +32,10 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     try:
+        await stop_job_workers()
+        await stop_identity_loader()
+        await stop_user_stats_reconciler()
+        await stop_cache_listener()
         await close_db_pool()
         logging.info("Application shutdown complete")
     except Exception as e:
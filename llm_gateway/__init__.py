@@ -0,0 +1,5 @@
+from .gateway import LLMOverloaded, llm_slot, call_with_retries, chat_completion, shared_chat_completion, get_gateway_stats
+from .single_flight import single_flight
+
+__all__ = ['LLMOverloaded', 'llm_slot', 'call_with_retries', 'chat_completion', 'shared_chat_completion', 'get_gateway_stats',
+           'single_flight']
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import math
+import random
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from os import getenv
+from time import perf_counter, time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+import groq
+from fastapi import HTTPException
+from .single_flight import get_single_flight_stats, request_key, single_flight
+
+# Admission control shared by every LLM call in the app. Each provider/model pair gets a
+# lane: a semaphore capping concurrent calls and a bounded queue in front of it. Callers
+# that can't get a slot within LLM_QUEUE_TIMEOUT, or find the queue full, get a 503 with
+# Retry-After instead of piling more load onto a provider that is already rate limiting.
+
+def _parse_limits(value: str) -> Dict[Tuple[str, str], int]:
+    # "groq:llama-3.1-8b-instant=16,groq:openai/gpt-oss-20b=4"
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        try:
+            lane, limit = item.rsplit("=", 1)
+            provider, model = lane.split(":", 1)
+            limits[(provider, model)] = int(limit)
+        except ValueError:
+            logging.warning(f"Ignoring malformed LLM_CONCURRENCY_LIMITS entry: {item}")
+    return limits
+
+DEFAULT_CONCURRENCY = int(getenv("LLM_MAX_CONCURRENCY", "8"))
+CONCURRENCY_LIMITS = _parse_limits(getenv("LLM_CONCURRENCY_LIMITS", ""))
+MAX_QUEUE = int(getenv("LLM_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(getenv("LLM_QUEUE_TIMEOUT", "10"))
+MAX_RETRIES = int(getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+# A Retry-After longer than this is passed on to the client instead of waited out
+RETRY_MAX_DELAY = float(getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+# Transient provider failures worth another attempt
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+class LLMOverloaded(HTTPException):
+    """The AI service is saturated; surfaces as 503 with a Retry-After header."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        self.retry_after = retry_after
+
+# (provider, model) -> lane state and counters
+_lanes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+def _lane(provider: str, model: str) -> Dict[str, Any]:
+    key = (provider, model)
+    lane = _lanes.get(key)
+    if lane is None:
+        limit = CONCURRENCY_LIMITS.get(key, DEFAULT_CONCURRENCY)
+        lane = _lanes[key] = {
+            "semaphore": asyncio.Semaphore(limit),
+            "limit": limit,
+            "in_flight": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "admitted": 0,
+            "rejected": 0,
+            "queue_timeouts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "wait_count": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+    return lane
+
+@asynccontextmanager
+async def llm_slot(provider: str, model: str) -> AsyncIterator[None]:
+    """Hold one of the lane's concurrency slots, queueing for at most LLM_QUEUE_TIMEOUT."""
+    lane = _lane(provider, model)
+    semaphore = lane["semaphore"]
+    start = perf_counter()
+    if not semaphore.locked():
+        # A free slot is taken without yielding to the event loop
+        await semaphore.acquire()
+    else:
+        if lane["waiting"] >= MAX_QUEUE:
+            lane["rejected"] += 1
+            raise LLMOverloaded("AI service is busy, please try again shortly", QUEUE_TIMEOUT)
+
+        lane["waiting"] += 1
+        lane["max_waiting"] = max(lane["max_waiting"], lane["waiting"])
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            lane["queue_timeouts"] += 1
+            raise LLMOverloaded("AI service is busy, please try again shortly", QUEUE_TIMEOUT)
+        finally:
+            lane["waiting"] -= 1
+
+    wait_ms = (perf_counter() - start) * 1000
+    lane["admitted"] += 1
+    lane["wait_count"] += 1
+    lane["wait_total_ms"] += wait_ms
+    lane["wait_max_ms"] = max(lane["wait_max_ms"], wait_ms)
+    lane["in_flight"] += 1
+    try:
+        yield
+    finally:
+        lane["in_flight"] -= 1
+        lane["semaphore"].release()
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+async def call_with_retries(provider: str, model: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run call(), retrying transient provider errors. Waits what Retry-After asks for, else
+    backs off exponentially, plus jitter so queued callers don't retry in lockstep.
+    """
+    lane = _lane(provider, model)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await call()
+        except RETRYABLE_ERRORS as e:
+            rate_limited = isinstance(e, groq.RateLimitError)
+            if rate_limited:
+                lane["rate_limited"] += 1
+            retry_after = _retry_after(e)
+            delay = retry_after if retry_after is not None else RETRY_BASE_DELAY * 2 ** attempt
+
+            if attempt == MAX_RETRIES or delay > RETRY_MAX_DELAY:
+                lane["failures"] += 1
+                if rate_limited:
+                    raise LLMOverloaded("AI service is rate limited, please try again shortly", delay)
+                raise
+
+            delay += random.uniform(0, min(delay, 1.0))
+            lane["retries"] += 1
+            logging.warning(
+                f"{provider}:{model} call failed ({type(e).__name__}), "
+                f"retry {attempt + 1}/{MAX_RETRIES} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+async def chat_completion(client, provider: str = "groq", **kwargs) -> Any:
+    """client.chat.completions.create(**kwargs) under admission control and retries."""
+    model = kwargs["model"]
+    async with llm_slot(provider, model):
+        return await call_with_retries(
+            provider, model, lambda: client.chat.completions.create(**kwargs)
+        )
+
+async def shared_chat_completion(client, provider: str = "groq", **kwargs) -> Any:
+    """chat_completion(), shared by concurrent callers making the identical request."""
+    return await single_flight(
+        request_key(provider, **kwargs),
+        lambda: chat_completion(client, provider, **kwargs)
+    )
+
+def get_gateway_stats() -> Dict[str, Any]:
+    return {
+        "max_queue": MAX_QUEUE,
+        "queue_timeout_seconds": QUEUE_TIMEOUT,
+        "single_flight": get_single_flight_stats(),
+        "lanes": {
+            f"{provider}:{model}": {
+                **{key: value for key, value in lane.items()
+                   if key not in ("semaphore", "wait_count", "wait_total_ms", "wait_max_ms")},
+                "avg_wait_ms": round(lane["wait_total_ms"] / lane["wait_count"], 2) if lane["wait_count"] else 0.0,
+                "max_wait_ms": round(lane["wait_max_ms"], 2),
+            }
+            for (provider, model), lane in _lanes.items()
+        },
+    }
@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+# Single-flight for identical LLM requests. When several callers ask for the same
+# completion at once (a popular wine opened by many users, a client retrying), the first
+# one makes the call and the others await its result instead of starting their own.
+# Errors reach every waiter. The call is cancelled once every waiter has gone away.
+
+# key -> {"task", "waiters"}
+_flights: Dict[str, Dict[str, Any]] = {}
+
+single_flight_stats: Dict[str, int] = {
+    "calls": 0,
+    "shared": 0,
+    "cancelled": 0,
+}
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+def request_key(provider: str, **kwargs) -> str:
+    """Key of an LLM request; whitespace differences in the prompt don't matter."""
+    request = json.dumps({"provider": provider, **_normalize(kwargs)}, sort_keys=True, default=str)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+def _forget(key: str, flight: Dict[str, Any]) -> None:
+    if _flights.get(key) is flight:
+        del _flights[key]
+
+async def single_flight(key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Result of call(), shared with every concurrent caller using the same key."""
+    flight = _flights.get(key)
+    if flight is None:
+        flight = {"task": asyncio.ensure_future(call()), "waiters": 0}
+        _flights[key] = flight
+        flight["task"].add_done_callback(lambda _: _forget(key, flight))
+        single_flight_stats["calls"] += 1
+    else:
+        single_flight_stats["shared"] += 1
+
+    flight["waiters"] += 1
+    try:
+        # Shielded so one waiter going away doesn't cancel the call for the others
+        return await asyncio.shield(flight["task"])
+    finally:
+        flight["waiters"] -= 1
+        if flight["waiters"] == 0 and not flight["task"].done():
+            # Nobody wants the result anymore; new callers start a fresh call
+            _forget(key, flight)
+            flight["task"].cancel()
+            single_flight_stats["cancelled"] += 1
+
+def get_single_flight_stats() -> Dict[str, Any]:
+    return {
+        **single_flight_stats,
+        "in_flight": len(_flights),
+    }
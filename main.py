@@ -1,15 +1,30 @@
 from time import time
-from fastapi import FastAPI, __version__, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from helpers import verify_token, create_admin_token, verify_admin_token
+from fastapi import FastAPI, __version__, Depends, HTTPException, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
+from helpers import verify_token, decode_token, create_admin_token, verify_admin_token
 from pydantic import BaseModel
-from groq_summary.summary import generate_wine_summary
-from chat.chat import generate_response
+from groq_summary.summary import get_wine_summary
+from groq_summary.cache import get_summary_cache_stats
+from groq_summary.batch import BATCH_MAX_ITEMS, stream_wine_summaries
+from jobs import AISUMMARIES_JOB, submit_job, get_job, get_job_stats, submit_precompute
+from chat.chat import SOMMELIER_MODE, generate_response
+from chat.agents.groq_triage import get_wine_collection_summary
+from chat.agents.groq_tools import get_tool_stats
+from llm_gateway import LLMOverloaded, get_gateway_stats
+from chat.context_cache import invalidate_collection_context, get_context_cache_stats
+from chat.history import get_history_stats
+from chat.fast_path import get_fast_path_stats
+from chat.sessions import create_session, get_session_turns, append_turns, delete_session, get_session_stats
 import logging
 from typing import List, Optional
 import asyncpg
 from os import getenv
-from database_connection import get_db_connection
+from database_connection import get_db_connection, get_read_connection, get_pool_status, fetch_statement, fetchval_statement, get_statement_stats
+from database_connection.metrics import acquire_connection, get_pool_metrics
+from database_connection.streaming import stream_statement_ndjson
+from database_connection.result_cache import cached_result, invalidate_table, get_cache_stats
+from database_connection.user_stats import get_user_stats_stats
+from database_connection.export import EXPORT_TABLES, stream_table_csv
 from lifespan import lifespan
 from init import create_app, get_html_response, read_html_file
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -17,6 +32,8 @@ from datetime import timedelta
 from dotenv import load_dotenv
 from jose import jwt, JWTError
 import asyncio
+import hashlib
+import json
 from sql_execute.execute import execute_sql
 from sql_generate.generate import generate_sql
 
@@ -84,7 +101,7 @@ async def test_db_connection(token: str = Depends(oauth2_scheme)):
         if not pool:
             return {"status": "failed", "message": "Could not establish database connection"}
             
-        async with pool.acquire() as conn:
+        async with acquire_connection(pool, "test_db_connection") as conn:
             tables = await conn.fetch("""
                 SELECT table_name 
                 FROM information_schema.tables 
@@ -101,6 +118,69 @@ async def test_db_connection(token: str = Depends(oauth2_scheme)):
         logging.error(f"Database connection test failed: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+@app.get('/db-pool-status', tags=["Monitoring"])
+async def pool_status(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    return {
+        "status": "success",
+        "pool": get_pool_status()
+    }
+
+@app.get('/db-statement-stats', tags=["Monitoring"])
+async def statement_stats(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    return {
+        "status": "success",
+        "statements": get_statement_stats()
+    }
+
+@app.get('/db-pool-metrics', tags=["Monitoring"])
+async def pool_metrics(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    metrics = get_pool_metrics()
+    try:
+        # Connections held by every worker of this app, to size the pools against the server limit
+        pool = await get_db_connection()
+        async with acquire_connection(pool, "pool_metrics") as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    current_setting('max_connections')::int AS max_connections,
+                    COUNT(*) FILTER (WHERE application_name LIKE 'mywine_fastapi%') AS app_connections,
+                    COUNT(*) AS total_connections
+                FROM pg_stat_activity;
+            """)
+            metrics["server"] = dict(row)
+    except Exception as e:
+        logging.error(f"Failed to read server connection counts: {str(e)}")
+        metrics["server"] = None
+    return {
+        "status": "success",
+        "metrics": metrics
+    }
+
+@app.get('/db-cache-stats', tags=["Monitoring"])
+async def cache_stats(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    return {
+        "status": "success",
+        "cache": get_cache_stats(),
+        "collection_context": get_context_cache_stats(),
+        "chat_history": get_history_stats(),
+        "chat_sessions": get_session_stats(),
+        "chat_fast_path": get_fast_path_stats(),
+        "chat_tools": get_tool_stats(),
+        "user_stats": get_user_stats_stats(),
+        "ai_summaries": get_summary_cache_stats()
+    }
+
+@app.get('/llm-gateway-stats', tags=["Monitoring"])
+async def llm_gateway_stats(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    return {
+        "status": "success",
+        "gateway": get_gateway_stats()
+    }
+
 # AI Summary
 @app.post('/getaisummary', tags=["AI Summary"])
 async def generate_aisummary(
@@ -119,11 +199,12 @@ async def generate_aisummary(
                 detail="Wine name and producer are required"
             )
 
-        # Generate AI summary for the wine
-        logging.info("Calling generate_wine_summary...")
-        summary = await generate_wine_summary(
+        # Served from the summary cache when any user's copy of this wine has one
+        logging.info("Calling get_wine_summary...")
+        summary, cached = await get_wine_summary(
             wine_name=wine_data.wine_name,
-            wine_producer=wine_data.wine_producer
+            wine_producer=wine_data.wine_producer,
+            wine_id=int(wine_data.wine_id) if wine_data.wine_id.isdigit() else None
         )
 
         if not summary:
@@ -136,6 +217,7 @@ async def generate_aisummary(
         logging.info("Successfully generated summary")
         return {
             "message": "AI summary generated successfully",
+            "cached": cached,
             "user_data": token_payload,
             "wine_details": {
                 "id": wine_data.wine_id,
@@ -155,11 +237,98 @@ async def generate_aisummary(
         )
 
 
+@app.post('/getaisummary/batch', tags=["AI Summary"])
+async def generate_aisummary_batch(
+    wines: List[WineRequest],
+    token_payload: dict = Depends(verify_token)
+):
+    """
+    AI summaries for many wines in one call, streamed as NDJSON in the order they finish.
+
+    Each line is {wine_id, name, producer, summary, cached} or, for a wine that failed,
+    {wine_id, name, producer, error, status_code}.
+    """
+    if not wines:
+        raise HTTPException(status_code=400, detail="No wines given")
+    if len(wines) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} wines per batch")
+
+    logging.info(f"Received batch summary request for {len(wines)} wines")
+    return StreamingResponse(
+        stream_wine_summaries([wine.dict() for wine in wines]),
+        media_type="application/x-ndjson"
+    )
+
+
+def _job_owner(token_payload: dict) -> str:
+    """Who a job belongs to: the token's subject, or the token itself when it names none."""
+    subject = token_payload.get("sub") or token_payload.get("user_id")
+    if subject is not None:
+        return f"user:{subject}"
+    claims = json.dumps(token_payload, sort_keys=True, default=str)
+    return f"token:{hashlib.sha256(claims.encode()).hexdigest()}"
+
+@app.post('/getaisummary/jobs', tags=["AI Summary"])
+async def submit_aisummary_job(
+    wines: List[WineRequest],
+    token_payload: dict = Depends(verify_token)
+):
+    """
+    Queue AI summaries for many wines as a background job and return its job_id at once.
+
+    Poll GET /getaisummary/jobs/{job_id}; once it has succeeded, result.summaries holds the
+    same items as the lines of /getaisummary/batch.
+    """
+    if not wines:
+        raise HTTPException(status_code=400, detail="No wines given")
+    if len(wines) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} wines per batch")
+
+    try:
+        job = await submit_job(
+            AISUMMARIES_JOB, {"wines": [wine.dict() for wine in wines], "owner": _job_owner(token_payload)}
+        )
+    except Exception as e:
+        logging.error(f"Failed to queue summary job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to queue summary job")
+    return {"status": "success", **job}
+
+@app.get('/getaisummary/jobs/{job_id}', tags=["AI Summary"])
+async def aisummary_job_status(job_id: str, token_payload: dict = Depends(verify_token)):
+    job = await get_job(job_id)
+    # Someone else's job is reported as missing, so job ids can't be probed
+    if job is None or job["kind"] != AISUMMARIES_JOB or job["payload"].get("owner") != _job_owner(token_payload):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job}
+
+
 # DB Stats Queries:
 
+# List endpoints page by keyset: pass the returned next_after_id as after_id to get the next page.
+# stream=true returns every row after after_id as NDJSON read through a server-side cursor.
+def next_after_id(results: list, limit: Optional[int]) -> Optional[int]:
+    if not limit or len(results) < limit:
+        return None
+    return results[-1]["id"]
+
+# Tables each cached admin view is built from; a write to any of them drops the entry.
+# Cached views load from the primary, whose NOTIFYs drive the invalidation.
+NOTES_TABLES = ("wine_notes", "wine_table", "wine_users")
+USER_STATS_TABLES = ("wine_users", "wine_table", "wine_notes", "wine_aisummaries")
+
+async def fetch_rows(pool, endpoint: str, statement: str, *args) -> List[dict]:
+    async with acquire_connection(pool, endpoint) as conn:
+        results = await fetch_statement(conn, statement, *args)
+        return [dict(row) for row in results]
+
 # DB Stats Query 1
 @app.get('/db-get-wine-notes', tags=["Database Statistics"])
-async def get_wine_notes(token: str = Depends(oauth2_scheme)):
+async def get_wine_notes(
+    token: str = Depends(oauth2_scheme),
+    after_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = False
+):
     payload = verify_admin_token(token)
     # Verify token and check admin role
     if payload.get("role") != "admin":
@@ -167,39 +336,34 @@ async def get_wine_notes(token: str = Depends(oauth2_scheme)):
             status_code=403,
             detail="Not enough permissions"
         )
+
+    if stream:
+        return StreamingResponse(
+            stream_statement_ndjson("wine_notes", after_id, limit),
+            media_type="application/x-ndjson"
+        )
     
     try:
         pool = await get_db_connection()
         if not pool:
             return {"status": "failed", "message": "Could not establish database connection"}
             
-        async with pool.acquire() as conn:
-            try:
-                results = await conn.fetch("""
-                    SELECT 
-                        wn.id,
-                        wn.note_text,
-                        wn.wine_id,
-                        wt.name AS wine_name,
-                        wt.user_id,
-                        wu.username,
-                        wu.email
-                    FROM 
-                        wine_notes wn
-                    JOIN 
-                        wine_table wt ON wn.wine_id = wt.id
-                    JOIN 
-                        wine_users wu ON wt.user_id = wu.id;
-                """)
-                
-                return {
-                    "status": "success",
-                    "message": "Wine notes fetched successfully",
-                    "notes": [dict(row) for row in results]
-                }
-            except asyncpg.PostgresError as e:
-                logging.error(f"PostgreSQL query error: {str(e)}")
-                return {"status": "error", "message": "Database query failed"}
+        try:
+            results = await cached_result(
+                ("wine_notes", after_id, limit),
+                NOTES_TABLES,
+                lambda: fetch_rows(pool, "get_wine_notes", "wine_notes", after_id, limit)
+            )
+            
+            return {
+                "status": "success",
+                "message": "Wine notes fetched successfully",
+                "notes": results,
+                "next_after_id": next_after_id(results, limit)
+            }
+        except asyncpg.PostgresError as e:
+            logging.error(f"PostgreSQL query error: {str(e)}")
+            return {"status": "error", "message": "Database query failed"}
             
     except Exception as e:
         logging.error(f"Database query failed: {str(e)}")
@@ -207,42 +371,40 @@ async def get_wine_notes(token: str = Depends(oauth2_scheme)):
 
 # DB Stats Query 2
 @app.get('/db-get-empty-notes', tags=["Database Statistics"])
-async def get_empty_notes(token: str = Depends(oauth2_scheme)):
+async def get_empty_notes(
+    token: str = Depends(oauth2_scheme),
+    after_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = False
+):
     payload = verify_admin_token(token)
+    if stream:
+        return StreamingResponse(
+            stream_statement_ndjson("empty_notes", after_id, limit),
+            media_type="application/x-ndjson"
+        )
+
     try:
         pool = await get_db_connection()
         if not pool:
             return {"status": "failed", "message": "Could not establish database connection"}
             
-        async with pool.acquire() as conn:
-            try:
-                results = await conn.fetch("""
-                    SELECT 
-                        wn.id,
-                        wn.note_text,
-                        wn.wine_id,
-                        wt.name AS wine_name,
-                        wt.user_id,
-                        wu.username,
-                        wu.email
-                    FROM 
-                        wine_notes wn
-                    JOIN 
-                        wine_table wt ON wn.wine_id = wt.id
-                    JOIN 
-                        wine_users wu ON wt.user_id = wu.id
-                    WHERE 
-                        wn.note_text = '';
-                """)
-                
-                return {
-                    "status": "success",
-                    "message": "Empty note strings fetched successfully",
-                    "notes": [dict(row) for row in results]
-                }
-            except asyncpg.PostgresError as e:
-                logging.error(f"PostgreSQL query error: {str(e)}")
-                return {"status": "error", "message": "Database query failed"}
+        try:
+            results = await cached_result(
+                ("empty_notes", after_id, limit),
+                NOTES_TABLES,
+                lambda: fetch_rows(pool, "get_empty_notes", "empty_notes", after_id, limit)
+            )
+            
+            return {
+                "status": "success",
+                "message": "Empty note strings fetched successfully",
+                "notes": results,
+                "next_after_id": next_after_id(results, limit)
+            }
+        except asyncpg.PostgresError as e:
+            logging.error(f"PostgreSQL query error: {str(e)}")
+            return {"status": "error", "message": "Database query failed"}
             
     except Exception as e:
         logging.error(f"Database query failed: {str(e)}")
@@ -269,38 +431,20 @@ async def get_wines_per_user(token: str = Depends(oauth2_scheme)):
             logging.error("Failed to establish database connection after retries")
             return {"status": "failed", "message": "Could not establish database connection"}
             
-        async with pool.acquire() as conn:
-            try:
-                results = await conn.fetch("""
-                    SELECT
-                        wt.user_id,
-                        wu.username,
-                        wu.email,
-                    COUNT(*) AS wine_entries,
-                    COUNT(wn.id) AS wines_with_notes,
-                    COUNT(was.id) AS wines_with_aisummaries
-                    FROM
-                        wine_table wt
-                    JOIN
-                        wine_users wu ON wt.user_id = wu.id
-                    LEFT JOIN
-                        wine_notes wn ON wt.id = wn.wine_id
-                    LEFT JOIN
-                        wine_aisummaries was ON wt.id = was.wine_id
-                    GROUP BY
-                        GROUPING SETS ((wt.user_id, wu.username, wu.email), ())
-                    ORDER BY
-                    wt.user_id NULLS LAST;
-                """)
-                
-                return {
-                    "status": "success",
-                    "message": "Wines per user fetched successfully",
-                    "wines_per_user": [dict(row) for row in results]
-                }
-            except asyncpg.PostgresError as e:
-                logging.error(f"PostgreSQL query error: {str(e)}")
-                return {"status": "error", "message": "Database query failed"}
+        async def load_wines_per_user():
+            return await fetch_rows(pool, "get_wines_per_user", "wines_per_user")
+            
+        try:
+            results = await cached_result("wines_per_user", USER_STATS_TABLES, load_wines_per_user)
+            
+            return {
+                "status": "success",
+                "message": "Wines per user fetched successfully",
+                "wines_per_user": results
+            }
+        except asyncpg.PostgresError as e:
+            logging.error(f"PostgreSQL query error: {str(e)}")
+            return {"status": "error", "message": "Database query failed"}
             
     except Exception as e:
         logging.error(f"Database query failed: {str(e)}")
@@ -308,8 +452,19 @@ async def get_wines_per_user(token: str = Depends(oauth2_scheme)):
 
 # DB Stats Query 4
 @app.get('/db-get-contact-messages', tags=["Database Statistics"])
-async def get_contact_messages(token: str = Depends(oauth2_scheme)):
+async def get_contact_messages(
+    token: str = Depends(oauth2_scheme),
+    after_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = False
+):
     payload = verify_admin_token(token)
+    if stream:
+        return StreamingResponse(
+            stream_statement_ndjson("contact_messages", after_id, limit),
+            media_type="application/x-ndjson"
+        )
+
     try:
         # Add retries for connection
         max_retries = 3
@@ -317,7 +472,7 @@ async def get_contact_messages(token: str = Depends(oauth2_scheme)):
         pool = None
         
         while retry_count < max_retries and not pool:
-            pool = await get_db_connection()
+            pool = await get_read_connection()
             if not pool:
                 retry_count += 1
                 logging.warning(f"Database connection attempt {retry_count} failed, retrying...")
@@ -327,14 +482,15 @@ async def get_contact_messages(token: str = Depends(oauth2_scheme)):
             logging.error("Failed to establish database connection after retries")
             return {"status": "failed", "message": "Could not establish database connection"}
             
-        async with pool.acquire() as conn:
+        async with acquire_connection(pool, "get_contact_messages") as conn:
             try:
-                results = await conn.fetch("SELECT * FROM wine_contact;")
+                results = await fetch_statement(conn, "contact_messages", after_id, limit)
                 
                 return {
                     "status": "success",
                     "message": "Contact messages fetched successfully",
-                    "messages": [dict(row) for row in results]
+                    "messages": [dict(row) for row in results],
+                    "next_after_id": next_after_id(results, limit)
                 }
             except asyncpg.PostgresError as e:
                 logging.error(f"PostgreSQL query error: {str(e)}")
@@ -344,6 +500,58 @@ async def get_contact_messages(token: str = Depends(oauth2_scheme)):
         logging.error(f"Database query failed: {str(e)}")
         return {"status": "error", "message": "Database connection error"}
 
+# Bulk CSV export straight from COPY
+@app.get('/db-export/{table_name}', tags=["Database Statistics"])
+async def export_table(
+    table_name: str,
+    token: str = Depends(oauth2_scheme),
+    after_id: int = 0,
+    gzip: bool = False
+):
+    payload = verify_admin_token(token)
+    if table_name not in EXPORT_TABLES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown table '{table_name}'. Exportable tables: {', '.join(EXPORT_TABLES)}"
+        )
+
+    filename = f"{table_name}.csv.gz" if gzip else f"{table_name}.csv"
+    return StreamingResponse(
+        stream_table_csv(table_name, after_id, compress=gzip),
+        media_type="application/gzip" if gzip else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Background jobs
+@app.post('/jobs/precompute-aisummaries', tags=["Background Jobs"])
+async def precompute_aisummaries(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    try:
+        job = await submit_precompute()
+    except Exception as e:
+        logging.error(f"Failed to queue summary precomputation: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to queue summary precomputation"
+        )
+    return {"status": "success", **job}
+
+@app.get('/jobs/{job_id}', tags=["Background Jobs"])
+async def job_status(job_id: str, token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job}
+
+@app.get('/job-stats', tags=["Monitoring"])
+async def job_stats(token: str = Depends(oauth2_scheme)):
+    payload = verify_admin_token(token)
+    return {
+        "status": "success",
+        "jobs": await get_job_stats()
+    }
+
 # Generate Admin Token
 @app.post("/token", tags=["Admin Authentication"])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -378,11 +586,59 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     user_id: int
+    # With a session the server keeps the history and the client sends only the new message
+    session_id: Optional[str] = None
     history: List[ChatMessage] = []
 
+async def chat_history(chat_request: ChatRequest) -> List[dict]:
+    """Prior turns, from the session when there is one. Cleaned up later by build_messages."""
+    if chat_request.session_id:
+        turns = await get_session_turns(chat_request.session_id, chat_request.user_id)
+        if turns is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Chat session not found or expired"
+            )
+        return turns
+    return [{"role": turn.role, "content": turn.content} for turn in chat_request.history]
+
+async def record_exchange(chat_request: ChatRequest, reply: str) -> None:
+    if chat_request.session_id:
+        await append_turns(chat_request.session_id, [
+            {"role": "user", "content": chat_request.message},
+            {"role": "assistant", "content": reply}
+        ])
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# How often a non-streaming chat request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Await coro, cancelling it if the client disconnects first. Returns None in that case."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logging.info(f"Client disconnected, cancelling {request.url.path}")
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
 @app.post("/chat", tags=["Chat"])
 async def chat_endpoint(
     chat_request: ChatRequest,
+    request: Request,
     token_payload: dict = Depends(verify_token)
 ) -> JSONResponse:
     try:
@@ -392,27 +648,36 @@ async def chat_endpoint(
                 detail="Message cannot be empty"
             )
         
-        history = [
-            {"role": turn.role, "content": turn.content}
-            for turn in chat_request.history
-            if turn.role in ("user", "assistant") and turn.content.strip()
-        ]
-
-        response_parts = []
-        async for part in generate_response(
-            chat_request.message,
-            chat_request.user_id,
-            history,
-        ):
-            response_parts.append(part)
+        history = await chat_history(chat_request)
+
+        async def collect() -> str:
+            response_parts = []
+            async for part in generate_response(
+                chat_request.message,
+                chat_request.user_id,
+                history,
+            ):
+                response_parts.append(part)
+            return "".join(response_parts)
         
-        complete_response = "".join(response_parts)
+        complete_response = await cancel_on_disconnect(request, collect())
+        if complete_response is not None:
+            await record_exchange(chat_request, complete_response)
         
         return JSONResponse({
             "message": complete_response,
+            "session_id": chat_request.session_id,
             "status": "success"
         })
         
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        logging.error("Chat endpoint error: response timed out")
+        raise HTTPException(
+            status_code=504,
+            detail="Chat response timed out"
+        )
     except Exception as e:
         logging.error(f"Chat endpoint error: {str(e)}")
         raise HTTPException(
@@ -420,6 +685,216 @@ async def chat_endpoint(
             detail=f"Failed to generate chat response: {str(e)}"
         )
 
+# Streams the reply as Server-Sent Events: one "data" event per token, then "done" (or "error")
+@app.post("/chat/stream", tags=["Chat"])
+async def chat_stream_endpoint(
+    chat_request: ChatRequest,
+    token_payload: dict = Depends(verify_token)
+) -> StreamingResponse:
+    if not chat_request.message.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Message cannot be empty"
+        )
+
+    history = await chat_history(chat_request)
+
+    async def events():
+        try:
+            response_parts = []
+            async for token in generate_response(
+                chat_request.message,
+                chat_request.user_id,
+                history,
+            ):
+                response_parts.append(token)
+                yield sse_event({"delta": token})
+            await record_exchange(chat_request, "".join(response_parts))
+            yield sse_event({"status": "success", "session_id": chat_request.session_id}, event="done")
+        except asyncio.TimeoutError:
+            logging.error("Chat stream error: response timed out")
+            yield sse_event({"status": "error", "message": "Chat response timed out"}, event="error")
+        except LLMOverloaded as e:
+            yield sse_event(
+                {"status": "error", "message": e.detail, "retry_after": e.headers["Retry-After"]},
+                event="error"
+            )
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logging.error(f"Chat stream error: {str(e)}")
+            yield sse_event({"status": "error", "message": "Failed to generate chat response"}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Seconds a new socket has to send its auth message when the token isn't in the URL
+WS_AUTH_TIMEOUT = 10.0
+# Close codes in the application range, mirroring HTTP 401 and 404
+WS_UNAUTHORIZED = 4401
+WS_NOT_FOUND = 4404
+
+@app.websocket("/chat/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    user_id: int,
+    session_id: Optional[str] = None,
+    token: Optional[str] = None
+):
+    """
+    Sommelier chat over one socket. Authenticates once, then per turn:
+
+    client: {"type": "message", "content": "..."} or {"type": "cancel"}
+    server: {"type": "delta", "content": "..."}... then {"type": "done"},
+            {"type": "cancelled"} or {"type": "error", "message": "..."}
+
+    The token comes from the query string or a first {"type": "auth", "token": "..."} message.
+    History is kept in a chat session; pass session_id to resume one.
+    """
+    await websocket.accept()
+    try:
+        if token is None:
+            auth = await asyncio.wait_for(websocket.receive_json(), timeout=WS_AUTH_TIMEOUT)
+            token = auth.get("token") if auth.get("type") == "auth" else None
+        token_payload = decode_token(token or "")
+    except WebSocketDisconnect:
+        return
+    except (HTTPException, asyncio.TimeoutError, ValueError, AttributeError):
+        await websocket.close(code=WS_UNAUTHORIZED)
+        return
+
+    if session_id is None:
+        session_id = await create_session(user_id)
+    elif await get_session_turns(session_id, user_id) is None:
+        await websocket.send_json({"type": "error", "message": "Chat session not found or expired"})
+        await websocket.close(code=WS_NOT_FOUND)
+        return
+
+    # Load the collection context now so the first turn doesn't wait for it
+    warmup = None
+    if SOMMELIER_MODE != "tools":
+        warmup = asyncio.create_task(get_wine_collection_summary(user_id))
+    await websocket.send_json({"type": "ready", "session_id": session_id})
+
+    async def run_turn(message: str) -> None:
+        try:
+            history = await get_session_turns(session_id, user_id) or []
+            response_parts = []
+            async for part in generate_response(message, user_id, history):
+                response_parts.append(part)
+                await websocket.send_json({"type": "delta", "content": part})
+            await append_turns(session_id, [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": "".join(response_parts)}
+            ])
+            await websocket.send_json({"type": "done"})
+        except asyncio.TimeoutError:
+            logging.error("Chat socket error: response timed out")
+            await websocket.send_json({"type": "error", "message": "Chat response timed out"})
+        except LLMOverloaded as e:
+            await websocket.send_json({
+                "type": "error",
+                "message": e.detail,
+                "retry_after": e.headers["Retry-After"]
+            })
+        except Exception as e:
+            logging.error(f"Chat socket error: {str(e)}")
+            await websocket.send_json({"type": "error", "message": "Failed to generate chat response"})
+
+    generation: Optional[asyncio.Task] = None
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+                kind = data.get("type")
+            except (ValueError, AttributeError):
+                await websocket.send_json({"type": "error", "message": "Invalid message"})
+                continue
+
+            if kind == "cancel":
+                if generation is not None and not generation.done():
+                    generation.cancel()
+                    await asyncio.gather(generation, return_exceptions=True)
+                    await websocket.send_json({"type": "cancelled"})
+                continue
+
+            if kind != "message":
+                await websocket.send_json({"type": "error", "message": f"Unknown message type: {kind}"})
+                continue
+
+            # The socket may outlive the token it was opened with
+            if token_payload.get("exp") and time() > token_payload["exp"]:
+                await websocket.send_json({"type": "error", "message": "Token has expired"})
+                await websocket.close(code=WS_UNAUTHORIZED)
+                return
+
+            if generation is not None and not generation.done():
+                await websocket.send_json({"type": "error", "message": "A reply is already in progress"})
+                continue
+
+            content = (data.get("content") or "").strip()
+            if not content:
+                await websocket.send_json({"type": "error", "message": "Message cannot be empty"})
+                continue
+
+            generation = asyncio.create_task(run_turn(content))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in (generation, warmup):
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(
+            *(task for task in (generation, warmup) if task is not None),
+            return_exceptions=True
+        )
+
+class ChatSessionCreate(BaseModel):
+    user_id: int
+    # Lets a client that kept its own history move it to the server
+    history: List[ChatMessage] = []
+
+@app.post("/chat/sessions", tags=["Chat"])
+async def create_chat_session(
+    session_request: ChatSessionCreate,
+    token_payload: dict = Depends(verify_token)
+):
+    turns = [
+        {"role": turn.role, "content": turn.content.strip()}
+        for turn in session_request.history
+        if turn.role in ("user", "assistant") and turn.content.strip()
+    ]
+    session_id = await create_session(session_request.user_id, turns)
+    return {"status": "success", "session_id": session_id}
+
+@app.delete("/chat/sessions/{session_id}", tags=["Chat"])
+async def delete_chat_session(
+    session_id: str,
+    user_id: int,
+    token_payload: dict = Depends(verify_token)
+):
+    if await get_session_turns(session_id, user_id) is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Chat session not found or expired"
+        )
+    await delete_session(session_id)
+    return {"status": "success"}
+
+# Lets the frontend drop the sommelier's cached collection context right after an edit
+class ContextInvalidation(BaseModel):
+    user_id: int
+
+@app.post("/chat/context/invalidate", tags=["Chat"])
+async def invalidate_chat_context(
+    invalidation: ContextInvalidation,
+    token_payload: dict = Depends(verify_token)
+):
+    invalidate_collection_context(invalidation.user_id)
+    return {"status": "success"}
+
 # setting Pro user accounts true or false
 
 class ProAccountUpdate(BaseModel):
@@ -442,19 +917,20 @@ async def update_pro_status(
                 detail="Could not establish database connection"
             )
             
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                UPDATE wine_users
-                SET has_proaccount = $1
-                WHERE id = $2
-            """, update_data.has_proaccount, update_data.user_id)
+        async with acquire_connection(pool, "update_pro_status") as conn:
+            updated_id = await fetchval_statement(
+                conn, "update_pro_status", update_data.has_proaccount, update_data.user_id
+            )
             
-            if result == "UPDATE 0":
+            if updated_id is None:
                 raise HTTPException(
                     status_code=404,
                     detail=f"User with ID {update_data.user_id} not found"
                 )
             
+            # The NOTIFY trigger reaches every worker; drop this worker's entries right away
+            invalidate_table("wine_users")
+            
             return JSONResponse({
                 "status": "success",
                 "message": f"Pro account status updated for user {update_data.user_id}",
@@ -483,32 +959,16 @@ async def get_user_list(token: str = Depends(oauth2_scheme)) -> JSONResponse:
                 detail="Could not establish database connection"
             )
             
-        async with pool.acquire() as conn:
-            results = await conn.fetch("""
-                SELECT 
-                    wu.id,
-                    wu.username,
-                    wu.email,
-                    COUNT(wt.id) AS wine_count,
-                    COUNT(DISTINCT wn.wine_id) AS wines_with_notes,
-                    COUNT(DISTINCT was.wine_id) AS wines_with_ai_summary
-                FROM 
-                    wine_users wu
-                LEFT JOIN 
-                    wine_table wt ON wu.id = wt.user_id
-                LEFT JOIN 
-                    wine_notes wn ON wt.id = wn.wine_id
-                LEFT JOIN 
-                    wine_aisummaries was ON wt.id = was.wine_id
-                GROUP BY 
-                    wu.id, wu.username, wu.email;
-            """)
+        async def load_user_list():
+            return await fetch_rows(pool, "get_user_list", "user_list")
             
-            return JSONResponse({
-                "status": "success",
-                "message": "User list fetched successfully",
-                "users": [dict(row) for row in results]
-            })
+        results = await cached_result("user_list", USER_STATS_TABLES, load_user_list)
+            
+        return JSONResponse({
+            "status": "success",
+            "message": "User list fetched successfully",
+            "users": results
+        })
             
     except Exception as e:
         logging.error(f"Failed to fetch user list: {str(e)}")
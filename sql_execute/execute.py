@@ -1,12 +1,23 @@
 import logging
 from typing import Dict, Any, List
 from fastapi import HTTPException
-from database_connection.database_connection import get_db_connection
+import asyncpg
+from time import perf_counter
+from database_connection.database_connection import get_db_connection, get_read_connection
+from database_connection.metrics import acquire_connection, observe_query
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+async def _fetch(pool, sql_query: str) -> List[asyncpg.Record]:
+    async with acquire_connection(pool, "execute_sql") as connection:
+        start = perf_counter()
+        try:
+            return await connection.fetch(sql_query)
+        finally:
+            observe_query((perf_counter() - start) * 1000)
+
 async def execute_sql(sql_query: str) -> Dict[str, List[Dict[str, Any]]]:
     """
     Execute an SQL query and return the results in JSON format.
@@ -21,17 +32,19 @@ async def execute_sql(sql_query: str) -> Dict[str, List[Dict[str, Any]]]:
         HTTPException: If there's an error executing the query
     """
     try:
-        # Get database pool
-        pool = await get_db_connection()
+        # Read-only work goes to the replica when one is available
+        pool = await get_read_connection()
         
-        async with pool.acquire() as connection:
-            # Execute query and fetch results
-            rows = await connection.fetch(sql_query)
-            
-            # Convert rows to list of dictionaries
-            results = [dict(row) for row in rows]
+        try:
+            rows = await _fetch(pool, sql_query)
+        except asyncpg.exceptions.ReadOnlySQLTransactionError:
+            # The statement writes, so it has to run on the primary
+            rows = await _fetch(await get_db_connection(), sql_query)
             
-            return {"result": results}
+        # Convert rows to list of dictionaries
+        results = [dict(row) for row in rows]
+        
+        return {"result": results}
             
     except Exception as e:
         logging.error(f"Error executing SQL query: {str(e)}")
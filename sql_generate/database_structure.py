@@ -80,4 +80,37 @@ RELATIONSHIPS = [
         "type": "one-to-many",
         "via": "wine_id"
     }
-] 
\ No newline at end of file
+]
+
+# Secondary indexes the application's fixed queries depend on (applied by database_connection.schema)
+INDEXES = {
+    "wine_table_user_id_idx": {
+        "table": "wine_table",
+        "columns": ["user_id"],
+        "description": "Collection lookups and per-user stats join wine_table on user_id"
+    },
+    "wine_notes_wine_id_idx": {
+        "table": "wine_notes",
+        "columns": ["wine_id"],
+        "description": "Notes are joined to their wine"
+    },
+    "wine_aisummaries_wine_id_idx": {
+        "table": "wine_aisummaries",
+        "columns": ["wine_id"],
+        "description": "AI summaries are joined to their wine"
+    },
+    "wine_table_name_producer_idx": {
+        "table": "wine_table",
+        "columns": [
+            "lower(regexp_replace(btrim(name), '\\s+', ' ', 'g'))",
+            "lower(regexp_replace(btrim(producer), '\\s+', ' ', 'g'))"
+        ],
+        "description": "The AI summary cache finds wines by normalized name and producer"
+    },
+    "wine_notes_empty_text_idx": {
+        "table": "wine_notes",
+        "columns": ["id"],
+        "where": "note_text = ''",
+        "description": "Keyset pages of empty notes without scanning every note"
+    }
+}
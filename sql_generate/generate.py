@@ -5,6 +5,7 @@ from typing import Dict, Any, Optional
 import logging
 from .database_structure import SCHEMA, RELATIONSHIPS
 from groq import AsyncGroq
+from llm_gateway import LLMOverloaded, shared_chat_completion
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,7 +19,8 @@ if not GROQ_API_KEY:
 
 # Initialize Groq client
 try:
-    client = AsyncGroq(api_key=GROQ_API_KEY)
+    # Retries are handled by the LLM gateway
+    client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
 except Exception as e:
     logger.error(f"Failed to initialize Groq client: {str(e)}")
     raise RuntimeError(f"Failed to initialize Groq client: {str(e)}")
@@ -159,7 +161,8 @@ Respond with one JSON object containing exactly two fields:
 - "explanation": a brief explanation of how the query works"""
 
         # Get completion from Groq
-        chat_completion = await client.chat.completions.create(
+        completion = await shared_chat_completion(
+            client,
             messages=[
                 {
                     "role": "system",
@@ -180,7 +183,7 @@ Respond with one JSON object containing exactly two fields:
             response_format={"type": "json_object"}
         )
 
-        message = chat_completion.choices[0].message
+        message = completion.choices[0].message
         response = message.content
         # Some models put usable text only in refusal / secondary fields
         if not response and getattr(message, "refusal", None):
@@ -194,6 +197,8 @@ Respond with one JSON object containing exactly two fields:
             "raw_response": response
         }
 
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logging.error(f"SQL generation error: {str(e)}; raw_response={response!r}")
         return {
@@ -0,0 +1,54 @@
+from collections import Counter
+from decimal import Decimal
+import pytest
+from chat.fast_path import answer_from_stats_dict
+
+STATS = {
+    "total_bottles": 30,
+    "total_unique_wines": 6,
+    "countries": Counter({"France": 18, "Italy": 12}),
+    "regions": Counter({"Bordeaux": 10, "Burgundy": 8, "Tuscany": 12}),
+    "grapes": Counter({"Pinot Noir": 8, "Sangiovese": 12, "Merlot": 10}),
+    "producers": Counter({"Château Margaux": 10, "Leflaive": 8, "Antinori": 12}),
+    "years": Counter({2015: 10, 2019: 20}),
+    "most_expensive": {"wine": "Château Margaux", "price": Decimal("650"), "producer": "Château Margaux", "year": 2015},
+    "total_value": Decimal("9000"),
+    "value_by_country": {"France": Decimal("7500"), "Italy": Decimal("1500")},
+    "value_by_region": {"Bordeaux": Decimal("6500"), "Burgundy": Decimal("1000"), "Tuscany": Decimal("1500")},
+    "value_by_producer": {"Château Margaux": Decimal("6500"), "Leflaive": Decimal("1000"), "Antinori": Decimal("1500")},
+    "value_by_grape": {"Merlot": Decimal("6500"), "Pinot Noir": Decimal("1000"), "Sangiovese": Decimal("1500")},
+    "average_bottle_value": Decimal("300"),
+}
+
+@pytest.mark.parametrize("message, answer", [
+    ("How many bottles do I have?", "You have 30 bottles in your collection, across 6 different wines."),
+    ("How many different wines are in my cellar?", "Your collection has 6 different wines, 30 bottles in total."),
+    ("What is my collection worth?", "Your collection is worth $9,000.00 (30 bottles)."),
+    ("What's the total value of my wines?", "Your collection is worth $9,000.00 (30 bottles)."),
+    ("What is the value of my French wines?", "Your wines from France are worth $7,500.00 (18 bottles)."),
+    ("How many bottles from Burgundy do I have?", "You have 8 bottles from Burgundy."),
+    ("How much are my Pinot Noir bottles worth?", "Your wines made from Pinot Noir are worth $1,000.00 (8 bottles)."),
+    ("How many bottles of Spanish wine do I have?", "You don't have any wines from Spain in your collection."),
+])
+def test_answers_covered_questions(message, answer):
+    assert answer_from_stats_dict(message, STATS) == answer
+
+@pytest.mark.parametrize("message", [
+    # A wine the stats can't filter on
+    "How many bottles of Barolo do I have?",
+    "What are my Barolo wines worth?",
+    # Vintage and colour
+    "How many bottles of 2015 do I have?",
+    "What is the value of my 2019 Bordeaux wines?",
+    "How many bottles of red wine do I have?",
+    "What are my white wines worth?",
+    # Price questions about a wine or a bottle, not the collection
+    "Is the Sassicaia worth it?",
+    "How much does a bottle of Petrus cost?",
+    "What is the cost of a magnum?",
+    # Judgement rather than a number
+    "Which of my wines should I drink first?",
+    "How many bottles? What are they worth?",
+])
+def test_defers_to_llm(message):
+    assert answer_from_stats_dict(message, STATS) is None